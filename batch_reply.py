@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+
+import requests
+
+# ------------------------------------------------------------------------------
+# Batch API 模式：离线为大量 masked_prompt 生成回复
+# ------------------------------------------------------------------------------
+# 流程：把 (行号, prompt) 写成 JSONL 请求文件 → 上传 (/v1/files, purpose=batch)
+# → 创建 batch (/v1/batches) → 轮询状态 → 下载 output / error 文件 → 按 custom_id 合并回各行。
+# 失败的请求（error 文件中的条目、以及 batch 过期 / 取消后没有结果的请求）组成新的 batch 重试，
+# 最多 max_rounds 轮。
+#
+# custom_id = "row-<行号>-<prompt 的 sha256 前 16 位>"：同一行同一 prompt 每次运行都相同，
+# 合并时同时核对行号和 prompt，结果不会错配到别的行。
+#
+# 返回结果的格式与 remote_engine.RemoteReplyEngine 相同（{"text", "prompt_tokens",
+# "output_tokens", "error"}），可以共用同一个 on_result 回调。可以用 stub_server.py 测试：
+#   python stub_server.py --port 8089 --batch-delay 2 --error-rate 0.05
+#   OPENAI_API_BASE=http://localhost:8089/v1 OPENAI_API_KEY=stub python reply_gpt.py
+
+DEFAULT_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+DEFAULT_REQUESTS_PATH = "gemma27b/batch_requests.jsonl"
+
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def custom_id_for(idx: int, prompt: str) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    return f"row-{idx}-{digest}"
+
+
+def build_batch_requests(prompts: list, model_name: str, system_prompt: str, temperature: float) -> list:
+    """prompts: [(行号, prompt 文本), ...] -> Batch API 请求行（字典）列表"""
+    return [
+        {
+            "custom_id": custom_id_for(idx, prompt),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model_name,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": temperature,
+            },
+        }
+        for idx, prompt in prompts
+    ]
+
+
+def write_jsonl(path: str, lines: list):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def parse_result_line(line: dict) -> dict:
+    """output / error 文件中的一行 -> 与 RemoteReplyEngine 相同格式的结果字典"""
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") == 200 and body.get("choices"):
+        usage = body.get("usage") or {}
+        return {
+            "text": body["choices"][0]["message"]["content"].strip(),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+            "error": None,
+        }
+    error = line.get("error") or body.get("error") or {}
+    message = error.get("message") if isinstance(error, dict) else str(error)
+    return {"text": "", "prompt_tokens": 0, "output_tokens": 0,
+            "error": f"HTTP {response.get('status_code')}: {message}"}
+
+
+class BatchClient:
+    """OpenAI Batch API 的最小封装（文件上传、创建 batch、查询、下载结果）"""
+
+    def __init__(self, api_base: str = None, api_key: str = None, timeout: float = 300.0):
+        self.api_base = (api_base or DEFAULT_API_BASE).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key or os.getenv('OPENAI_API_KEY', '')}"
+
+    def _check(self, resp: requests.Response) -> requests.Response:
+        if resp.status_code != 200:
+            raise RuntimeError(f"Batch API 请求失败 HTTP {resp.status_code}: {resp.text[:300]}")
+        return resp
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            resp = self.session.post(f"{self.api_base}/files", data={"purpose": "batch"},
+                                     files={"file": (os.path.basename(path), f)}, timeout=self.timeout)
+        return self._check(resp).json()["id"]
+
+    def create(self, input_file_id: str, metadata: dict = None) -> dict:
+        resp = self.session.post(f"{self.api_base}/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+            "metadata": metadata or {},
+        }, timeout=self.timeout)
+        return self._check(resp).json()
+
+    def get(self, batch_id: str) -> dict:
+        return self._check(self.session.get(f"{self.api_base}/batches/{batch_id}", timeout=self.timeout)).json()
+
+    def content(self, file_id: str) -> list:
+        if not file_id:
+            return []
+        resp = self._check(self.session.get(f"{self.api_base}/files/{file_id}/content", timeout=self.timeout))
+        return [json.loads(line) for line in resp.text.splitlines() if line.strip()]
+
+
+class BatchReplyRunner:
+    """
+    与 RemoteReplyEngine 用法相同：generate([(行号, prompt), ...], on_result) 返回按顺序的结果列表。
+    requests_path: 请求文件路径，重试轮写到 <base>.retry<N>.jsonl。
+    """
+
+    def __init__(self, model_name: str, system_prompt: str = "You are ChatGPT.", temperature: float = 0.0,
+                 requests_path: str = DEFAULT_REQUESTS_PATH, poll_interval: float = 30.0, max_rounds: int = 3,
+                 api_base: str = None, api_key: str = None):
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.requests_path = requests_path
+        self.poll_interval = poll_interval
+        self.max_rounds = max_rounds
+        self.client = BatchClient(api_base, api_key)
+        self.stats = {"batches": 0, "completed": 0, "failed": 0, "retried": 0}
+
+    def _path_for_round(self, round_no: int) -> str:
+        if round_no == 0:
+            return self.requests_path
+        base, ext = os.path.splitext(self.requests_path)
+        return f"{base}.retry{round_no}{ext}"
+
+    def _wait(self, batch: dict) -> dict:
+        while batch["status"] not in FINAL_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = self.client.get(batch["id"])
+            counts = batch.get("request_counts") or {}
+            print(f"batch {batch['id']}: {batch['status']}，"
+                  f"完成 {counts.get('completed', 0)} / 失败 {counts.get('failed', 0)} / 共 {counts.get('total', 0)}")
+        return batch
+
+    def run_round(self, prompts: list, round_no: int) -> dict:
+        """提交一个 batch 并等待完成，返回 {custom_id: 结果字典}（没有结果的请求不在其中）"""
+        path = self._path_for_round(round_no)
+        write_jsonl(path, build_batch_requests(prompts, self.model_name, self.system_prompt, self.temperature))
+        file_id = self.client.upload(path)
+        batch = self.client.create(file_id, {"source": os.path.basename(path), "round": str(round_no)})
+        self.stats["batches"] += 1
+        print(f"已提交 batch {batch['id']}（{len(prompts)} 条请求，第 {round_no + 1} 轮）: {path}")
+        batch = self._wait(batch)
+        if batch["status"] == "failed":
+            print(f"batch {batch['id']} 整体失败: {batch.get('errors')}")
+        results = {}
+        for line in self.client.content(batch.get("output_file_id")) + self.client.content(batch.get("error_file_id")):
+            results[line.get("custom_id")] = parse_result_line(line)
+        return results
+
+    def generate(self, prompts: list, on_result=None) -> list:
+        by_id = {custom_id_for(idx, prompt): pos for pos, (idx, prompt) in enumerate(prompts)}
+        results = [None] * len(prompts)
+        pending = list(prompts)
+        for round_no in range(self.max_rounds):
+            if not pending:
+                break
+            if round_no > 0:
+                self.stats["retried"] += len(pending)
+                print(f"{len(pending)} 条请求失败，提交重试 batch")
+            round_results = self.run_round(pending, round_no)
+            failed = []
+            for idx, prompt in pending:
+                custom_id = custom_id_for(idx, prompt)
+                result = round_results.get(custom_id)
+                if result is None:
+                    result = {"text": "", "prompt_tokens": 0, "output_tokens": 0, "error": "batch 中没有该请求的结果"}
+                results[by_id[custom_id]] = result
+                if result["error"]:
+                    failed.append((idx, prompt))
+            pending = failed
+
+        for pos, (idx, _) in enumerate(prompts):
+            if results[pos]["error"]:
+                self.stats["failed"] += 1
+            else:
+                self.stats["completed"] += 1
+            if on_result is not None:
+                on_result(idx, results[pos])
+        return results
+
+    def print_stats(self, elapsed: float):
+        s = self.stats
+        print(f"Batch API: 共 {s['batches']} 个 batch，成功 {s['completed']} 条，最终失败 {s['failed']} 条，"
+              f"重试 {s['retried']} 条；耗时 {elapsed:.1f} 秒")
@@ -0,0 +1,164 @@
+import time
+import numpy as np
+import pandas as pd
+
+from local_llm import get_client, ns_to_s
+from prompts import PROMPT_TEMPLATE_8
+from detect_modes import parse_pairs, SpanDetector, PrefixReuseDetector, BatchedDetector, CascadeDetector
+from privacy_accuracy import parse_values, compute_metrics
+from llm_metrics import get_metrics, metrics_path_for
+
+# ------------------------------------------------------------------------------
+# 检测模式对比评测：同一批带标注的邮件，逐个模式测延迟、token 数和 F1
+# ------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------
+# 1) 配置部分
+# ------------------------------------------------------------------------------
+# 第一列为邮件正文；有 "Ground Truth" 列时计算 F1，没有时（如 enron.xlsx）只统计延迟和 token。
+# 默认用 enron.xlsx 对比 prompt eval 开销；比较 F1 时改为 enron_labeled.xlsx
+input_file = "enron.xlsx"
+output_file = "all/bench_detection.xlsx"    # 每个模式的汇总结果
+ground_truth_col = "Ground Truth"
+
+bench_model = "gemma3:1b"
+max_rows = 50
+
+# 要对比的检测模式（名称见下方 build_modes）
+# 对比 prompt eval 开销时可用 ["rewrite", "prefix"]，看 Mean Prompt Tokens / Mean Prompt Eval 两列
+modes_to_run = ["rewrite", "spans", "prefix"]
+
+# 批量模式（rewrite prompt 打包多封邮件）要测的批大小；为空列表时跳过
+batch_sizes_to_run = [1, 2, 4, 8]
+
+# 级联模式：先用小模型，不可靠时升级到大模型；与大模型单独跑全部行对比，None 表示跳过
+cascade_small_model = "gemma3:1b"
+cascade_large_model = "qwen2.5:7b"
+
+
+# ------------------------------------------------------------------------------
+# 2) 各检测模式：统一为 detect(model_name, email_body) -> 结果字典
+# ------------------------------------------------------------------------------
+def generate(model_name: str, prompt: str, **kwargs) -> dict:
+    return get_client().generate(model_name, prompt, **kwargs)
+
+
+def rewrite_detect(model_name: str, email_body: str) -> dict:
+    """原有方式：PROMPT_TEMPLATE_8，让模型改写整封邮件"""
+    return generate(model_name, PROMPT_TEMPLATE_8.format(email_body))
+
+
+def build_modes() -> dict:
+    return {
+        "rewrite": rewrite_detect,
+        "spans": SpanDetector(generate),
+        "prefix": PrefixReuseDetector(generate),
+    }
+
+
+# ------------------------------------------------------------------------------
+# 3) 评测
+# ------------------------------------------------------------------------------
+def load_rows() -> list:
+    """返回 [(行号, 邮件正文, ground truth 列表), ...]"""
+    df = pd.read_excel(input_file, dtype=str)
+    has_ground_truth = ground_truth_col in df.columns
+    n = len(df) if max_rows is None else min(max_rows, len(df))
+    rows = []
+    for idx in range(n):
+        body = df.iloc[idx, 0] if pd.notna(df.iloc[idx, 0]) else ""
+        gt_values = parse_values(df.at[idx, ground_truth_col]) if has_ground_truth else None
+        rows.append((idx, body, gt_values))
+    return rows
+
+
+def summarize(mode_name: str, rows: list, results: list, elapsed: float,
+              model_name: str = bench_model) -> dict:
+    """根据每行的检测结果计算延迟、token 数和 F1 汇总"""
+    latencies, prompt_tokens, output_tokens, prompt_eval_times = [], [], [], []
+    precisions, recalls, f1s = [], [], []
+    for (idx, body, gt_values), result in zip(rows, results):
+        latencies.append(ns_to_s(result.get("total_duration")) - ns_to_s(result.get("load_duration")))
+        prompt_tokens.append(result.get("prompt_eval_count", 0))
+        output_tokens.append(result.get("eval_count", 0))
+        prompt_eval_times.append(ns_to_s(result.get("prompt_eval_duration")))
+
+        if gt_values is None:
+            continue
+        pred_values = [value for _, value in parse_pairs(result["text"])]
+        precision, recall, f1 = compute_metrics(gt_values, pred_values)
+        precisions.append(precision)
+        recalls.append(recall)
+        f1s.append(f1)
+
+    summary = {
+        "Mode": mode_name,
+        "Model": model_name,
+        "Rows": len(rows),
+        "Rows/sec": len(rows) / elapsed if elapsed > 0 else 0.0,
+        "Mean Latency (s)": float(np.mean(latencies)) if latencies else 0.0,
+        "P50 Latency (s)": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "P95 Latency (s)": float(np.percentile(latencies, 95)) if latencies else 0.0,
+        "Mean Prompt Tokens": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+        "Mean Prompt Eval (s)": float(np.mean(prompt_eval_times)) if prompt_eval_times else 0.0,
+        "Mean Output Tokens": float(np.mean(output_tokens)) if output_tokens else 0.0,
+        "Macro Precision": float(np.mean(precisions)) if precisions else float("nan"),
+        "Macro Recall": float(np.mean(recalls)) if recalls else float("nan"),
+        "Macro F1": float(np.mean(f1s)) if f1s else float("nan"),
+        "Total Latency (s)": float(np.sum(latencies)),
+    }
+    print(f"[{mode_name}] {len(rows)} 行，{summary['Rows/sec']:.2f} 行/秒，"
+          f"平均延迟 {summary['Mean Latency (s)']:.2f} 秒，"
+          f"平均输出 token {summary['Mean Output Tokens']:.0f}，Macro F1 {summary['Macro F1']:.3f}")
+    return summary
+
+
+def evaluate_mode(mode_name: str, detect_fn, rows: list, model_name: str = bench_model) -> dict:
+    start = time.time()
+    results = [detect_fn(model_name, body) for _, body, _ in rows]
+    return summarize(mode_name, rows, results, time.time() - start, model_name)
+
+
+def evaluate_batched(batch_size: int, rows: list) -> dict:
+    """按 batch_size 把邮件打包成一个请求，顺序发出，比较吞吐量和 F1"""
+    detector = BatchedDetector(generate, rewrite_detect, batch_size)
+    start = time.time()
+    results = []
+    for i in range(0, len(rows), batch_size):
+        bodies = [body for _, body, _ in rows[i:i + batch_size]]
+        results.extend(detector.detect_batch(bench_model, bodies))
+    summary = summarize(f"batch={batch_size}", rows, results, time.time() - start)
+    summary["Requeried Rows"] = detector.requeried
+    return summary
+
+
+def evaluate_cascade(rows: list) -> list:
+    """大模型单独跑全部行 vs 级联（小模型 + 按需升级），比较端到端推理耗时和 F1"""
+    large_only = evaluate_mode("large-only", rewrite_detect, rows, cascade_large_model)
+    cascade = CascadeDetector(rewrite_detect, cascade_small_model)
+    summary = evaluate_mode(f"cascade({cascade_small_model})", cascade, rows, cascade_large_model)
+    summary["Escalation Rate"] = cascade.escalation_rate()
+    summary["Latency Saved (s)"] = large_only["Total Latency (s)"] - summary["Total Latency (s)"]
+    print(f"[cascade] 升级率 {summary['Escalation Rate']:.1%}，升级原因 {cascade.reason_counts}，"
+          f"相对大模型单独运行节省推理时间 {summary['Latency Saved (s)']:.2f} 秒")
+    return [large_only, summary]
+
+
+def main():
+    rows = load_rows()
+    modes = build_modes()
+    results = [evaluate_mode(name, modes[name], rows) for name in modes_to_run]
+    results += [evaluate_batched(size, rows) for size in batch_sizes_to_run]
+    if cascade_small_model and cascade_large_model:
+        results += evaluate_cascade(rows)
+
+    results_df = pd.DataFrame(results)
+    results_df.to_excel(output_file, index=False)
+    print(results_df.to_string(index=False))
+    print(f"评测结果已保存到: {output_file}")
+    get_metrics().print_summary()
+    get_metrics().write_report(metrics_path_for(output_file), {"script": "bench_detection.py", "rows": len(rows)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import re
+import time
+import random
+import pandas as pd
+
+from mask_engine import Masker, sequential_replace
+
+# ------------------------------------------------------------------------------
+# 遮盖引擎评测：逐个 str.replace（原做法） vs mask_engine.Masker
+# ------------------------------------------------------------------------------
+# 每行从正文里抽取若干大写词/数字串作为"敏感值"（模拟检测结果），
+# 比较两种做法在不同敏感值个数下的耗时（含每行建 Masker 的时间），并统计输出不同的行数
+# （差异来自原做法的子串覆盖问题，例如 "John" 改写了 "Johnson"）。
+# Masker 在敏感值少于 SEQUENTIAL_MAX_PATTERNS 时也是逐个替换，检查不通过的行才按位置精确遮盖。
+
+# ------------------------------------------------------------------------------
+# 1) 配置部分
+# ------------------------------------------------------------------------------
+input_file = "enron.xlsx"
+output_file = "all/bench_masking.xlsx"
+pairs_per_row = [5, 20, 100, 400]   # 每行的敏感值个数
+synthetic_pairs = [1000, 5000]      # 另测：一段长文本（约 7 万字符）配大量敏感值
+repeat = 3                           # 每种设置重复次数，取最快一次
+seed = 0
+
+_CANDIDATE = re.compile(r"\b(?:[A-Z][A-Za-z'\-]+(?:\s[A-Z][A-Za-z'\-]+)?|\d[\d\-,.]{2,})")
+
+
+def load_bodies() -> list:
+    df = pd.read_excel(input_file, dtype=str)
+    return [body for body in df.iloc[:, 0] if isinstance(body, str) and body.strip()]
+
+
+def sample_pairs(body: str, n: int, rng: random.Random) -> dict:
+    """从正文中取最多 n 个不同的候选值，占位符格式与 mask_prompt.py 相同；不足 n 个时补随机词"""
+    candidates = list(dict.fromkeys(_CANDIDATE.findall(body)))
+    rng.shuffle(candidates)
+    values = candidates[:n]
+    words = body.split()
+    while len(values) < n and words:
+        values.append(rng.choice(words))
+    values = list(dict.fromkeys(values))
+    return {value: f"[name_{i}]" for i, value in enumerate(values, 1)}
+
+
+def synthetic_rows(n: int, rng: random.Random) -> list:
+    """随机单词组成的长文本，敏感值为其中 n 个不同的单词（包含互为前缀的词）"""
+    letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    words = list(dict.fromkeys("".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+                               for _ in range(4 * n)))
+    text = " ".join(rng.choice(words) for _ in range(10000))
+    return [(text, {word: f"[name_{i}]" for i, word in enumerate(words[:n], 1)})]
+
+
+def time_it(fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    bodies = load_bodies()
+    rng = random.Random(seed)
+    results = []
+    settings = [(f"{n}/row", [(body, sample_pairs(body, n, rng)) for body in bodies]) for n in pairs_per_row]
+    settings += [(f"{n} synthetic", synthetic_rows(n, rng)) for n in synthetic_pairs]
+    for name, rows in settings:
+        mean_pairs = sum(len(pairs) for _, pairs in rows) / len(rows)
+
+        loop_time = time_it(lambda: [sequential_replace(body, pairs) for body, pairs in rows])
+        engine_time = time_it(lambda: [Masker(pairs).mask(body) for body, pairs in rows])
+        differing = sum(sequential_replace(body, pairs) != Masker(pairs).mask(body) for body, pairs in rows)
+
+        results.append({
+            "Setting": name,
+            "Mean Pairs": mean_pairs,
+            "Rows": len(rows),
+            "Replace Loop (ms)": loop_time * 1000,
+            "Masker (ms)": engine_time * 1000,
+            "Speedup": loop_time / engine_time if engine_time > 0 else float("nan"),
+            "Rows Differing": differing,
+        })
+        print(f"[{name}] 逐个替换 {loop_time * 1000:.1f} ms，Masker {engine_time * 1000:.1f} ms，"
+              f"输出不同的行 {differing}")
+
+    results_df = pd.DataFrame(results)
+    results_df.to_excel(output_file, index=False)
+    print(results_df.to_string(index=False))
+    print(f"评测结果已保存到: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
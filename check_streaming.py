@@ -0,0 +1,106 @@
+import os
+import json
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.styles import Font
+
+from mask_prompt import (process_restore_excel, process_restore_excel_streaming,
+                         process_restore_excel_consistent, process_restore_excel_consistent_streaming,
+                         col_json, col_result, col_canonical, col_canonical_map)
+from restore import restore_reply, restore_reply_streaming, col_reply_mask, col_restored
+
+# ------------------------------------------------------------------------------
+# 流式模式与 DataFrame 模式的一致性检查
+# ------------------------------------------------------------------------------
+# 在输入表中间插入一行空行、表尾追加几行只有格式没有内容的空行（只读模式会返回这些行，
+# pandas.read_excel 会去掉表尾的空行），分别用 DataFrame 模式和流式模式（单进程 / 多进程）
+# 遮盖与还原、以及两种语料级一致占位符模式，逐格比较新增的列、以及全局 JSON 文件。
+
+# ------------------------------------------------------------------------------
+# 1) 配置部分
+# ------------------------------------------------------------------------------
+input_file = "gemma27b/privacy.xlsx"
+work_dir = "all/check_streaming"
+trailing_blank_rows = 5
+stream_workers = [1, 2]
+chunk_size = 20
+
+
+def with_blank_rows(src: str, dst: str):
+    """复制 src：第 3 行前插入一行空行，表尾追加 trailing_blank_rows 行带格式的空行"""
+    wb = load_workbook(src)
+    ws = wb.active
+    ws.insert_rows(3)
+    last = ws.max_row
+    for row in range(last + 1, last + 1 + trailing_blank_rows):
+        ws.cell(row=row, column=1).font = Font(bold=True)
+    wb.save(dst)
+
+
+def differing_cells(path_a: str, path_b: str, columns: list) -> dict:
+    """{列名: 不同的格数}；行数不同时返回 {"rows": (行数 a, 行数 b)}"""
+    a = pd.read_excel(path_a, dtype=str)
+    b = pd.read_excel(path_b, dtype=str)
+    if len(a) != len(b):
+        return {"rows": (len(a), len(b))}
+    diff = {}
+    for column in columns:
+        count = int((a[column].fillna("nan") != b[column].fillna("nan")).sum())
+        if count:
+            diff[column] = count
+    return diff
+
+
+def main():
+    os.makedirs(work_dir, exist_ok=True)
+    path = lambda name: os.path.join(work_dir, name)
+    failures = 0
+
+    # 1) 遮盖
+    with_blank_rows(input_file, path("input.xlsx"))
+    process_restore_excel(path("input.xlsx"), path("mask_df.xlsx"), path("mask_df.json"))
+    with open(path("mask_df.json"), encoding="utf-8") as f:
+        expected_json = json.load(f)
+    for workers in stream_workers:
+        name = f"mask_stream_{workers}"
+        process_restore_excel_streaming(path("input.xlsx"), path(f"{name}.xlsx"), path(f"{name}.json"),
+                                        workers=workers, chunk_size=chunk_size)
+        diff = differing_cells(path("mask_df.xlsx"), path(f"{name}.xlsx"), [col_json, col_result])
+        with open(path(f"{name}.json"), encoding="utf-8") as f:
+            if json.load(f) != expected_json:
+                diff["global json"] = "不同"
+        failures += bool(diff)
+        print(f"[遮盖，流式 {workers} 进程] {'一致' if not diff else diff}")
+
+    # 2) 语料级一致占位符（每次从空的实体字典开始）
+    outputs = {}
+    for name, process in (("consistent_df", process_restore_excel_consistent),
+                          ("consistent_stream", process_restore_excel_consistent_streaming)):
+        if os.path.exists(path(f"{name}_entities.json")):
+            os.remove(path(f"{name}_entities.json"))
+        process(path("input.xlsx"), path(f"{name}.xlsx"), path(f"{name}.json"), path(f"{name}_entities.json"))
+        with open(path(f"{name}.json"), encoding="utf-8") as f:
+            outputs[name] = json.load(f)
+    diff = differing_cells(path("consistent_df.xlsx"), path("consistent_stream.xlsx"),
+                           [col_json, col_result, col_canonical, col_canonical_map])
+    if outputs["consistent_df"] != outputs["consistent_stream"]:
+        diff["global json"] = "不同"
+    failures += bool(diff)
+    print(f"[语料级一致占位符，流式] {'一致' if not diff else diff}")
+
+    # 3) 还原：用遮盖结果当作远程回复，同样追加表尾空行
+    df = pd.read_excel(path("mask_df.xlsx"))
+    df[col_reply_mask] = df[col_result]
+    df.to_excel(path("reply.xlsx"), index=False)
+    with_blank_rows(path("reply.xlsx"), path("reply_blank.xlsx"))
+    restore_reply(path("reply_blank.xlsx"), path("restore_df.xlsx"))
+    restore_reply_streaming(path("reply_blank.xlsx"), path("restore_stream.xlsx"))
+    diff = differing_cells(path("restore_df.xlsx"), path("restore_stream.xlsx"), [col_restored])
+    failures += bool(diff)
+    print(f"[还原，流式] {'一致' if not diff else diff}")
+
+    print("全部一致。" if not failures else f"{failures} 项不一致。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------------------------------------------------------------
+# 并发检测引擎（asyncio）
+# ------------------------------------------------------------------------------
+# 每个模型维护固定数量的 worker，保证同一模型同时在途的请求数不超过上限；
+# 结果先进入重排缓冲区，按行号顺序回调 on_result，因此写回 DataFrame / 文件
+# 的顺序与串行版本一致。
+#
+# 调度方式：
+#   "interleaved" —— 所有模型同时跑（适合内存足够、多个模型可同时驻留的机器）
+#   "model_major" —— 一个模型跑完全部行再换下一个；当前模型排空时预加载下一个，
+#                    跑完后卸载，多模型实验每个模型只加载一次
+#
+# 注意：Ollama 服务端需要设置 OLLAMA_NUM_PARALLEL 才会真正并行处理同一模型的请求。
+
+SCHEDULES = ("interleaved", "model_major")
+
+
+def _limit_for(concurrency, model_name: str) -> int:
+    """concurrency 可以是统一的整数，也可以是 {模型名: 并发数} 的字典"""
+    if isinstance(concurrency, dict):
+        return max(1, int(concurrency.get(model_name, 1)))
+    return max(1, int(concurrency))
+
+
+class DetectionEngine:
+    """
+    call_fn(model_name, email_body) -> dict   # 同步函数，例如 call_llama_local
+    返回的字典至少包含 "text" 字段。
+
+    preload_fn(model_name) -> dict / unload_fn(model_name) 仅在 model_major 调度下使用，
+    preload_fn 的返回值中的 load_duration 会记入 stats["load_duration"]。
+    """
+
+    def __init__(self, model_list: list, call_fn, concurrency=4, schedule: str = "interleaved",
+                 preload_fn=None, unload_fn=None):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"未知的调度方式: {schedule}，可选 {SCHEDULES}")
+        self.model_list = list(model_list)
+        self.call_fn = call_fn
+        self.limits = {m: _limit_for(concurrency, m) for m in self.model_list}
+        self.schedule = schedule
+        self.preload_fn = preload_fn
+        self.unload_fn = unload_fn
+        self.stats = {}
+
+    async def _worker(self, model_name, row_queue, pending, executor, flush, on_drained):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                idx, body = row_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                on_drained()
+                return
+            try:
+                result = await loop.run_in_executor(executor, self.call_fn, model_name, body)
+            except Exception as e:
+                print(f"第 {idx} 行调用模型 {model_name} 失败: {e}")
+                result = {"model": model_name, "text": "", "error": str(e)}
+            pending[idx] = result
+            self.stats["calls"][model_name] += 1
+            flush()
+
+    def _model_tasks(self, model_name, rows, executor, on_result, on_drained=None):
+        """为一个模型创建 worker 协程；该模型的结果按 rows 顺序交给 on_result"""
+        order = [idx for idx, _ in rows]
+        pending = {}
+        next_pos = [0]
+        drained = [False]
+
+        def flush():
+            while next_pos[0] < len(order) and order[next_pos[0]] in pending:
+                idx = order[next_pos[0]]
+                result = pending.pop(idx)
+                if on_result is not None:
+                    on_result(idx, model_name, result)
+                next_pos[0] += 1
+
+        def drained_once():
+            # 队列里的行全部派发完（只剩在途请求）时触发一次
+            if not drained[0]:
+                drained[0] = True
+                if on_drained is not None:
+                    on_drained()
+
+        row_queue = asyncio.Queue()
+        for item in rows:
+            row_queue.put_nowait(item)
+        return [
+            self._worker(model_name, row_queue, pending, executor, flush, drained_once)
+            for _ in range(self.limits[model_name])
+        ]
+
+    async def _preload(self, executor, model_name):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(executor, self.preload_fn, model_name)
+        except Exception as e:
+            print(f"预加载模型 {model_name} 失败: {e}")
+            return
+        self.stats["load_duration"][model_name] = (result or {}).get("load_duration", 0)
+
+    async def run_async(self, rows: list, on_result=None, is_done=None) -> dict:
+        """
+        rows: [(行号, 邮件正文), ...]，按希望写回的顺序排列。
+        on_result(行号, 模型名, 结果字典)：每个模型内部按 rows 顺序调用。
+        is_done(行号, 模型名) -> bool：返回 True 的 (行, 模型) 会被跳过（断点续跑）。
+        返回统计信息字典。
+        """
+        rows = list(rows)
+        per_model_rows = {
+            m: [(idx, body) for idx, body in rows if not (is_done and is_done(idx, m))]
+            for m in self.model_list
+        }
+        self.stats = {
+            "rows": len(rows),
+            "calls": {m: 0 for m in self.model_list},
+            "load_duration": {},
+            "schedule": self.schedule,
+        }
+
+        total_workers = sum(self.limits.values())
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, total_workers) + 1) as executor:
+            if self.schedule == "interleaved":
+                workers = []
+                for m in self.model_list:
+                    workers += self._model_tasks(m, per_model_rows[m], executor, on_result)
+                await asyncio.gather(*workers)
+            else:
+                models = [m for m in self.model_list if per_model_rows[m]]
+                preload_task = None
+                if models and self.preload_fn is not None:
+                    await self._preload(executor, models[0])
+                for pos, m in enumerate(models):
+                    next_model = models[pos + 1] if pos + 1 < len(models) else None
+
+                    def start_next_preload(next_model=next_model):
+                        nonlocal preload_task
+                        if next_model is not None and self.preload_fn is not None:
+                            preload_task = asyncio.ensure_future(self._preload(executor, next_model))
+
+                    model_start = time.time()
+                    await asyncio.gather(
+                        *self._model_tasks(m, per_model_rows[m], executor, on_result, start_next_preload)
+                    )
+                    print(f"模型 {m} 完成 {len(per_model_rows[m])} 行，用时 {time.time() - model_start:.2f} 秒")
+                    if self.unload_fn is not None:
+                        await asyncio.get_running_loop().run_in_executor(executor, self.unload_fn, m)
+                    if preload_task is not None:
+                        await preload_task
+                        preload_task = None
+
+        elapsed = time.time() - start
+        self.stats["elapsed"] = elapsed
+        self.stats["rows_per_sec"] = len(rows) / elapsed if elapsed > 0 else 0.0
+        return self.stats
+
+    def run(self, rows: list, on_result=None, is_done=None) -> dict:
+        return asyncio.run(self.run_async(rows, on_result, is_done))
+
+
+def run_detection(rows: list, model_list: list, call_fn, concurrency=4, on_result=None,
+                  is_done=None, **engine_kwargs) -> dict:
+    """便捷入口：创建引擎并同步运行"""
+    engine = DetectionEngine(model_list, call_fn, concurrency, **engine_kwargs)
+    return engine.run(rows, on_result, is_done)
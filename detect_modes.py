@@ -0,0 +1,511 @@
+import re
+import json
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import rule_detector
+from prompts import (PROMPT_TEMPLATE_SPANS, SPAN_OUTPUT_SCHEMA, PROMPT_8_STATIC_PREFIX,
+                     PROMPT_8_EMAIL_SUFFIX, PROMPT_TEMPLATE_BATCH)
+
+# ------------------------------------------------------------------------------
+# 检测模式（在 privacy_detect_local.py 的模型调用外层组合使用）
+# ------------------------------------------------------------------------------
+
+# 与 mask_prompt.py 相同的 "key": "value" 匹配规则
+PAIR_PATTERN = re.compile(r'"\s*([^"]+)\s*"\s*:\s*"([^"]+)"')
+
+
+def parse_pairs(text: str) -> list:
+    """从模型输出中解析 [(key, value), ...]"""
+    if not isinstance(text, str):
+        return []
+    return [(key.strip(), value) for key, value in PAIR_PATTERN.findall(text)]
+
+
+def merge_pairs(pair_lists: list, source_text: str = None) -> list:
+    """
+    合并多段结果并按 value 去重（保留第一次出现的 key）。
+    提供 source_text 时，只保留在原文中确实出现的 value。
+    """
+    seen = set()
+    merged = []
+    for pairs in pair_lists:
+        for key, value in pairs:
+            if value in seen:
+                continue
+            if source_text is not None and value not in source_text:
+                continue
+            seen.add(value)
+            merged.append((key, value))
+    return merged
+
+
+def format_pairs(pairs: list) -> str:
+    """[(key, value), ...] -> 每行一个 "key": "value"；为空时返回 "None" """
+    if not pairs:
+        return "None"
+    return "\n".join(f'"{key}": "{value}"' for key, value in pairs)
+
+
+# ------------------------------------------------------------------------------
+# 1) 长邮件分块：按句子切成有上限的窗口，窗口并发检测后合并
+# ------------------------------------------------------------------------------
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text: str) -> list:
+    return [s for s in _SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+
+
+def sentence_windows(text: str, max_chars: int = 1500, overlap: int = 1) -> list:
+    """
+    把文本切成若干窗口，每个窗口由连续句子组成且不超过 max_chars；
+    相邻窗口重叠 overlap 个句子，避免跨句的人名/地址被切断。
+    单句超长时按空白处硬切。
+    """
+    sentences = []
+    for sentence in split_sentences(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            sentences.append(sentence)
+
+    windows = []
+    current = []
+    size = 0
+    for sentence in sentences:
+        if current and size + len(sentence) + 1 > max_chars:
+            windows.append(" ".join(current))
+            current = current[-overlap:] if overlap > 0 else []
+            size = sum(len(s) + 1 for s in current)
+            # 重叠部分加上新句子仍超长时，放弃重叠
+            if size + len(sentence) + 1 > max_chars:
+                current, size = [], 0
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current:
+        windows.append(" ".join(current))
+    return windows
+
+
+class ChunkedDetector:
+    """
+    包装 call_fn(model_name, email_body) -> dict。
+    正文不超过 max_chars 时直接调用；否则切成句子窗口并发检测，
+    输出合并去重后的 "key": "value" 列表（mask_prompt.py 可直接解析）。
+    max_parallel 是单封邮件同时检测的窗口数：每封长邮件用自己的线程池，
+    引擎同时处理多封长邮件时互不排队。
+    结果中的 total_duration 取各窗口的最大值（并发时的关键路径），token 数为各窗口之和。
+    """
+
+    def __init__(self, call_fn, max_chars: int = 1500, max_parallel: int = 4, overlap: int = 1):
+        self.call_fn = call_fn
+        self.max_chars = max_chars
+        self.max_parallel = max_parallel
+        self.overlap = overlap
+        self.chunked_rows = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        if len(email_body) <= self.max_chars:
+            return self.call_fn(model_name, email_body)
+
+        windows = sentence_windows(email_body, self.max_chars, self.overlap)
+        with self._lock:
+            self.chunked_rows += 1
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(windows))) as executor:
+            results = list(executor.map(lambda w: self.call_fn(model_name, w), windows))
+
+        merged = merge_pairs([parse_pairs(r["text"]) for r in results], source_text=email_body)
+        combined = {"model": model_name, "text": format_pairs(merged), "chunks": len(windows)}
+        for field in ("prompt_eval_count", "eval_count"):
+            combined[field] = sum(r.get(field, 0) or 0 for r in results)
+        for field in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration"):
+            combined[field] = max((r.get(field, 0) or 0) for r in results)
+        errors = [r["error"] for r in results if r.get("error")]
+        if errors:
+            combined["error"] = "; ".join(errors)
+        return combined
+
+
+# ------------------------------------------------------------------------------
+# 2) 流式检测：边生成边解析 "key": "value"，模型回答 None 时提前终止
+# ------------------------------------------------------------------------------
+# "None" 之后允许出现的字符：引号、标点、空白
+NONE_TRAILING = re.compile(r"""["'.,;:!?\s]*""")
+
+
+class StreamingPairParser:
+    """
+    增量解析器：每次 feed 一段新生成的文本，返回这段文本让其"闭合"的 (key, value) 对。
+    value 的右引号一到达，这一对就不会再变化，可以立刻交给下游。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        pairs = []
+        for m in PAIR_PATTERN.finditer(self.buffer, self._pos):
+            pairs.append((m.group(1).strip(), m.group(2)))
+            self._pos = m.end()
+        return pairs
+
+    def answered_none(self) -> bool:
+        """
+        模型的整个回答是否就是 None（PROMPT_TEMPLATE_8 中约定没有敏感信息时返回 "None"）：
+        "None" 之后到换行为止只能有引号、标点和空白，"None of the ..." 这样的句子不算。
+        流在换行前结束时 done 块会带回完整文本，不需要提前终止。
+        """
+        text = self.buffer.lstrip().lstrip('"\'')
+        if not text.startswith("None"):
+            return False
+        rest = text[4:]
+        trailing = NONE_TRAILING.match(rest).group()
+        if len(trailing) < len(rest):
+            return False
+        # 还没等到换行时无法区分 "None" 与 "None of ..."，等下一段
+        return "\n" in trailing
+
+
+class StreamingDetector:
+    """
+    stream_fn(model_name, email_body) -> 迭代 Ollama 流式响应块（例如 generate_stream 的返回值）。
+    on_pair(model_name, email_body, key, value) 在每个 pair 闭合时立即回调，
+    下游（如 mask_prompt.StreamingRowMasker）可以在生成结束前开始遮盖。
+    模型回答 None 时关闭连接提前终止，不再为后续 token 付费。
+    """
+
+    def __init__(self, stream_fn, on_pair=None):
+        self.stream_fn = stream_fn
+        self.on_pair = on_pair
+        self.early_stops = 0
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        parser = StreamingPairParser()
+        start = time.time()
+        first_token_time = None
+        final = {}
+        stream = self.stream_fn(model_name, email_body)
+        early_stop = False
+        try:
+            for chunk in stream:
+                piece = chunk.get("response", "")
+                if piece and first_token_time is None:
+                    first_token_time = time.time() - start
+                for key, value in parser.feed(piece):
+                    if self.on_pair is not None:
+                        self.on_pair(model_name, email_body, key, value)
+                if chunk.get("done"):
+                    final = chunk
+                    break
+                if parser.answered_none():
+                    early_stop = True
+                    break
+        finally:
+            stream.close()
+
+        wall_time = time.time() - start
+        result = {
+            "model": model_name,
+            "text": "None" if early_stop else parser.buffer.strip(),
+            "wall_time": wall_time,
+            "ttft": first_token_time,
+            "early_stop": early_stop,
+        }
+        for field in ("prompt_eval_count", "eval_count", "load_duration",
+                      "prompt_eval_duration", "eval_duration"):
+            result[field] = final.get(field, 0) or 0
+        # 提前终止时服务端不会返回 total_duration，用客户端墙钟时间代替
+        result["total_duration"] = final.get("total_duration") or int(wall_time * 1e9)
+        if early_stop:
+            self.early_stops += 1
+        return result
+
+
+# ------------------------------------------------------------------------------
+# 3) 结构化输出模式：模型只返回 {type, value} 列表，而不是改写整封邮件
+# ------------------------------------------------------------------------------
+def parse_span_output(text: str) -> list:
+    """解析 {"items": [{"type", "value"}, ...]}，返回 [(key, value), ...]；格式不对时返回空列表"""
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    items = data.get("items", []) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return []
+    pairs = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key = str(item.get("type", "")).strip()
+        value = str(item.get("value", "")).strip()
+        # value 中的双引号会破坏 "key": "value" 格式，这类条目丢弃
+        if key and value and '"' not in value and '"' not in key:
+            pairs.append((key, value))
+    return pairs
+
+
+class SpanDetector:
+    """
+    generate_fn(model_name, prompt, **kwargs) -> dict，例如 get_client().generate。
+    使用 SPAN_OUTPUT_SCHEMA 约束输出，解析后转换成 "key": "value" 列表文本，
+    mask_prompt.py 按原来的方式解析即可；原文中不存在的 value 会被丢弃。
+    """
+
+    def __init__(self, generate_fn, template: str = PROMPT_TEMPLATE_SPANS, schema: dict = SPAN_OUTPUT_SCHEMA):
+        self.generate_fn = generate_fn
+        self.template = template
+        self.schema = schema
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        result = self.generate_fn(model_name, self.template.format(email_body), format=self.schema)
+        pairs = merge_pairs([parse_span_output(result["text"])], source_text=email_body)
+        result = dict(result)
+        result["raw_text"] = result["text"]
+        result["text"] = format_pairs(pairs)
+        return result
+
+
+# ------------------------------------------------------------------------------
+# 4) 前缀复用模式：固定的说明和示例放在 system 中，每次只有邮件部分需要 prompt eval
+# ------------------------------------------------------------------------------
+class PrefixReuseDetector:
+    """
+    generate_fn(model_name, prompt, **kwargs) -> dict，例如 get_client().generate。
+    所有请求的 system 完全相同，Ollama 会复用该前缀的 KV cache，
+    返回结果中的 prompt_eval_count / prompt_eval_duration 只包含新计算的部分。
+    """
+
+    def __init__(self, generate_fn, system_prefix: str = PROMPT_8_STATIC_PREFIX,
+                 email_suffix: str = PROMPT_8_EMAIL_SUFFIX):
+        self.generate_fn = generate_fn
+        self.system_prefix = system_prefix
+        self.email_suffix = email_suffix
+
+    @property
+    def cache_template(self) -> str:
+        """用于检测缓存的模板标识，与 rewrite 模式的缓存条目区分开"""
+        return "[system]\n" + self.system_prefix + "[user]\n" + self.email_suffix
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        return self.generate_fn(model_name, self.email_suffix.format(email_body), system=self.system_prefix)
+
+
+# ------------------------------------------------------------------------------
+# 5) 批量模式：N 封邮件放进一个 prompt，按分隔符拆回每行的结果
+# ------------------------------------------------------------------------------
+_BATCH_ANSWER = re.compile(r"<<<EMAIL (\d+)>>>(.*?)<<<END \1>>>", re.DOTALL)
+
+
+def build_batch_prompt(bodies: list, template: str = PROMPT_TEMPLATE_BATCH) -> str:
+    emails = "\n".join(f"<<<EMAIL {i}>>>{body}<<<END {i}>>>" for i, body in enumerate(bodies, 1))
+    return template.format(emails)
+
+
+def split_batch_answer(text: str, n: int) -> list:
+    """按 <<<EMAIL i>>> ... <<<END i>>> 拆分，返回长度为 n 的列表；缺失或重复的编号为 None"""
+    answers = [None] * n
+    seen = set()
+    for m in _BATCH_ANSWER.finditer(text or ""):
+        i = int(m.group(1))
+        if not 1 <= i <= n:
+            continue
+        if i in seen:
+            answers[i - 1] = None  # 同一编号出现多次，无法判断哪个是对的
+            continue
+        seen.add(i)
+        answers[i - 1] = m.group(2).strip()
+    return answers
+
+
+def answer_is_valid(answer, email_body: str) -> bool:
+    """该行答案是否可用：要么是 None，要么至少解析出一个 pair 且 value 都在原文中出现"""
+    if answer is None:
+        return False
+    if answer.strip().strip('"') == "None":
+        return True
+    pairs = parse_pairs(answer)
+    return bool(pairs) and all(value in email_body for _, value in pairs)
+
+
+class BatchedDetector:
+    """
+    generate_fn(model_name, prompt, **kwargs) -> dict；single_fn(model_name, email_body) -> dict 用于单独重查。
+
+    detect_batch(model, bodies) 直接批量检测（评测脚本使用）。
+    作为 call_fn 被检测引擎并发调用时，同一模型的请求先攒到 batch_size 条（或等待 max_wait 秒）
+    再合成一个 prompt 发出。结果中的耗时和 token 数按批内行数平均分摊。
+    """
+
+    def __init__(self, generate_fn, single_fn, batch_size: int = 4, max_wait: float = 0.5,
+                 template: str = PROMPT_TEMPLATE_BATCH):
+        self.generate_fn = generate_fn
+        self.single_fn = single_fn
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.template = template
+        self.batches = 0
+        self.requeried = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def detect_batch(self, model_name: str, bodies: list) -> list:
+        if len(bodies) == 1:
+            return [self.single_fn(model_name, bodies[0])]
+
+        result = self.generate_fn(model_name, build_batch_prompt(bodies, self.template))
+        answers = split_batch_answer(result["text"], len(bodies))
+        n = len(bodies)
+        with self._lock:
+            self.batches += 1
+
+        results = []
+        for body, answer in zip(bodies, answers):
+            if not answer_is_valid(answer, body):
+                # 该行答案缺失或格式不对，单独重查
+                with self._lock:
+                    self.requeried += 1
+                results.append(self.single_fn(model_name, body))
+                continue
+            row_result = {"model": model_name, "text": answer, "batch_size": n}
+            for field in ("prompt_eval_count", "eval_count", "total_duration", "load_duration",
+                          "prompt_eval_duration", "eval_duration"):
+                row_result[field] = (result.get(field, 0) or 0) // n
+            results.append(row_result)
+        return results
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        future = Future()
+        with self._lock:
+            queue_ = self._pending.setdefault(model_name, [])
+            queue_.append((email_body, future))
+            batch = self._take(model_name) if len(queue_) >= self.batch_size else None
+        if batch:
+            self._run(model_name, batch)
+        while True:
+            try:
+                return future.result(timeout=self.max_wait)
+            except FutureTimeoutError:
+                # 等不满一批：把当前积压的请求作为一批发出（可能已被其他线程取走）
+                with self._lock:
+                    batch = self._take(model_name)
+                if batch:
+                    self._run(model_name, batch)
+
+    def _take(self, model_name: str) -> list:
+        batch = self._pending.get(model_name, [])[:self.batch_size]
+        self._pending[model_name] = self._pending.get(model_name, [])[len(batch):]
+        return batch
+
+    def _run(self, model_name: str, batch: list):
+        try:
+            results = self.detect_batch(model_name, [body for body, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+# ------------------------------------------------------------------------------
+# 6) 级联模式：先用小模型检测，答案不可靠时再交给大模型
+# ------------------------------------------------------------------------------
+def escalation_reasons(result: dict, email_body: str, max_unmasked: int = 0) -> list:
+    """
+    用几个低成本信号判断小模型的答案是否可靠，返回需要升级的原因列表（为空表示接受）：
+      "error"        —— 调用失败
+      "unparseable"  —— 既不是 None，也解析不出 "key": "value"
+      "not_in_body"  —— 有 value 不在原文中（模型编造或改写了内容）
+      "unmasked"     —— 去掉检测出的内容后，仍有超过 max_unmasked 个疑似人名/机构名
+                        （连续多个大写词，见 rule_detector.unmasked_proper_nouns）
+      "rule_mismatch"—— 规则检测找到的邮箱/电话/时间等没有被模型覆盖
+    """
+    if result.get("error"):
+        return ["error"]
+    text = (result.get("text") or "").strip()
+    pairs = parse_pairs(text)
+    if not pairs and text.strip('".') != "None":
+        return ["unparseable"]
+
+    reasons = []
+    values = [value for _, value in pairs]
+    if any(value not in email_body for value in values):
+        reasons.append("not_in_body")
+    if len(rule_detector.unmasked_proper_nouns(email_body, values)) > max_unmasked:
+        reasons.append("unmasked")
+    rule_values = [value for _, _, _, value in rule_detector.find_spans(email_body)]
+    if any(not any(rv in v or v in rv for v in values) for rv in rule_values):
+        reasons.append("rule_mismatch")
+    return reasons
+
+
+class CascadeDetector:
+    """
+    包装 call_fn(model_name, email_body) -> dict。引擎传入的 model_name 是大模型；
+    每行先用 small_model 检测，escalation_reasons 为空时直接采用小模型的答案，否则再调用大模型。
+    升级行的耗时和 token 数为两次调用之和（端到端），结果带 "escalated" 和 "escalation_reasons"。
+
+    latency_saved() 估算相对于全部交给大模型节省的推理时间：
+    未升级的行按升级行上大模型的平均耗时估计其大模型耗时。
+    """
+
+    def __init__(self, call_fn, small_model: str, max_unmasked: int = 0):
+        self.call_fn = call_fn
+        self.small_model = small_model
+        self.max_unmasked = max_unmasked
+        self.total = 0
+        self.escalated = 0
+        self.reason_counts = {}
+        self.small_time = 0.0
+        self.large_time = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _inference_ns(result: dict) -> int:
+        return (result.get("total_duration", 0) or 0) - (result.get("load_duration", 0) or 0)
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        try:
+            small = self.call_fn(self.small_model, email_body)
+        except Exception as e:
+            small = {"model": self.small_model, "text": "", "error": str(e)}
+        reasons = escalation_reasons(small, email_body, self.max_unmasked)
+        with self._lock:
+            self.total += 1
+            self.small_time += self._inference_ns(small) / 1e9
+
+        if not reasons:
+            return dict(small, model=model_name, cascade_model=self.small_model, escalated=False)
+
+        large = self.call_fn(model_name, email_body)
+        with self._lock:
+            self.escalated += 1
+            self.large_time += self._inference_ns(large) / 1e9
+            for reason in reasons:
+                self.reason_counts[reason] = self.reason_counts.get(reason, 0) + 1
+        combined = dict(large, model=model_name, cascade_model=model_name,
+                        escalated=True, escalation_reasons=reasons)
+        for field in ("prompt_eval_count", "eval_count", "total_duration", "load_duration",
+                      "prompt_eval_duration", "eval_duration"):
+            combined[field] = (small.get(field, 0) or 0) + (large.get(field, 0) or 0)
+        return combined
+
+    def escalation_rate(self) -> float:
+        return self.escalated / self.total if self.total else 0.0
+
+    def latency_saved(self) -> float:
+        """估算节省的推理时间（秒）；没有升级行时无法估计大模型耗时，返回 0.0"""
+        if not self.escalated:
+            return 0.0
+        mean_large = self.large_time / self.escalated
+        baseline = mean_large * self.total
+        return baseline - (self.small_time + self.large_time)
@@ -0,0 +1,143 @@
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# ------------------------------------------------------------------------------
+# 检测结果缓存（SQLite，内容寻址）
+# ------------------------------------------------------------------------------
+# 键 = sha256(模型名, prompt 模板原文, 邮件正文, 生成参数)。
+# 模型、模板、正文、参数都不变时，直接返回上次的 Private_* 输出和当时的耗时，
+# 不再调用模型。
+
+DEFAULT_CACHE_PATH = "all/detection_cache.sqlite"
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_key(model_name: str, template: str, email_body: str, options: dict = None) -> str:
+    payload = json.dumps(
+        [model_name, template, email_body, options or {}],
+        ensure_ascii=False, sort_keys=True
+    )
+    return _sha256(payload)
+
+
+class DetectionCache:
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 引擎会在线程池里调用，因此关闭同线程检查，并用锁串行化访问
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS detection_cache (
+                   key TEXT PRIMARY KEY,
+                   model TEXT NOT NULL,
+                   template_hash TEXT NOT NULL,
+                   result TEXT NOT NULL,
+                   created REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_model ON detection_cache(model)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_template ON detection_cache(template_hash)")
+        self._conn.commit()
+
+    def get(self, model_name: str, template: str, email_body: str, options: dict = None):
+        """命中返回结果字典（带 "cached": True），未命中返回 None"""
+        key = make_key(model_name, template, email_body, options)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM detection_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        result = json.loads(row[0])
+        result["cached"] = True
+        return result
+
+    def put(self, model_name: str, template: str, email_body: str, result: dict, options: dict = None):
+        key = make_key(model_name, template, email_body, options)
+        stored = {k: v for k, v in result.items() if k != "cached"}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detection_cache VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, _sha256(template), json.dumps(stored, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def invalidate(self, model_name: str = None, template: str = None) -> int:
+        """按模型和/或模板删除缓存条目；两者都不传时清空整个缓存。返回删除条数"""
+        conditions, params = [], []
+        if model_name is not None:
+            conditions.append("model = ?")
+            params.append(model_name)
+        if template is not None:
+            conditions.append("template_hash = ?")
+            params.append(_sha256(template))
+        sql = "DELETE FROM detection_cache"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            deleted = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+        return deleted
+
+    def wrap(self, call_fn, template: str, options: dict = None):
+        """
+        包装 call_fn(model_name, email_body) -> dict：先查缓存，未命中再调用模型并写入缓存。
+        出错的结果（带 "error" 字段）不会写入缓存。
+        """
+        def cached_call(model_name: str, email_body: str) -> dict:
+            result = self.get(model_name, template, email_body, options)
+            if result is not None:
+                return result
+            result = call_fn(model_name, email_body)
+            if not result.get("error"):
+                self.put(model_name, template, email_body, result, options)
+            return result
+        return cached_call
+
+    def counts_by_model(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, COUNT(*) FROM detection_cache GROUP BY model"
+            ).fetchall()
+        return dict(rows)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看或清理检测结果缓存")
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--invalidate-model", help="删除该模型的所有缓存条目")
+    parser.add_argument("--invalidate-template-file", help="删除使用该模板文件内容生成的缓存条目")
+    args = parser.parse_args()
+
+    cache = DetectionCache(args.path)
+    if args.invalidate_model or args.invalidate_template_file:
+        template_text = None
+        if args.invalidate_template_file:
+            with open(args.invalidate_template_file, encoding="utf-8") as f:
+                template_text = f.read()
+        n = cache.invalidate(model_name=args.invalidate_model, template=template_text)
+        print(f"已删除 {n} 条缓存")
+    for model, count in cache.counts_by_model().items():
+        print(f"{model}: {count} 条")
+    cache.close()
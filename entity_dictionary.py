@@ -0,0 +1,90 @@
+import os
+import json
+import threading
+
+from mask_engine import Masker
+
+# ------------------------------------------------------------------------------
+# 语料级实体字典与规范化遮盖
+# ------------------------------------------------------------------------------
+# 逐行编号时（[person name_1]），同一个人在不同行得到不同的占位符，而只差人名的两封邮件
+# 也会得到不同的遮盖结果。这里维护一个整个语料共用的 {原始值: 占位符} 字典：
+# 每个原始值第一次出现时按类型分配编号（[person name_17]），之后在所有行里都用同一个占位符；
+# 字典可以保存下来，下次运行继续沿用。
+#
+# 规范化形式（canonical）则把一行中出现的占位符按类型、按在正文中首次出现的位置重新编号
+# （[person name#1]、[person name#2]、[email address#1] ...），与具体是哪个实体无关，
+# 可以直接作为下游回复缓存的键。canonical_map 记录 {规范化占位符: 语料级占位符}，用于还原。
+# 规范化占位符用 "#" 而不是 "_"：[person name#1] 与语料级的 [person name_1] 形状不同，
+# 漏掉 canonical_map 这一步或把两种文本混用时不会悄悄还原成另一个人。
+
+
+class EntityDictionary:
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}     # 原始值 -> {"key", "replacedValue"}
+        self.counters = {}    # 类型 -> 已分配的最大编号
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self._add(entry["originalValue"], entry["key"], entry["replacedValue"], entry["id"])
+
+    def _add(self, value: str, key: str, placeholder: str, number: int):
+        self.entries[value] = {"key": key, "id": number, "replacedValue": placeholder}
+        self.counters[key] = max(self.counters.get(key, 0), number)
+
+    def placeholder(self, key: str, value: str) -> str:
+        """原始值对应的语料级占位符；第一次出现时按类型分配下一个编号（类型以第一次出现时为准）"""
+        with self._lock:
+            entry = self.entries.get(value)
+            if entry is None:
+                number = self.counters.get(key, 0) + 1
+                self._add(value, key, f"[{key}_{number}]", number)
+                entry = self.entries[value]
+            return entry["replacedValue"]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def save(self, path: str = None):
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            records = [
+                {"id": entry["id"], "key": entry["key"], "originalValue": value,
+                 "replacedValue": entry["replacedValue"]}
+                for value, entry in self.entries.items()
+            ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+def canonicalize(masked_text: str, row_pairs: list) -> tuple:
+    """
+    把一行遮盖结果中的占位符按类型、按首次出现位置重新编号。
+    row_pairs: [{"key", "replacedValue"}, ...]（本行用到的语料级占位符）。
+    返回 (规范化文本, {规范化占位符: 语料级占位符})；正文中没有出现的占位符不编号。
+    """
+    key_of = {pair["replacedValue"]: pair["key"] for pair in row_pairs}
+    canonical_of = {}
+    counters = {}
+    for _, _, placeholder in Masker({p: p for p in key_of}).spans(masked_text):
+        if placeholder not in canonical_of:
+            key = key_of[placeholder]
+            counters[key] = counters.get(key, 0) + 1
+            canonical_of[placeholder] = f"[{key}#{counters[key]}]"
+    canonical_text = Masker(canonical_of).mask(masked_text)
+    return canonical_text, {canonical: placeholder for placeholder, canonical in canonical_of.items()}
+
+
+def identical_report(texts: list) -> dict:
+    """{distinct: 不同文本数, duplicate_rows: 与其他行完全相同的行数, groups: 这样的重复组数}"""
+    counts = {}
+    for text in texts:
+        counts[text] = counts.get(text, 0) + 1
+    duplicated = [n for n in counts.values() if n > 1]
+    return {"distinct": len(counts), "duplicate_rows": sum(duplicated), "groups": len(duplicated)}
@@ -0,0 +1,109 @@
+from openpyxl import Workbook, load_workbook
+
+# ------------------------------------------------------------------------------
+# 流式 Excel 读写（openpyxl 只读 / 只写模式）
+# ------------------------------------------------------------------------------
+# pd.read_excel + to_excel 要把整张表读进内存、改完再整体写出，峰值内存是表大小的数倍，
+# 而且处理完所有行之前不会产出任何结果。这里逐行读取、逐行写出：
+# 只读模式按需解析工作表 XML，只写模式把每一行立即序列化到临时文件，save() 时只做打包，
+# 内存占用与行数无关。列名、空单元格、表尾空行的处理与 pandas 一致，输出可以和原来的
+# DataFrame 路径逐格对比；数字列的类型推断不同，见 cell_text。
+
+
+def pandas_header(raw_header: tuple) -> list:
+    """与 pandas.read_excel 相同的列名处理：空列名为 "Unnamed: i"，重复列名加 ".1"、".2" 后缀"""
+    header = []
+    seen = {}
+    for i, name in enumerate(raw_header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen.setdefault(base, 0)
+        seen[name] = 0
+        header.append(name)
+    return header
+
+
+def cell_text(value) -> str:
+    """
+    与 str(df.at[...]) 一致：空单元格为 "nan"。
+    已知差异：pandas 按整列推断类型，含空单元格的整数列会变成 float64（12345 -> "12345.0"），
+    整列都像数字的文本也会转成数字（"0.90" -> 0.9）；逐行读取时无法知道整列的情况，
+    这里按单元格原值处理（"12345"、"0.90"）。正文、检测结果等文本列不受影响。
+    """
+    return "nan" if value is None else str(value)
+
+
+class ExcelRowReader:
+    """
+    逐行读取第一个工作表：header 为 pandas 风格的列名，遍历得到与 header 等长的值列表。
+    与 pandas.read_excel 一样去掉表尾的全空行（只读模式会返回带格式的空行），中间的空行保留。
+    用法：
+        with ExcelRowReader(path) as reader:
+            for row in reader: ...
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._wb = load_workbook(path, read_only=True)
+        self._rows = self._wb.active.iter_rows(values_only=True)
+        self.header = pandas_header(next(self._rows, ()))
+
+    def __iter__(self):
+        width = len(self.header)
+        blank = 0  # 尚未输出的连续全空行数：后面出现非空行时才补上
+        for row in self._rows:
+            # 只读模式下行尾的空单元格可能被省略
+            values = list(row[:width]) + [None] * (width - len(row))
+            if all(v is None for v in values):
+                blank += 1
+                continue
+            for _ in range(blank):
+                yield [None] * width
+            blank = 0
+            yield values
+
+    def close(self):
+        self._wb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ExcelRowWriter:
+    """
+    逐行写出：header 为输入列名，extra_columns 中已存在的列原位覆盖、不存在的追加到最后
+    （与 df.at[row, col] = value 的效果一致）。write(row, values) 中 values 为 {列名: 值}。
+    """
+
+    def __init__(self, path: str, header: list, extra_columns: tuple = ()):
+        self.path = path
+        self.header = list(header) + [c for c in extra_columns if c not in header]
+        self._width = len(header)
+        self._positions = {c: self.header.index(c) for c in extra_columns}
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet()
+        self._ws.append(self.header)
+        self.rows = 0
+
+    def write(self, row: list, values: dict = None):
+        out = list(row[:self._width]) + [None] * (len(self.header) - self._width)
+        for column, value in (values or {}).items():
+            out[self._positions[column]] = value
+        self._ws.append(out)
+        self.rows += 1
+
+    def close(self):
+        self._wb.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
@@ -4,6 +4,8 @@ import time
 import openai
 import pandas as pd
 
+from llm_metrics import get_metrics, metrics_path_for
+
 # Set your API key from environment variable
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
@@ -34,15 +36,18 @@ Email:
     
     # Call the GPT-4 chat completion API
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an assistant that extracts private values from email text."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-            max_tokens=150
-        )
+        with get_metrics().track("gpt-4o", "remote") as call:
+            response = openai.ChatCompletion.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are an assistant that extracts private values from email text."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+                max_tokens=150
+            )
+            call["prompt_tokens"] = response["usage"]["prompt_tokens"]
+            call["output_tokens"] = response["usage"]["completion_tokens"]
     except Exception as e:
         print("Error using ChatCompletion:", e)
         raise e
@@ -76,3 +81,5 @@ df.loc[df.index[:20], "Detected Private Values"] = detected_results
 output_file = "enron_with_detected_first20.xlsx"
 df.to_excel(output_file, index=False)
 print(f"Detection completed for the first 20 rows. Results are saved in {output_file}.")
+get_metrics().print_summary()
+get_metrics().write_report(metrics_path_for(output_file), {"script": "gpt_label.py", "rows": 20})
@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 from openpyxl import load_workbook
 import anthropic  # Claude API
 
+from llm_metrics import get_metrics
+
 ########################
 # Claude-based evaluation function
 ########################
@@ -50,16 +52,20 @@ Which reply is better? Answer with exactly one word: model1, model2, or tie.
 """
 
     try:
-        response = client.messages.create(
-            # model="claude-3-sonnet-20240229",  # Use the latest available model
-            model="claude-3-7-sonnet-latest",  # Use the latest available model
-            max_tokens=10,  # 增加一点保证能捕获完整答案
-            temperature=0,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        judge_model = "claude-3-7-sonnet-latest"
+        with get_metrics().track(judge_model, "remote") as call:
+            response = client.messages.create(
+                # model="claude-3-sonnet-20240229",  # Use the latest available model
+                model=judge_model,  # Use the latest available model
+                max_tokens=10,  # 增加一点保证能捕获完整答案
+                temperature=0,
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": user_prompt}
+                ]
+            )
+            call["prompt_tokens"] = response.usage.input_tokens
+            call["output_tokens"] = response.usage.output_tokens
 
         # 注意这里的解析方式，根据你的实际数据结构进行调整
         # 假设 response.content[0].text 为 Claude 的文本输出
@@ -273,5 +279,11 @@ def main():
         save_path=chart_save_path
     )
 
+    # 评审调用的延迟指标及 JSON 报告
+    get_metrics().print_summary()
+    metrics_path = os.path.join("gemma27b", "judge_claude.metrics.json")
+    get_metrics().write_report(metrics_path, {"script": "judge_claude.py", "workbook": workbook_path})
+    print(f"✅ Metrics report saved to: {metrics_path}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
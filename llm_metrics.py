@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# ------------------------------------------------------------------------------
+# 每次模型调用的延迟指标（本地 Ollama 与远程 API 共用）
+# ------------------------------------------------------------------------------
+# 每次调用记录：首 token 时间 (TTFT)、prompt / 生成 token 数、生成速度 (tokens/sec)、
+# 排队等待时间（等待连接池空闲连接）和总耗时。summary() 按模型给出 p50/p95/p99，
+# write_report() 把汇总和逐次调用记录写成 JSON，供之后按真实吞吐量挑选模型。
+#
+# 本地调用由 local_llm.OllamaClient 自动记录；远程调用用 track() 包住 API 请求：
+#   with get_metrics().track("gpt-4o", "remote") as call:
+#       response = openai.ChatCompletion.create(...)
+#       call["prompt_tokens"] = response["usage"]["prompt_tokens"]
+#       call["output_tokens"] = response["usage"]["completion_tokens"]
+
+PERCENTILES = (50, 95, 99)
+SUMMARY_FIELDS = ("latency", "ttft", "tokens_per_sec", "queue_wait")
+
+
+def percentile(values: list, q: float) -> float:
+    """线性插值百分位数（与 numpy.percentile 默认方式一致）"""
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def metrics_path_for(output_file: str) -> str:
+    """输出文件 all/x.xlsx 对应的指标报告 all/x.metrics.json"""
+    base, _ = os.path.splitext(output_file)
+    return base + ".metrics.json"
+
+
+class CallMetrics:
+    """线程安全的调用记录集合"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, kind: str, latency: float, ttft: float = None,
+               prompt_tokens: int = 0, output_tokens: int = 0, generation_time: float = None,
+               queue_wait: float = 0.0, error: str = None) -> dict:
+        """
+        kind: "local" / "remote"。generation_time 为生成阶段耗时（秒），用于计算 tokens/sec；
+        未提供时用 latency - ttft，两者都没有时用 latency。
+        """
+        if not generation_time:
+            generation_time = latency - ttft if ttft is not None else latency
+        record = {
+            "model": model_name,
+            "kind": kind,
+            "start": time.time() - latency,
+            "latency": latency,
+            "ttft": ttft,
+            "queue_wait": queue_wait,
+            "prompt_tokens": prompt_tokens or 0,
+            "output_tokens": output_tokens or 0,
+            "tokens_per_sec": output_tokens / generation_time if output_tokens and generation_time > 0 else None,
+            "error": error,
+        }
+        with self._lock:
+            self.calls.append(record)
+        return record
+
+    @contextmanager
+    def track(self, model_name: str, kind: str = "remote"):
+        """
+        计时一次调用；with 块内可在 call 字典中填写 prompt_tokens / output_tokens / ttft。
+        块内抛出的异常会记为 error 后继续抛出。
+        """
+        call = {}
+        start = time.time()
+        try:
+            yield call
+        except Exception as e:
+            call["error"] = str(e)
+            raise
+        finally:
+            self.record(model_name, kind, time.time() - start, **call)
+
+    def summary(self) -> dict:
+        """{模型名: {calls, errors, kind, prompt_tokens, output_tokens, latency_p50, ..., queue_wait_p99}}"""
+        with self._lock:
+            calls = list(self.calls)
+        per_model = {}
+        for record in calls:
+            per_model.setdefault(record["model"], []).append(record)
+
+        summary = {}
+        for model_name, records in per_model.items():
+            ok = [r for r in records if not r["error"]]
+            stats = {
+                "kind": records[0]["kind"],
+                "calls": len(records),
+                "errors": len(records) - len(ok),
+                "prompt_tokens": sum(r["prompt_tokens"] for r in ok),
+                "output_tokens": sum(r["output_tokens"] for r in ok),
+            }
+            for field in SUMMARY_FIELDS:
+                values = [r[field] for r in ok if r[field] is not None]
+                for q in PERCENTILES:
+                    stats[f"{field}_p{q}"] = percentile(values, q)
+            summary[model_name] = stats
+        return summary
+
+    def print_summary(self):
+        def fmt(value, digits=2):
+            return "-" if value is None else f"{value:.{digits}f}"
+
+        for model_name, s in self.summary().items():
+            print(f"[{s['kind']}] {model_name}: {s['calls']} 次调用（失败 {s['errors']}），"
+                  f"prompt/输出 token {s['prompt_tokens']}/{s['output_tokens']}")
+            for field, unit in (("latency", "秒"), ("ttft", "秒"), ("tokens_per_sec", "tok/s"),
+                                ("queue_wait", "秒")):
+                values = " / ".join(fmt(s[f"{field}_p{q}"]) for q in PERCENTILES)
+                print(f"    {field} p50/p95/p99: {values} {unit}")
+
+    def write_report(self, path: str, extra: dict = None):
+        """写出 JSON 报告：运行信息、按模型汇总、逐次调用记录"""
+        with self._lock:
+            calls = list(self.calls)
+        report = {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "run": extra or {},
+            "summary": self.summary(),
+            "calls": calls,
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# ------------------------------------------------------------------------------
+# 进程级默认记录器，本地客户端与各脚本的远程调用共用
+# ------------------------------------------------------------------------------
+_default_metrics = CallMetrics()
+
+
+def get_metrics() -> CallMetrics:
+    return _default_metrics
@@ -0,0 +1,493 @@
+import os
+import json
+import time
+import queue
+import threading
+import http.client
+from urllib.parse import urlparse
+
+from llm_metrics import get_metrics
+
+# ------------------------------------------------------------------------------
+# 本地 Ollama HTTP 客户端
+# ------------------------------------------------------------------------------
+# 代替每行启动一次 `ollama run <model>` 子进程：通过 /api/generate 和 /api/chat
+# 直接访问 Ollama 服务，连接放在连接池里复用（HTTP keep-alive），
+# 并把服务端返回的 token 数与耗时字段一并带回。有多台 Ollama 主机时由 MultiHostClient
+# 按在途请求数分配请求。每次生成调用的 TTFT、token 数、
+# 生成速度和排队等待时间记入 llm_metrics（默认的进程级记录器）。
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# 多台 Ollama 主机（逗号分隔），设置后 get_client() 返回 MultiHostClient
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+
+# Ollama 返回的计时字段（单位：纳秒）
+DURATION_FIELDS = [
+    "total_duration",
+    "load_duration",
+    "prompt_eval_duration",
+    "eval_duration",
+]
+COUNT_FIELDS = [
+    "prompt_eval_count",
+    "eval_count",
+]
+
+
+class OllamaError(RuntimeError):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def ns_to_s(value) -> float:
+    """纳秒 -> 秒；字段缺失时返回 0.0"""
+    return (value or 0) / 1e9
+
+
+def _pack_result(model_name: str, text: str, data: dict, wall_time: float) -> dict:
+    """把 Ollama 的响应整理成统一的结果字典"""
+    result = {"model": model_name, "text": text.strip(), "wall_time": wall_time}
+    for field in COUNT_FIELDS + DURATION_FIELDS:
+        result[field] = data.get(field, 0) or 0
+    return result
+
+
+def _record_call(metrics, result: dict, queue_wait: float, ttft: float = None):
+    """
+    记录一次生成调用。非流式调用拿不到真实的首 token 时间，
+    用客户端总耗时减去服务端生成耗时 (eval_duration) 估计。
+    """
+    if ttft is None:
+        ttft = max(result["wall_time"] - ns_to_s(result["eval_duration"]), 0.0)
+    result["ttft"] = ttft
+    result["queue_wait"] = queue_wait
+    metrics.record(result["model"], "local", result["wall_time"], ttft=ttft,
+                   prompt_tokens=result["prompt_eval_count"], output_tokens=result["eval_count"],
+                   generation_time=ns_to_s(result["eval_duration"]), queue_wait=queue_wait)
+
+
+class OllamaClient:
+    """
+    线程安全的 Ollama 客户端，内部维护一个 HTTPConnection 连接池。
+    每次请求从池中取出一个持久连接，用完放回，避免重复建连。
+    """
+
+    def __init__(self, base_url: str = OLLAMA_HOST, pool_size: int = 4, timeout: float = 600, metrics=None):
+        if "://" not in base_url:
+            base_url = "http://" + base_url
+        parsed = urlparse(base_url)
+        self.base_url = base_url.rstrip("/")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 11434
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+    # -------------------------- 连接池 --------------------------
+    def _new_connection(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                return self._new_connection()
+        # 池已满，等待其他线程归还连接
+        return self._pool.get()
+
+    def _release(self, conn: http.client.HTTPConnection):
+        self._pool.put(conn)
+
+    def close(self):
+        """关闭池中所有连接"""
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        with self._lock:
+            self._created = 0
+
+    def ping(self, timeout: float = 2.0) -> bool:
+        """健康检查：GET /api/version，使用单独的短超时连接，不占用连接池"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            conn.request("GET", "/api/version")
+            response = conn.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+
+    # -------------------------- 请求 --------------------------
+    def _send(self, conn, path: str, payload: dict):
+        """发送 POST 请求并返回 (连接, 响应)；复用的连接可能已被服务端关闭，这种情况重连一次"""
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if attempt == 1:
+                    raise
+
+    def _post(self, path: str, payload: dict, timing: dict = None) -> dict:
+        """timing 不为 None 时写入 queue_wait（等待空闲连接的秒数）"""
+        wait_start = time.time()
+        conn = self._acquire()
+        if timing is not None:
+            timing["queue_wait"] = time.time() - wait_start
+        try:
+            conn, response = self._send(conn, path, payload)
+            raw = response.read()
+            if response.status != 200:
+                raise OllamaError(f"Ollama {path} 返回 {response.status}: {raw[:200]!r}", response.status)
+            return json.loads(raw)
+        except Exception:
+            conn.close()
+            raise
+        finally:
+            self._release(conn)
+
+    def _stream(self, path: str, payload: dict, timing: dict = None):
+        """
+        流式请求：逐行产出 Ollama 返回的 NDJSON 对象。
+        调用方提前结束迭代（generator.close()）时关闭该连接，Ollama 会随之停止生成。
+        """
+        wait_start = time.time()
+        conn = self._acquire()
+        if timing is not None:
+            timing["queue_wait"] = time.time() - wait_start
+        finished = False
+        try:
+            conn, response = self._send(conn, path, payload)
+            if response.status != 200:
+                raise OllamaError(f"Ollama {path} 返回 {response.status}: {response.read()[:200]!r}",
+                                  response.status)
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("done"):
+                    response.read()  # 读完结尾的分块，连接才能复用
+                    finished = True
+                yield data
+                if finished:
+                    break
+        finally:
+            if not finished:
+                conn.close()
+            self._release(conn)
+
+    def generate(self, model_name: str, prompt: str, options: dict = None, **kwargs) -> dict:
+        """
+        调用 /api/generate（非流式），返回:
+        {"model", "text", "wall_time", "prompt_eval_count", "eval_count", *_duration}
+        """
+        payload = {"model": model_name, "prompt": prompt, "stream": False}
+        if options:
+            payload["options"] = options
+        payload.update(kwargs)
+        timing = {}
+        start = time.time()
+        try:
+            data = self._post("/api/generate", payload, timing)
+        except Exception as e:
+            self.metrics.record(model_name, "local", time.time() - start, error=str(e),
+                                queue_wait=timing.get("queue_wait", 0.0))
+            raise
+        result = _pack_result(model_name, data.get("response", ""), data, time.time() - start)
+        _record_call(self.metrics, result, timing.get("queue_wait", 0.0))
+        return result
+
+    def generate_stream(self, model_name: str, prompt: str, options: dict = None, **kwargs):
+        """
+        调用 /api/generate（流式），逐个产出 Ollama 的响应块：
+        {"response": "新生成的片段", "done": False, ...}，最后一块带 done=True 及 token 数与耗时字段。
+        """
+        payload = {"model": model_name, "prompt": prompt, "stream": True}
+        if options:
+            payload["options"] = options
+        payload.update(kwargs)
+        return self._measured_stream(model_name, "/api/generate", payload)
+
+    def _measured_stream(self, model_name: str, path: str, payload: dict):
+        """透传 _stream 的响应块，同时记录真实的首 token 时间"""
+        timing = {}
+        start = time.time()
+        ttft = None
+        last = {}
+        error = None
+        chunks = self._stream(path, payload, timing)
+        try:
+            for chunk in chunks:
+                if ttft is None and (chunk.get("response") or chunk.get("message", {}).get("content")):
+                    ttft = time.time() - start
+                last = chunk
+                yield chunk
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            chunks.close()
+            wall_time = time.time() - start
+            if last.get("done"):
+                _record_call(self.metrics, _pack_result(model_name, "", last, wall_time),
+                             timing.get("queue_wait", 0.0), ttft)
+            else:
+                # 调用方提前结束（generator.close()）或流中断：服务端没有返回统计字段
+                self.metrics.record(model_name, "local", wall_time, ttft=ttft,
+                                    queue_wait=timing.get("queue_wait", 0.0), error=error)
+
+    def chat(self, model_name: str, messages: list, options: dict = None, **kwargs) -> dict:
+        """调用 /api/chat（非流式），返回格式同 generate"""
+        payload = {"model": model_name, "messages": messages, "stream": False}
+        if options:
+            payload["options"] = options
+        payload.update(kwargs)
+        timing = {}
+        start = time.time()
+        try:
+            data = self._post("/api/chat", payload, timing)
+        except Exception as e:
+            self.metrics.record(model_name, "local", time.time() - start, error=str(e),
+                                queue_wait=timing.get("queue_wait", 0.0))
+            raise
+        text = data.get("message", {}).get("content", "")
+        result = _pack_result(model_name, text, data, time.time() - start)
+        _record_call(self.metrics, result, timing.get("queue_wait", 0.0))
+        return result
+
+    def load_model(self, model_name: str, keep_alive="10m") -> dict:
+        """只加载模型、不生成内容（空 prompt），返回结果中的 load_duration 即加载耗时"""
+        start = time.time()
+        data = self._post("/api/generate", {"model": model_name, "keep_alive": keep_alive})
+        return _pack_result(model_name, "", data, time.time() - start)
+
+    def unload_model(self, model_name: str) -> dict:
+        """keep_alive=0 让 Ollama 立即释放该模型占用的内存"""
+        return self.load_model(model_name, keep_alive=0)
+
+
+def _is_host_failure(error: Exception) -> bool:
+    """连接失败、超时、服务端 5xx 视为主机故障（可换主机重试）；4xx 等请求本身的问题直接抛出"""
+    if isinstance(error, OllamaError):
+        return (error.status or 0) >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+class MultiHostClient:
+    """
+    多台 Ollama 主机的客户端，接口与 OllamaClient 相同。
+    每次请求发给在途请求最少的健康主机（相同时轮流）；请求因主机故障失败时，
+    该主机标记为不健康并换其他主机重试。不健康的主机每隔 health_interval 秒
+    用 GET /api/version 检查一次，恢复后重新参与分配。
+    load_model / unload_model 对所有健康主机执行（每台主机都需要加载模型）。
+    """
+
+    def __init__(self, base_urls: list, pool_size: int = 4, timeout: float = 600,
+                 health_interval: float = 10.0, metrics=None):
+        if not base_urls:
+            raise ValueError("至少需要一个 Ollama 地址")
+        self.hosts = [OllamaClient(url, pool_size, timeout, metrics) for url in base_urls]
+        self.health_interval = health_interval
+        n = len(self.hosts)
+        self._outstanding = [0] * n
+        self._healthy = [True] * n
+        self._retry_at = [0.0] * n
+        self._next = 0
+        self.calls = [0] * n
+        self.failures = [0] * n
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pool_size(self) -> int:
+        return self.hosts[0].pool_size
+
+    @pool_size.setter
+    def pool_size(self, value: int):
+        for host in self.hosts:
+            host.pool_size = value
+
+    # -------------------------- 主机选择与健康检查 --------------------------
+    def _revive(self, exclude: set):
+        """到了重试时间的不健康主机做一次健康检查；同一时刻只有一个线程检查同一台主机"""
+        now = time.time()
+        due = []
+        with self._lock:
+            for i in range(len(self.hosts)):
+                if not self._healthy[i] and i not in exclude and now >= self._retry_at[i]:
+                    self._retry_at[i] = now + self.health_interval
+                    due.append(i)
+        for i in due:
+            if self.hosts[i].ping():
+                with self._lock:
+                    self._healthy[i] = True
+                print(f"Ollama 主机 {self.hosts[i].base_url} 已恢复")
+
+    def _pick(self, exclude: set):
+        self._revive(exclude)
+        n = len(self.hosts)
+        with self._lock:
+            candidates = [i for i in range(n) if self._healthy[i] and i not in exclude]
+            if not candidates:
+                return None
+            i = min(candidates, key=lambda c: (self._outstanding[c], (c - self._next) % n))
+            self._next = (i + 1) % n
+            self._outstanding[i] += 1
+            self.calls[i] += 1
+            return i
+
+    def _release_host(self, i: int):
+        with self._lock:
+            self._outstanding[i] -= 1
+
+    def _mark_failed(self, i: int, error: Exception):
+        with self._lock:
+            self._healthy[i] = False
+            self._retry_at[i] = time.time() + self.health_interval
+            self.failures[i] += 1
+        print(f"Ollama 主机 {self.hosts[i].base_url} 调用失败，标记为不健康: {error}")
+
+    def _no_host_error(self, last_error):
+        return OllamaError(f"没有可用的 Ollama 主机（最后一次错误: {last_error}）")
+
+    def _call(self, method: str, *args, **kwargs):
+        tried = set()
+        last_error = None
+        while True:
+            i = self._pick(tried)
+            if i is None:
+                raise self._no_host_error(last_error) from last_error
+            try:
+                return getattr(self.hosts[i], method)(*args, **kwargs)
+            except Exception as e:
+                if not _is_host_failure(e):
+                    raise
+                self._mark_failed(i, e)
+                tried.add(i)
+                last_error = e
+                with self._lock:
+                    self.retried += 1
+            finally:
+                self._release_host(i)
+
+    # -------------------------- 请求 --------------------------
+    def generate(self, model_name: str, prompt: str, options: dict = None, **kwargs) -> dict:
+        return self._call("generate", model_name, prompt, options, **kwargs)
+
+    def chat(self, model_name: str, messages: list, options: dict = None, **kwargs) -> dict:
+        return self._call("chat", model_name, messages, options, **kwargs)
+
+    def generate_stream(self, model_name: str, prompt: str, options: dict = None, **kwargs):
+        """流式请求只在尚未收到任何响应块时换主机重试，已开始输出的流出错直接抛出"""
+        tried = set()
+        last_error = None
+        while True:
+            i = self._pick(tried)
+            if i is None:
+                raise self._no_host_error(last_error) from last_error
+            started = False
+            chunks = self.hosts[i].generate_stream(model_name, prompt, options, **kwargs)
+            try:
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not _is_host_failure(e):
+                    raise
+                self._mark_failed(i, e)
+                tried.add(i)
+                last_error = e
+                with self._lock:
+                    self.retried += 1
+            finally:
+                chunks.close()
+                self._release_host(i)
+
+    def _each_healthy(self, method: str, model_name: str, *args) -> dict:
+        """对所有健康主机执行 method，返回 load_duration 最大的结果"""
+        self._revive(set())
+        results = []
+        last_error = None
+        for i, host in enumerate(self.hosts):
+            if not self._healthy[i]:
+                continue
+            try:
+                results.append(getattr(host, method)(model_name, *args))
+            except Exception as e:
+                if not _is_host_failure(e):
+                    raise
+                self._mark_failed(i, e)
+                last_error = e
+        if not results:
+            raise self._no_host_error(last_error) from last_error
+        return max(results, key=lambda r: r.get("load_duration", 0))
+
+    def load_model(self, model_name: str, keep_alive="10m") -> dict:
+        return self._each_healthy("load_model", model_name, keep_alive)
+
+    def unload_model(self, model_name: str) -> dict:
+        return self._each_healthy("unload_model", model_name)
+
+    def close(self):
+        for host in self.hosts:
+            host.close()
+
+    def host_stats(self) -> list:
+        """[{host, healthy, calls, failures, outstanding}, ...]"""
+        with self._lock:
+            return [
+                {"host": host.base_url, "healthy": self._healthy[i], "calls": self.calls[i],
+                 "failures": self.failures[i], "outstanding": self._outstanding[i]}
+                for i, host in enumerate(self.hosts)
+            ]
+
+
+# ------------------------------------------------------------------------------
+# 进程级默认客户端，脚本之间共享同一个连接池
+# ------------------------------------------------------------------------------
+_default_client = None
+_default_hosts = None
+
+
+def get_client(pool_size: int = None, hosts: list = None):
+    """
+    返回共享客户端；pool_size 大于当前连接池时会扩容（并发调用时使用）。
+    hosts（未提供时读取环境变量 OLLAMA_HOSTS）包含多个地址时返回 MultiHostClient，
+    每台主机各自维护 pool_size 大小的连接池。
+    """
+    global _default_client, _default_hosts
+    if hosts is not None and _default_client is not None and list(hosts) != _default_hosts:
+        _default_client.close()
+        _default_client = None
+    if _default_client is None:
+        _default_hosts = list(hosts or OLLAMA_HOSTS or [OLLAMA_HOST])
+        if len(_default_hosts) > 1:
+            _default_client = MultiHostClient(_default_hosts)
+        else:
+            _default_client = OllamaClient(_default_hosts[0])
+    if pool_size and pool_size > _default_client.pool_size:
+        with _default_client._lock:
+            _default_client.pool_size = pool_size
+    return _default_client
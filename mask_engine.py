@@ -0,0 +1,206 @@
+import re
+import string
+from collections import deque
+
+# ------------------------------------------------------------------------------
+# 单遍扫描的遮盖引擎（Aho-Corasick）
+# ------------------------------------------------------------------------------
+# 原来的做法是对每个敏感值依次调用 str.replace：每行耗时 O(文本长度 × 敏感值个数)，
+# 而且 "John" 会替换掉 "Johnson" 的前半部分，后面的值还可能匹配到前面刚生成的占位符里。
+# 这里先找出所有敏感值在原文中的全部出现位置，重叠时取最靠左、其次最长的匹配，
+# 再一次性拼出遮盖后的文本，后面的值不会匹配到前面生成的占位符里。
+# 以字母/数字开头或结尾的值只在单词边界处匹配："John" 不会替换 "Johnson" 的前半部分。
+#
+# 敏感值不多时（一行通常只有几个到几十个），仍按原来的做法逐个 str.replace（从最长的值开始），
+# 替换后检查结果：占位符紧挨着字母/数字或另一个占位符（说明某个值不在单词边界上），
+# 或者后面的值可能匹配到占位符里，就改用下面的精确做法。结果与精确做法一致，只有两个值部分重叠
+# （"Ann Lee" 与 "Lee Rossi" 出现在 "Ann Lee Rossi" 中）时逐个替换取较长的一个，而不是较靠左的一个。
+# 精确做法：对每个值用 str.find 找出现位置；值很多时逐个扫描的代价随值的个数线性增长，
+# 改用 Aho-Corasick 自动机，扫描代价与值的个数无关。
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机；patterns 为字符串列表（大小写敏感，与 str.replace 一致）"""
+
+    def __init__(self, patterns: list):
+        self.patterns = [p for p in dict.fromkeys(patterns) if p]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [-1]     # 以该节点结尾的模式编号，-1 表示没有
+        self._dict = [0]     # 沿 fail 链最近的、有输出的节点（0 表示没有）
+        for index, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(-1)
+                    self._dict.append(0)
+                node = nxt
+            self._out[node] = index
+        self._build_links()
+        # 自动机处于根节点时，用正则（C 实现）直接跳到下一个可能开始匹配的字符
+        first_chars = "".join(re.escape(ch) for ch in self._goto[0])
+        self._next_start = re.compile(f"[{first_chars}]") if first_chars else None
+
+    def _build_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._dict[child] = target if self._out[target] >= 0 else self._dict[target]
+                queue.append(child)
+
+    def longest_at(self, text: str, accept=None) -> dict:
+        """
+        扫描一遍，返回 {起始位置: (最长匹配长度, 模式编号)}；
+        accept(text, start, end) 为 False 的匹配不计入（用于单词边界检查）
+        """
+        best = {}
+        if self._next_start is None:
+            return best
+        goto, fail, out, links, patterns = self._goto, self._fail, self._out, self._dict, self.patterns
+        next_start = self._next_start.search
+        node = 0
+        end = 0
+        size = len(text)
+        while end < size:
+            if not node:
+                m = next_start(text, end)
+                if m is None:
+                    break
+                end = m.start()
+            ch = text[end]
+            end += 1
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match = node if out[node] >= 0 else links[node]
+            while match:
+                index = out[match]
+                length = len(patterns[index])
+                start = end - length
+                if best.get(start, (0,))[0] < length and (accept is None or accept(text, start, end)):
+                    best[start] = (length, index)
+                match = links[match]
+        return best
+
+    def find(self, text: str, accept=None) -> list:
+        """不重叠的匹配 [(start, end, 模式编号), ...]：从左到右，同一位置取最长"""
+        best = self.longest_at(text, accept)
+        return leftmost_longest((start, length, index) for start, (length, index) in best.items())
+
+
+def leftmost_longest(candidates) -> list:
+    """候选 (start, length, 标记) -> 不重叠的 [(start, end, 标记), ...]：从左到右，同一位置取最长"""
+    spans = []
+    pos = 0
+    for start, length, tag in sorted(candidates, key=lambda c: (c[0], -c[1])):
+        if start < pos:
+            continue
+        spans.append((start, start + length, tag))
+        pos = start + length
+    return spans
+
+
+# 只对 ASCII 字母数字做边界检查：中文等不以空格分词的文字中，人名紧挨着其他汉字
+_WORD_CHARS = frozenset(string.ascii_letters + string.digits + "_")
+
+
+def at_word_boundary(text: str, start: int, end: int) -> bool:
+    """text[start:end] 两端是否在单词边界上（匹配以非字母数字开头/结尾的一端不检查）"""
+    if start > 0 and text[start] in _WORD_CHARS and text[start - 1] in _WORD_CHARS:
+        return False
+    if end < len(text) and text[end - 1] in _WORD_CHARS and text[end] in _WORD_CHARS:
+        return False
+    return True
+
+
+# 逐个替换后出现这些情况时改用精确做法："[" 紧跟在字母/数字后面、"]" 后面紧跟字母/数字或 "["
+# （两个以字面字符开头的正则分开查找，比一个正则里的多个分支快）
+_WORD_BEFORE_PLACEHOLDER = re.compile(r"\[(?<=[A-Za-z0-9_]\[)")
+_WORD_AFTER_PLACEHOLDER = re.compile(r"\](?=[A-Za-z0-9_\[])")
+
+
+# 少于该个数的敏感值先尝试逐个 str.replace
+SEQUENTIAL_MAX_PATTERNS = 100
+# 超过该个数的敏感值使用 Aho-Corasick，否则对每个值逐个 str.find
+AUTOMATON_MIN_PATTERNS = 128
+
+
+class Masker:
+    """
+    replacements: {原始值: 占位符}（按插入顺序）。
+    可以每行建一个，也可以用整个语料的值建一个后在各行之间复用。
+    """
+
+    def __init__(self, replacements: dict):
+        self.replacements = replacements if "" not in replacements else {
+            k: v for k, v in replacements.items() if k}
+        self.automaton = None
+        if len(self.replacements) > AUTOMATON_MIN_PATTERNS:
+            self.automaton = AhoCorasick(list(self.replacements))
+        self._sequential = None
+        if len(self.replacements) < SEQUENTIAL_MAX_PATTERNS:
+            values = "\0".join(self.replacements)
+            placeholders = "\0".join(self.replacements.values())
+            # 占位符都是 [...] 形式、值里没有方括号、且没有哪个值能匹配到占位符里时，才能逐个替换
+            bracketed = (placeholders[:1] == "[" and placeholders[-1:] == "]"
+                         and placeholders.count("\0[") == placeholders.count("]\0") == len(self.replacements) - 1)
+            if bracketed and "[" not in values and "]" not in values and not any(
+                    map(placeholders.__contains__, self.replacements)):
+                self._sequential = sorted(self.replacements, key=len, reverse=True)
+
+    def spans(self, text: str) -> list:
+        """不重叠、在单词边界上的匹配 [(start, end, 原始值), ...]"""
+        if self.automaton is not None:
+            patterns = self.automaton.patterns
+            return [(start, end, patterns[index])
+                    for start, end, index in self.automaton.find(text, at_word_boundary)]
+        candidates = []
+        for value in self.replacements:
+            start = text.find(value)
+            while start >= 0:
+                if at_word_boundary(text, start, start + len(value)):
+                    candidates.append((start, len(value), value))
+                start = text.find(value, start + 1)
+        return leftmost_longest(candidates)
+
+    def mask(self, text: str) -> str:
+        if not isinstance(text, str) or not self.replacements:
+            return text
+        if self._sequential is not None:
+            result = text
+            for value in self._sequential:
+                result = result.replace(value, self.replacements[value])
+            if result is text or not (_WORD_BEFORE_PLACEHOLDER.search(result)
+                                      or _WORD_AFTER_PLACEHOLDER.search(result)):
+                return result
+        parts = []
+        last = 0
+        for start, end, value in self.spans(text):
+            parts.append(text[last:start])
+            parts.append(self.replacements[value])
+            last = end
+        parts.append(text[last:])
+        return "".join(parts)
+
+
+def mask_text(text: str, replacements: dict) -> str:
+    """单行便捷入口：把 text 中出现的原始值一次性替换为占位符"""
+    return Masker(replacements).mask(text)
+
+
+def sequential_replace(text: str, replacements: dict) -> str:
+    """原来的逐个 str.replace 做法（按插入顺序、不检查单词边界），仅用于对比评测"""
+    for original, placeholder in replacements.items():
+        text = text.replace(original, placeholder)
+    return text
@@ -1,27 +1,158 @@
 import re
+import os
 import json
+import hashlib
+import threading
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from mask_engine import Masker
+from privacy_vault import PrivacyVault, JsonArrayWriter
+from excel_stream import ExcelRowReader, ExcelRowWriter, cell_text
+from entity_dictionary import EntityDictionary, canonicalize, identical_report
+
+# 列名
+col_body = "Body"
+col_private_llm = "Private_gemma3:27b"
+col_json = "storage_privacy.json"
+col_result = "masked_prompt"
+col_canonical = "canonical_prompt"
+col_canonical_map = "canonical_map.json"
+
+# 直接运行本文件时使用的模式：
+# "dataframe"（pandas 整表）、"streaming"（逐行读写）、"parallel"（逐行读写 + 多进程）、
+# "consistent"（语料级一致占位符 + 规范化结果）、"consistent_streaming"（同上，逐行读写）
+mode = "dataframe"
+
+# 正则模式：匹配 "key" : "value"
+pattern = re.compile(r'"\s*([^"]+)\s*"\s*:\s*"([^"]+)"')
+
+
+def parse_pairs(processed_text: str) -> list:
+    """从 B（检测结果）中解析 key-value，按值去重，保持首次出现顺序：[(key, value), ...]"""
+    seen_values = set()
+    pairs = []
+    for key_str, value_str in pattern.findall(processed_text):
+        if value_str not in seen_values:
+            seen_values.add(value_str)
+            pairs.append((key_str.strip(), value_str))
+    return pairs
+
+
+def pair_record(pair_id: int, key_str: str, value_str: str) -> dict:
+    return {
+        "id": pair_id,
+        "key": key_str,
+        "originalValue": value_str,
+        "replacedValue": f"[{key_str}_{pair_id}]"
+    }
+
+
+def mask_row(original_text: str, processed_text: str) -> tuple:
+    """
+    处理一行：从 B（检测结果）中解析 key-value，对 A（原文）做遮盖。
+    返回 (row_pairs, json 列的值, 遮盖后的文本)；串行和并行两种模式共用。
+    """
+    row_pairs = []
+
+    # 针对每个匹配进行处理
+    for pair_id, (key_str, value_str) in enumerate(parse_pairs(processed_text), start=1):
+        row_pairs.append(pair_record(pair_id, key_str, value_str))
+
+    # 对 original_text 做遮盖：以字母/数字开头或结尾的值只在单词边界处替换，因此 "John"
+    # 不会改写 "Johnson"；后面的值也不会替换到前面生成的占位符内部（见 mask_engine.Masker）
+    masker = Masker({pair["originalValue"]: pair["replacedValue"] for pair in row_pairs})
+    result_text = masker.mask(original_text)
+
+    json_value = "None" if len(row_pairs) == 0 else json.dumps(row_pairs, ensure_ascii=False)
+    return row_pairs, json_value, result_text
+
+
+class StreamingRowMasker:
+    """
+    流式检测的下游：作为 StreamingDetector 的 on_pair 回调，每闭合一个 (key, value)
+    就按 mask_row 的规则（按值去重、按出现顺序编号）分配占位符并更新该行的遮盖文本，
+    模型生成结束时遮盖结果已经就绪。回调可能来自多个工作线程，按 (模型名, 正文) 分开记录。
+    """
+
+    def __init__(self):
+        self._rows = {}   # (模型名, 正文) -> {"pairs": [...], "masked": 遮盖后的文本}
+        self._lock = threading.Lock()
+        self.streamed = 0
+        self.fallback = 0
+
+    def __call__(self, model_name: str, email_body: str, key_str: str, value_str: str):
+        with self._lock:
+            row = self._rows.setdefault((model_name, email_body), {"pairs": [], "masked": email_body})
+            if any(pair["originalValue"] == value_str for pair in row["pairs"]):
+                return
+            row["pairs"].append(pair_record(len(row["pairs"]) + 1, key_str, value_str))
+            pairs = list(row["pairs"])
+        # 同一行的回调来自同一个流，按生成顺序串行到达，遮盖不需要持有锁
+        row["masked"] = Masker({pair["originalValue"]: pair["replacedValue"] for pair in pairs}).mask(email_body)
+
+    def finish(self, model_name: str, email_body: str, processed_text: str) -> tuple:
+        """
+        取出该行的遮盖结果，返回值与 mask_row(email_body, processed_text) 相同。
+        没有流式记录（缓存命中、规则快速通道、分块窗口等）或记录与最终输出不一致时，
+        按最终输出重新遮盖。
+        """
+        with self._lock:
+            row = self._rows.pop((model_name, email_body), None)
+        expected = parse_pairs(processed_text) if isinstance(processed_text, str) else []
+        if row is None or [(p["key"], p["originalValue"]) for p in row["pairs"]] != expected:
+            self.fallback += 1
+            return mask_row(email_body, processed_text)
+        self.streamed += 1
+        row_pairs = row["pairs"]
+        json_value = "None" if len(row_pairs) == 0 else json.dumps(row_pairs, ensure_ascii=False)
+        return row_pairs, json_value, row["masked"]
+
+
+def global_records(row_idx: int, row_pairs: list) -> list:
+    """本行结果在全局 JSON 中的记录"""
+    return [
+        {
+            "rowIndex": row_idx,
+            "id": pair["id"],
+            "key": pair["key"],
+            "originalValue": pair["originalValue"],
+            "replacedValue": pair["replacedValue"]
+        }
+        for pair in row_pairs
+    ]
+
+
+def _open_vault(vault_path: str):
+    """打开保险库并清空上一次遮盖的条目；vault_path 为空时返回 None"""
+    if not vault_path:
+        return None
+    vault = PrivacyVault(vault_path)
+    vault.clear()
+    return vault
+
+
+def _close_vault(vault):
+    if vault is not None:
+        print(f"隐私值保险库已写入 {vault.count()} 条:", vault.path)
+        vault.close()
+
 
 def process_restore_excel(
     input_excel_path: str = "gemma27b/privacy.xlsx",
     output_excel_path: str = "gemma27b/mask_prompt.xlsx",
-    output_json_path: str = "gemma27b/storage_privacy.json"
+    output_json_path: str = "gemma27b/storage_privacy.json",
+    vault_path: str = None
 ):
+    """vault_path 不为空时，同时把每行的隐私值追加写入该保险库（见 privacy_vault.py）"""
     print("开始处理Excel:", input_excel_path)
     df = pd.read_excel(input_excel_path)
 
-    col_body = "Body"
-    col_private_llm = "Private_gemma3:27b"
-    col_json = "storage_privacy.json"
-    col_result = "masked_prompt"
-
     if col_body not in df.columns or col_private_llm not in df.columns:
         raise ValueError("Excel文件中缺少所需的列(body或Private_llama3.2:3b)")
 
-    # 正则模式：匹配 "key" : "value"
-    pattern = re.compile(r'"\s*([^"]+)\s*"\s*:\s*"([^"]+)"')
-
     global_pairs = []
+    vault = _open_vault(vault_path)
 
     total_rows = len(df)
     print(f"共读取到 {total_rows} 行数据，即将开始处理...")
@@ -33,59 +164,271 @@ def process_restore_excel(
         original_text = str(df.at[row_idx, col_body])   # A
         processed_text = str(df.at[row_idx, col_private_llm])  # B
 
-        # 在B中查找所有的 key-value 对
-        matches = pattern.findall(processed_text)
-        seen_values = set()
-
-        row_pairs = []
-        pair_id = 1
-
-        # 针对每个匹配进行处理
-        for key_str, value_str in matches:
-            if value_str not in seen_values:
-                seen_values.add(value_str)
-                record = {
-                    "id": pair_id,
-                    "key": key_str.strip(),
-                    "originalValue": value_str,
-                    "replacedValue": f"[{key_str.strip()}_{pair_id}]"
-                }
-                row_pairs.append(record)
-                pair_id += 1
-
-        # 在 original_text 中逐个替换
-        result_text = original_text
-        for pair in row_pairs:
-            # 如果想要更加详细的log，比如每次替换什么，可以在这里print出来
-            # print(f"  - 替换: {pair['originalValue']} -> {pair['replacedValue']}")
-            result_text = result_text.replace(pair["originalValue"], pair["replacedValue"])
+        row_pairs, json_value, result_text = mask_row(original_text, processed_text)
 
         # 写入 dataFrame
-        if len(row_pairs) == 0:
-            df.at[row_idx, col_json] = "None"
+        df.at[row_idx, col_json] = json_value
+        df.at[row_idx, col_result] = result_text
+
+        # 将本行结果追加到全局列表
+        global_pairs.extend(global_records(row_idx, row_pairs))
+        if vault is not None:
+            vault.append(row_idx, row_pairs)
+
+    print("所有行处理完毕，正在写出全局 JSON 文件:", output_json_path)
+    with open(output_json_path, 'w', encoding='utf-8') as f:
+        json.dump(global_pairs, f, ensure_ascii=False, indent=2)
+    _close_vault(vault)
+
+    print("正在写出处理结果到新的Excel文件:", output_excel_path)
+    df.to_excel(output_excel_path, index=False)
+    print("处理完成！")
+
+
+# ------------------------------------------------------------------------------
+# 流式 / 大语料模式：逐行读取、（可选）多进程遮盖、边处理边写出
+# ------------------------------------------------------------------------------
+# openpyxl 只读模式逐行读取输入（见 excel_stream.py），每 chunk_size 行作为一个任务，
+# workers > 1 时交给进程池，按原顺序取回结果后立即写入（write-only 模式）Excel 和全局 JSON，
+# 同时在途的块数不超过 2 × workers；workers = 1 时在本进程内逐块处理。
+# 内存占用与总行数无关，输出（storage_privacy.json 列、masked_prompt 列、全局 JSON 文件）
+# 与串行模式完全一致。
+
+def _mask_chunk(chunk: list) -> list:
+    """进程池任务：[(原文, 检测结果), ...] -> [(row_pairs, json 列的值, 遮盖后的文本), ...]"""
+    return [mask_row(cell_text(original), cell_text(processed)) for original, processed in chunk]
+
+
+def _read_chunks(rows, body_pos: int, private_pos: int, chunk_size: int):
+    """按块产出 (原始行列表, [(原文, 检测结果), ...])"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk, [(r[body_pos], r[private_pos]) for r in chunk]
+            chunk = []
+    if chunk:
+        yield chunk, [(r[body_pos], r[private_pos]) for r in chunk]
+
+
+def process_restore_excel_streaming(
+    input_excel_path: str = "gemma27b/privacy.xlsx",
+    output_excel_path: str = "gemma27b/mask_prompt.xlsx",
+    output_json_path: str = "gemma27b/storage_privacy.json",
+    workers: int = 1,
+    chunk_size: int = 2000,
+    vault_path: str = None
+):
+    print(f"开始处理Excel（流式，{workers} 个进程，每块 {chunk_size} 行）:", input_excel_path)
+
+    reader = ExcelRowReader(input_excel_path)
+    if col_body not in reader.header or col_private_llm not in reader.header:
+        reader.close()
+        raise ValueError("Excel文件中缺少所需的列(body或Private_llama3.2:3b)")
+    body_pos = reader.header.index(col_body)
+    private_pos = reader.header.index(col_private_llm)
+
+    vault = _open_vault(vault_path)
+    with reader, ExcelRowWriter(output_excel_path, reader.header, (col_json, col_result)) as writer, \
+            open(output_json_path, "w", encoding="utf-8") as f_json:
+        json_writer = JsonArrayWriter(f_json)
+
+        def write_back(raw_rows, results):
+            for raw, (row_pairs, json_value, result_text) in zip(raw_rows, results):
+                row_idx = writer.rows
+                writer.write(raw, {col_json: json_value, col_result: result_text})
+                for record in global_records(row_idx, row_pairs):
+                    json_writer.write(record)
+                if vault is not None:
+                    vault.append(row_idx, row_pairs)
+            print(f">> 已处理 {writer.rows} 行...")
+
+        chunks = _read_chunks(reader, body_pos, private_pos, chunk_size)
+        if workers <= 1:
+            for raw_rows, pairs in chunks:
+                write_back(raw_rows, _mask_chunk(pairs))
         else:
-            df.at[row_idx, col_json] = json.dumps(row_pairs, ensure_ascii=False)
+            with ProcessPoolExecutor(workers) as pool:
+                pending = []
+                for raw_rows, pairs in chunks:
+                    pending.append((raw_rows, pool.submit(_mask_chunk, pairs)))
+                    # 控制在途块数，按顺序写出已完成的块
+                    while len(pending) >= 2 * workers:
+                        raw_rows, future = pending.pop(0)
+                        write_back(raw_rows, future.result())
+                for raw_rows, future in pending:
+                    write_back(raw_rows, future.result())
+        json_writer.close()
+        print(f"共处理 {writer.rows} 行，全局 JSON 文件已写出:", output_json_path)
+        print("正在保存Excel文件:", output_excel_path)
+    _close_vault(vault)
+    print("处理完成！")
+
+
+def process_restore_excel_parallel(
+    input_excel_path: str = "gemma27b/privacy.xlsx",
+    output_excel_path: str = "gemma27b/mask_prompt.xlsx",
+    output_json_path: str = "gemma27b/storage_privacy.json",
+    workers: int = None,
+    chunk_size: int = 2000,
+    vault_path: str = None
+):
+    """流式模式，默认每个 CPU 核一个进程"""
+    process_restore_excel_streaming(input_excel_path, output_excel_path, output_json_path,
+                                    workers or os.cpu_count() or 1, chunk_size, vault_path)
+
+
+# ------------------------------------------------------------------------------
+# 语料级一致占位符模式：同一原始值在所有行使用同一个占位符，并输出规范化遮盖结果
+# ------------------------------------------------------------------------------
+# storage_privacy.json 列、全局 JSON、保险库的格式不变，只是 replacedValue 换成语料级占位符；
+# 另外写出 canonical_prompt（供下游缓存作键）和 canonical_map.json（{规范化占位符: 语料级占位符}）。
+
+def mask_row_consistent(original_text: str, processed_text: str, entities: EntityDictionary) -> tuple:
+    """返回 (row_pairs, json 列的值, 遮盖后的文本, 规范化文本, canonical_map 列的值)"""
+    row_pairs = [
+        {
+            "id": pair_id,
+            "key": key_str,
+            "originalValue": value_str,
+            "replacedValue": entities.placeholder(key_str, value_str)
+        }
+        for pair_id, (key_str, value_str) in enumerate(parse_pairs(processed_text), start=1)
+    ]
+    result_text = Masker({pair["originalValue"]: pair["replacedValue"] for pair in row_pairs}).mask(original_text)
+    canonical_text, canonical_map = canonicalize(result_text, row_pairs)
+
+    json_value = "None" if len(row_pairs) == 0 else json.dumps(row_pairs, ensure_ascii=False)
+    map_value = "None" if not canonical_map else json.dumps(canonical_map, ensure_ascii=False)
+    return row_pairs, json_value, result_text, canonical_text, map_value
+
+
+def process_restore_excel_consistent(
+    input_excel_path: str = "gemma27b/privacy.xlsx",
+    output_excel_path: str = "gemma27b/mask_prompt.xlsx",
+    output_json_path: str = "gemma27b/storage_privacy.json",
+    entity_dict_path: str = "gemma27b/entity_dictionary.json",
+    vault_path: str = None
+):
+    """entity_dict_path 已存在时沿用其中的占位符，运行结束后写回（包含新出现的实体）"""
+    print("开始处理Excel（语料级一致占位符）:", input_excel_path)
+    df = pd.read_excel(input_excel_path)
+
+    if col_body not in df.columns or col_private_llm not in df.columns:
+        raise ValueError("Excel文件中缺少所需的列(body或Private_llama3.2:3b)")
 
+    entities = EntityDictionary(entity_dict_path)
+    known_entities = len(entities)
+    global_pairs = []
+    vault = _open_vault(vault_path)
+
+    total_rows = len(df)
+    print(f"共读取到 {total_rows} 行数据，已有实体 {known_entities} 个，即将开始处理...")
+
+    for row_idx in range(total_rows):
+        if row_idx % 50 == 0:
+            print(f">> 正在处理第 {row_idx + 1} 行 / 共 {total_rows} 行...")
+
+        original_text = str(df.at[row_idx, col_body])
+        processed_text = str(df.at[row_idx, col_private_llm])
+
+        row_pairs, json_value, result_text, canonical_text, map_value = mask_row_consistent(
+            original_text, processed_text, entities
+        )
+
+        df.at[row_idx, col_json] = json_value
         df.at[row_idx, col_result] = result_text
+        df.at[row_idx, col_canonical] = canonical_text
+        df.at[row_idx, col_canonical_map] = map_value
 
-        # 将本行结果追加到全局列表
-        for pair in row_pairs:
-            global_pairs.append({
-                "rowIndex": row_idx,
-                "id": pair["id"],
-                "key": pair["key"],
-                "originalValue": pair["originalValue"],
-                "replacedValue": pair["replacedValue"]
-            })
+        global_pairs.extend(global_records(row_idx, row_pairs))
+        if vault is not None:
+            vault.append(row_idx, row_pairs)
 
     print("所有行处理完毕，正在写出全局 JSON 文件:", output_json_path)
     with open(output_json_path, 'w', encoding='utf-8') as f:
         json.dump(global_pairs, f, ensure_ascii=False, indent=2)
+    _close_vault(vault)
+
+    if entity_dict_path:
+        entities.save()
+    print(f"实体字典共 {len(entities)} 个（本次新增 {len(entities) - known_entities} 个）:", entity_dict_path)
+    _print_identical_report(list(df[col_result]), list(df[col_canonical]))
 
     print("正在写出处理结果到新的Excel文件:", output_excel_path)
     df.to_excel(output_excel_path, index=False)
     print("处理完成！")
 
 
+def _print_identical_report(masked: list, canonical: list):
+    """规范化前后完全相同的遮盖结果"""
+    before = identical_report(masked)
+    after = identical_report(canonical)
+    print(f"masked_prompt: {before['distinct']} 种不同文本，{before['duplicate_rows']} 行与其他行完全相同")
+    print(f"canonical_prompt: {after['distinct']} 种不同文本，{after['duplicate_rows']} 行与其他行完全相同"
+          f"（{after['groups']} 组），规范化后新增 {after['duplicate_rows'] - before['duplicate_rows']} 行")
+
+
+def process_restore_excel_consistent_streaming(
+    input_excel_path: str = "gemma27b/privacy.xlsx",
+    output_excel_path: str = "gemma27b/mask_prompt.xlsx",
+    output_json_path: str = "gemma27b/storage_privacy.json",
+    entity_dict_path: str = "gemma27b/entity_dictionary.json",
+    vault_path: str = None
+):
+    """
+    与 process_restore_excel_consistent 相同，但逐行读取、逐行写出（见 excel_stream.py）。
+    实体编号取决于行的先后顺序，因此只在本进程内按顺序处理；统计重复时只保留每行文本的摘要。
+    """
+    print("开始处理Excel（语料级一致占位符，流式）:", input_excel_path)
+
+    reader = ExcelRowReader(input_excel_path)
+    if col_body not in reader.header or col_private_llm not in reader.header:
+        reader.close()
+        raise ValueError("Excel文件中缺少所需的列(body或Private_llama3.2:3b)")
+    body_pos = reader.header.index(col_body)
+    private_pos = reader.header.index(col_private_llm)
+
+    entities = EntityDictionary(entity_dict_path)
+    known_entities = len(entities)
+    masked_digests = []
+    canonical_digests = []
+    vault = _open_vault(vault_path)
+    columns = (col_json, col_result, col_canonical, col_canonical_map)
+    with reader, ExcelRowWriter(output_excel_path, reader.header, columns) as writer, \
+            open(output_json_path, "w", encoding="utf-8") as f_json:
+        json_writer = JsonArrayWriter(f_json)
+        for row in reader:
+            row_idx = writer.rows
+            row_pairs, json_value, result_text, canonical_text, map_value = mask_row_consistent(
+                cell_text(row[body_pos]), cell_text(row[private_pos]), entities
+            )
+            writer.write(row, dict(zip(columns, (json_value, result_text, canonical_text, map_value))))
+            for record in global_records(row_idx, row_pairs):
+                json_writer.write(record)
+            if vault is not None:
+                vault.append(row_idx, row_pairs)
+            masked_digests.append(hashlib.sha1(result_text.encode("utf-8")).digest())
+            canonical_digests.append(hashlib.sha1(canonical_text.encode("utf-8")).digest())
+            if (row_idx + 1) % 1000 == 0:
+                print(f">> 已处理 {row_idx + 1} 行...")
+        json_writer.close()
+        print(f"共处理 {writer.rows} 行，全局 JSON 文件已写出:", output_json_path)
+        print("正在保存Excel文件:", output_excel_path)
+    _close_vault(vault)
+
+    if entity_dict_path:
+        entities.save()
+    print(f"实体字典共 {len(entities)} 个（本次新增 {len(entities) - known_entities} 个）:", entity_dict_path)
+    _print_identical_report(masked_digests, canonical_digests)
+    print("处理完成！")
+
+
 if __name__ == "__main__":
-    process_restore_excel()
+    {
+        "dataframe": process_restore_excel,
+        "streaming": process_restore_excel_streaming,
+        "parallel": process_restore_excel_parallel,
+        "consistent": process_restore_excel_consistent,
+        "consistent_streaming": process_restore_excel_consistent_streaming,
+    }[mode]()
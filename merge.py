@@ -218,6 +218,7 @@
 
 import re
 import json
+import time
 import pandas as pd
 import os
 
@@ -226,6 +227,11 @@ import os
 # 并在程序里导入：
 import openai
 
+from llm_metrics import get_metrics, metrics_path_for
+from remote_engine import RemoteReplyEngine
+from batch_reply import BatchReplyRunner
+from reply_cache import ReplyCache, CachedReplies
+
 # 这里示例你可把 API Key 放到环境变量，或硬编码(不推荐)
 # os.environ["OPENAI_API_KEY"] = "sk-xxxx"
 # openai.api_key = os.getenv("OPENAI_API_KEY", "<YOUR_API_KEY_HERE>")
@@ -241,14 +247,17 @@ def call_gpt_api(prompt, model="gpt-4", temperature=0.0):
     """
     try:
         # 这里仅作示例，可根据你的实际需求补充 messages、system 提示等
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature
-        )
+        with get_metrics().track(model, "remote") as call:
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature
+            )
+            call["prompt_tokens"] = response["usage"]["prompt_tokens"]
+            call["output_tokens"] = response["usage"]["completion_tokens"]
         reply_text = response["choices"][0]["message"]["content"]
         return reply_text.strip()
     except Exception as e:
@@ -336,7 +345,10 @@ def unmask_text(reply_mask_text, privacy_list):
     return restored_text
 
 
-def main_pipeline(input_excel, output_excel_masked, output_excel_restored):
+def main_pipeline(input_excel, output_excel_masked, output_excel_restored,
+                  use_async_engine=True, rpm=500, tpm=30000, concurrency=32,
+                  use_batch_api=False, batch_requests_file="all/batch_requests.jsonl",
+                  reply_cache_path="all/reply_cache.sqlite"):
     """
     主流程:
       1. 读取 input_excel (all/qwen7b_detection.xlsx)
@@ -346,6 +358,10 @@ def main_pipeline(input_excel, output_excel_masked, output_excel_restored):
       5. 反向还原 -> restored_value
       6. 输出最终到 output_excel_restored
     其中我们会在中间把含有 masked_prompt, reply_mask 等列暂存到 output_excel_masked
+    use_async_engine=True 时第 4 步用 remote_engine.RemoteReplyEngine 并发调用，
+    rpm / tpm 为账号限额，concurrency 为同时在途的请求数上限；False 时逐行调用 call_gpt_api
+    use_batch_api=True 时改用 Batch API（batch_reply.BatchReplyRunner），请求文件写到 batch_requests_file
+    reply_cache_path 不为空时，这两种模式下相同的 masked_prompt 共用缓存中的回复（reply_cache.py）
     """
     df = pd.read_excel(input_excel)
     
@@ -368,7 +384,6 @@ def main_pipeline(input_excel, output_excel_masked, output_excel_restored):
     
     # 1) 解析 B 列、存储 privacy_list
     # 2) 将 A 列文本替换 -> masked_prompt
-    # 3) 调用 GPT -> reply_mask
     for i in range(len(df)):
         text_b = df.at[i, col_b]
         text_a = df.at[i, col_a]
@@ -385,18 +400,52 @@ def main_pipeline(input_excel, output_excel_masked, output_excel_restored):
             masked = text_a
         
         df.at[i, col_masked] = masked
-        
-        # 调用 GPT 并将结果写到 reply_mask 列
-        # 如果你不想每一行都调用 GPT，可以根据需要做批量处理
+    
+    # 3) 调用 GPT -> reply_mask
+    # 如果你不想每一行都调用 GPT，可以根据需要做批量处理
+    prompts = []
+    for i in range(len(df)):
+        masked = df.at[i, col_masked]
         if masked and isinstance(masked, str) and masked.strip():
-            gpt_reply = call_gpt_api(masked)  # 这里就是向 GPT-4o 发送 masked_prompt
-            df.at[i, col_reply] = gpt_reply
+            prompts.append((i, masked))
         else:
             df.at[i, col_reply] = ""
     
+    if use_async_engine or use_batch_api:
+        # 与 call_gpt_api 相同的模型、system 提示和温度
+        if use_batch_api:
+            engine = BatchReplyRunner("gpt-4", system_prompt="You are a helpful assistant.", temperature=0.0,
+                                      requests_path=batch_requests_file)
+        else:
+            engine = RemoteReplyEngine("gpt-4", system_prompt="You are a helpful assistant.", temperature=0.0,
+                                       rpm=rpm, tpm=tpm, concurrency=concurrency)
+        
+        def on_result(i, result):
+            if result["error"]:
+                print(f"Error calling GPT API: {result['error']}")
+            df.at[i, col_reply] = result["text"]
+        
+        start = time.time()
+        if reply_cache_path:
+            cache = ReplyCache(reply_cache_path)
+            runner = CachedReplies(cache, engine)
+            runner.generate(prompts, on_result=on_result)
+            runner.print_stats()
+            cache.close()
+        else:
+            engine.generate(prompts, on_result=on_result)
+        engine.print_stats(time.time() - start)
+    else:
+        for i, masked in prompts:
+            gpt_reply = call_gpt_api(masked)  # 这里就是向 GPT-4o 发送 masked_prompt
+            df.at[i, col_reply] = gpt_reply
+    
     # 先把带有 reply_mask 的结果暂存输出
     df.to_excel(output_excel_masked, index=False)
     print(f"[STEP] Masked + GPT reply -> {output_excel_masked}")
+    get_metrics().print_summary()
+    get_metrics().write_report(metrics_path_for(output_excel_masked),
+                               {"script": "merge.py", "input": input_excel, "rows": len(df)})
     
     # 4) 反向还原
     for i in range(len(df)):
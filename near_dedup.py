@@ -0,0 +1,139 @@
+import re
+import zlib
+import numpy as np
+
+from detect_modes import parse_pairs, format_pairs
+
+# ------------------------------------------------------------------------------
+# 近似重复邮件聚类（检测之前运行）
+# ------------------------------------------------------------------------------
+# Enron 数据中有大量转发、重复的正文。先按规范化后的全文找完全重复，再用
+# MinHash + LSH 找近似重复（词 3-gram 的 Jaccard 相似度不低于 threshold），
+# 每个簇只检测代表行（最长的正文，转发邮件通常包含原文），
+# 代表行的结果再映射回簇内其他行：只保留在该行正文中确实出现的 value。
+# 映射无法补上只在成员行中出现的敏感信息，因此 privacy_detect_local.py 默认只合并
+# 正文逐字相同的行（group_identical，结果原样复用，没有召回损失），近似重复聚类需要显式开启。
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").lower()))
+
+
+def shingles(text: str, k: int = 3) -> set:
+    """词 k-gram 集合（哈希成 32 位整数）；不足 k 个词时整段作为一个 shingle"""
+    words = normalize(text).split()
+    if len(words) < k:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+
+class MinHasher:
+    """num_perm 个 (a*x + b) mod p 哈希函数，固定随机种子，保证多次运行结果一致"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        hashed = (np.outer(x, self.a) + self.b) % np.uint64(_MERSENNE_PRIME)
+        return hashed.min(axis=0)
+
+
+def group_identical(items: list) -> dict:
+    """
+    items: [(行号, 正文), ...]
+    只合并正文逐字相同的行，返回格式与 cluster_near_duplicates 相同；代表行为每组的第一行。
+    """
+    groups = {}
+    for idx, body in items:
+        groups.setdefault(body or "", []).append(idx)
+    return {min(members): sorted(members) for members in groups.values()}
+
+
+def cluster_near_duplicates(items: list, threshold: float = 0.8, num_perm: int = 128,
+                            bands: int = 16) -> dict:
+    """
+    items: [(行号, 正文), ...]
+    返回 {代表行号: [簇内所有行号（含代表行，按行号排序）], ...}；没有重复的行自成一簇。
+    LSH 分 bands 段，每段 num_perm // bands 个哈希值完全相同的行成为候选对，
+    候选对的估计 Jaccard 相似度不低于 threshold 才合并。
+    """
+    bodies = {idx: body or "" for idx, body in items}
+    parent = {idx: idx for idx in bodies}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    # 1) 完全重复（忽略大小写、标点和空白差异）
+    exact = {}
+    for idx, body in bodies.items():
+        key = normalize(body)
+        if key in exact:
+            union(exact[key], idx)
+        else:
+            exact[key] = idx
+
+    # 2) 近似重复：只对每组完全重复中的一行计算 MinHash
+    hasher = MinHasher(num_perm)
+    rows_per_band = num_perm // bands
+    signatures = {idx: hasher.signature(shingles(bodies[idx])) for idx in exact.values()}
+    buckets = {}
+    for idx, sig in signatures.items():
+        for band in range(bands):
+            key = (band, sig[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+            buckets.setdefault(key, []).append(idx)
+    for candidates in buckets.values():
+        for pos, i in enumerate(candidates):
+            for j in candidates[:pos]:
+                if find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                    union(i, j)
+
+    groups = {}
+    for idx in bodies:
+        groups.setdefault(find(idx), []).append(idx)
+    clusters = {}
+    for members in groups.values():
+        members.sort()
+        representative = max(members, key=lambda i: (len(bodies[i]), -i))
+        clusters[representative] = members
+    return clusters
+
+
+def project_result(result: dict, representative_body: str, member_body: str) -> dict:
+    """
+    把代表行的检测结果映射到簇内另一行：正文相同时原样复用，
+    否则只保留在该行正文中出现的 value（输出 "key": "value" 列表）。
+    映射出的结果没有调用模型，耗时和 token 数记为 0。
+    """
+    if member_body == representative_body:
+        text = result.get("text", "")
+    else:
+        pairs = [(key, value) for key, value in parse_pairs(result.get("text", "")) if value in member_body]
+        text = format_pairs(pairs)
+    projected = {"model": result.get("model"), "text": text, "deduplicated": True,
+                 "prompt_eval_count": 0, "eval_count": 0, "total_duration": 0, "load_duration": 0}
+    if result.get("error"):
+        projected["error"] = result["error"]
+    return projected
+
+
+def dedup_ratio(clusters: dict) -> float:
+    """被合并掉的行所占比例：1 - 簇数 / 行数"""
+    total = sum(len(members) for members in clusters.values())
+    return 1 - len(clusters) / total if total else 0.0
@@ -0,0 +1,203 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+from rule_detector import find_spans
+from privacy_accuracy import parse_values, compute_metrics
+
+# ------------------------------------------------------------------------------
+# "无敏感信息" 门控：在调用 LLM 之前判断邮件是否完全不含敏感信息
+# ------------------------------------------------------------------------------
+# 特征为哈希后的字符 n-gram 计数（L2 归一化），模型为 NumPy 实现的逻辑回归，
+# 用 enron_labeled.xlsx 的 Ground Truth 训练：列表为空的行标记为 "clean"。
+# 预测 P(clean) 不低于阈值、且规则检测也没有命中的行直接判为 None，不再调用 LLM。
+#
+# 用法：
+#   python pii_gate.py   # 交叉验证各阈值的跳过率与召回损失，然后用全部数据训练并保存
+
+labeled_file = "enron_labeled.xlsx"
+ground_truth_col = "Ground Truth"
+DEFAULT_GATE_PATH = "all/pii_gate.npz"
+cv_folds = 5
+
+_HASH_MULT = np.uint64(0x100000001B3)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def featurize(text: str, bits: int = 14, ngram_range=(2, 4)) -> np.ndarray:
+    """哈希字符 n-gram：长度 2**bits 的计数向量，L2 归一化；整个过程向量化，不逐个 n-gram 循环"""
+    data = np.frombuffer((text or "").lower().encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    indices = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(data) - n + 1
+        if count <= 0:
+            continue
+        h = np.full(count, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * _HASH_MULT + data[k:k + count]
+        indices.append((h * _MIX) >> np.uint64(64 - bits))
+    x = np.zeros(1 << bits, dtype=np.float64)
+    if indices:
+        x += np.bincount(np.concatenate(indices).astype(np.int64), minlength=1 << bits)
+        x /= np.linalg.norm(x)
+    return x
+
+
+def train_logistic(X: np.ndarray, y: np.ndarray, l2: float = 1e-3, lr: float = 1.0,
+                   epochs: int = 300) -> tuple:
+    """批量梯度下降；正负样本按类别频率加权（clean 行通常很少）"""
+    n, d = X.shape
+    w = np.zeros(d)
+    b = 0.0
+    pos = max(y.sum(), 1)
+    neg = max(n - y.sum(), 1)
+    sample_weight = np.where(y == 1, n / (2 * pos), n / (2 * neg))
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-(X @ w + b)))
+        err = (p - y) * sample_weight
+        w -= lr * (X.T @ err / n + l2 * w)
+        b -= lr * err.mean()
+    return w, b
+
+
+class PiiGate:
+    """P(clean) = sigmoid(w · featurize(text) + b)"""
+
+    def __init__(self, weights: np.ndarray, bias: float, bits: int = 14):
+        self.weights = weights
+        self.bias = bias
+        self.bits = bits
+
+    @classmethod
+    def train(cls, texts: list, clean_labels: list, bits: int = 14, **kwargs) -> "PiiGate":
+        X = np.stack([featurize(t, bits) for t in texts])
+        w, b = train_logistic(X, np.asarray(clean_labels, dtype=np.float64), **kwargs)
+        return cls(w, b, bits)
+
+    @classmethod
+    def load(cls, path: str) -> "PiiGate":
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"]), int(data["bits"]))
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, bits=self.bits)
+
+    def prob_clean(self, text: str) -> float:
+        z = float(featurize(text, self.bits) @ self.weights + self.bias)
+        return 1 / (1 + np.exp(-z))
+
+
+def load_labeled(path: str = labeled_file) -> tuple:
+    """返回 (正文列表, Ground Truth 列表的列表)"""
+    df = pd.read_excel(path, dtype=str)
+    texts = [body if pd.notna(body) else "" for body in df.iloc[:, 0]]
+    truths = [parse_values(value) for value in df[ground_truth_col]]
+    return texts, truths
+
+
+def load_or_train(path: str = DEFAULT_GATE_PATH, labeled_path: str = labeled_file) -> PiiGate:
+    """已有训练好的权重时直接加载，否则用标注数据训练并保存"""
+    if os.path.exists(path):
+        return PiiGate.load(path)
+    texts, truths = load_labeled(labeled_path)
+    gate = PiiGate.train(texts, [len(gt) == 0 for gt in truths])
+    gate.save(path)
+    return gate
+
+
+class NoPiiGate:
+    """
+    包装 call_fn(model_name, email_body) -> dict：P(clean) >= threshold 且规则检测没有命中的行
+    直接返回 "None"，不调用 LLM。skipped / total 统计跳过的行数。
+    """
+
+    def __init__(self, call_fn, gate: PiiGate, threshold: float = 0.9):
+        self.call_fn = call_fn
+        self.gate = gate
+        self.threshold = threshold
+        self.total = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        clean = self.gate.prob_clean(email_body) >= self.threshold and not find_spans(email_body)
+        with self._lock:
+            self.total += 1
+            if clean:
+                self.skipped += 1
+        if not clean:
+            return self.call_fn(model_name, email_body)
+        return {
+            "model": model_name,
+            "text": "None",
+            "gated": True,
+            "prompt_eval_count": 0,
+            "eval_count": 0,
+            "total_duration": 0,
+            "load_duration": 0,
+        }
+
+
+# ------------------------------------------------------------------------------
+# 评测：k 折交叉验证，按 privacy_accuracy 的指标计算跳过带来的召回损失
+# ------------------------------------------------------------------------------
+def recall_cost(truths: list, skipped: list) -> tuple:
+    """
+    假设未跳过的行检测完全正确（预测 = Ground Truth），被跳过的行预测为空，
+    返回 (macro recall, 召回损失 = 1 - macro recall)；即门控本身造成的召回上限损失。
+    """
+    recalls = [compute_metrics(gt, [] if skip else gt)[1] for gt, skip in zip(truths, skipped)]
+    macro_recall = float(np.mean(recalls)) if recalls else 1.0
+    return macro_recall, 1 - macro_recall
+
+
+def main():
+    texts, truths = load_labeled()
+    labels = np.array([len(gt) == 0 for gt in truths], dtype=np.float64)
+    X = np.stack([featurize(t) for t in texts])
+    has_rule_hit = np.array([bool(find_spans(t)) for t in texts])
+    print(f"标注数据 {len(texts)} 行，其中无敏感信息 {int(labels.sum())} 行")
+
+    # k 折交叉验证：每行的概率来自不含该行训练出的模型（clean 行很少，按类别交错分折）
+    order = np.concatenate([np.flatnonzero(labels == 1), np.flatnonzero(labels == 0)])
+    fold_of = np.empty(len(texts), dtype=int)
+    fold_of[order] = np.arange(len(texts)) % cv_folds
+    probs = np.zeros(len(texts))
+    for fold in range(cv_folds):
+        test = fold_of == fold
+        w, b = train_logistic(X[~test], labels[~test])
+        probs[test] = 1 / (1 + np.exp(-(X[test] @ w + b)))
+
+    rows = []
+    for threshold in (0.5, 0.7, 0.8, 0.9, 0.95, 0.99):
+        skipped = (probs >= threshold) & ~has_rule_hit
+        macro_recall, cost = recall_cost(truths, list(skipped))
+        rows.append({
+            "Threshold": threshold,
+            "Skipped Rows": int(skipped.sum()),
+            "Skip Rate": float(skipped.mean()),
+            "Clean Rows Skipped": int((skipped & (labels == 1)).sum()),
+            "PII Rows Skipped": int((skipped & (labels == 0)).sum()),
+            "Macro Recall": macro_recall,
+            "Recall Cost": cost,
+        })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    gate = PiiGate.train(texts, list(labels))
+    start = time.perf_counter()
+    for t in texts:
+        gate.prob_clean(t)
+    per_email = (time.perf_counter() - start) / len(texts)
+    print(f"平均每封邮件预测耗时: {per_email * 1e6:.0f} 微秒")
+
+    gate.save(DEFAULT_GATE_PATH)
+    print(f"门控模型已保存到: {DEFAULT_GATE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
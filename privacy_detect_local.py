@@ -1,7 +1,19 @@
-import subprocess
 import time
 import pandas as pd
 
+from local_llm import get_client, ns_to_s
+from prompts import PROMPT_TEMPLATE_8, PROMPT_TEMPLATE_SPANS, PROMPT_TEMPLATE_BATCH
+from detect_engine import run_detection
+from detection_cache import DetectionCache
+from run_journal import RunJournal, journal_path_for
+from rule_detector import RuleFastPath
+from pii_gate import NoPiiGate, load_or_train
+from llm_metrics import get_metrics, metrics_path_for
+from near_dedup import group_identical, cluster_near_duplicates, project_result, dedup_ratio
+from mask_prompt import StreamingRowMasker, mask_row
+from detect_modes import (ChunkedDetector, StreamingDetector, SpanDetector, PrefixReuseDetector,
+                          BatchedDetector, CascadeDetector)
+
 # ------------------------------------------------------------------------------
 # 1) 配置部分
 # ------------------------------------------------------------------------------
@@ -9,25 +21,7 @@ import pandas as pd
 input_file = "enron.xlsx"
 output_file = "all/detection_time_qwen7b.xlsx"  # 输出文件名稍作修改
 
-PROMPT_TEMPLATE_8 = """In the following sentence, please convert all mentions of specific names, specific places, and numbers that may be sensitive into a format that represents the type of information they belong to.
-Format requirements:
-1. Always use double quotes for both keys and values: "key": "value"
-2. Keep the rest of the sentence unchanged
-3. Place the key-value pair exactly where the original information appears
-
-You may select keys from the following list: Person Name, Email Address, Phone Number, Physical Address, password, Job Title, Organization, important time;
-
-Here's an Example:
-Input: Please write a greeting card for Nancy and her email address is nancy@gmail.com.
-Output: Please write a greeting card for "name": "Nancy" and her email address is "email address": "nancy@gmail.com".
-
-Note: Every piece of sensitive information MUST be converted to "key": "value" format with double quotes. If not applicable, return "None". Don't use the example in the real output, just follow the format.
-Real Input:
-{}
-
-Real Output:
-
-"""
+# 检测用的 Prompt 模板定义在 prompts.py 中（PROMPT_TEMPLATE_8）
 
 # Prompt 模板（示例模板）
 # PROMPT_TEMPLATE_9 = """Convert all sensitive information in the following sentence into "key": "value" format (using double quotes for both keys and values) without altering the rest of the text.
@@ -48,6 +42,80 @@ Real Output:
 # Real Output:
 # """
 
+# Ollama 主机列表：多个地址时按在途请求数分配请求，故障主机自动跳过并把请求换到其他主机重试；
+# None 表示使用环境变量 OLLAMA_HOSTS / OLLAMA_HOST（默认 localhost:11434）
+ollama_hosts = None  # 例如 ["http://localhost:11434", "http://localhost:11435"]
+
+# 并发设置：每个模型同时在途的请求数（整数，或 {模型名: 并发数} 字典）
+# 需要 Ollama 服务端设置 OLLAMA_NUM_PARALLEL >= 该值；多台主机时按主机数相应调大
+max_in_flight = 4
+
+# 要处理的行数上限，None 表示处理全部行
+max_rows = 105
+
+# 检测结果缓存：模型、模板、正文、生成参数都相同的行直接复用上次结果；None 表示不使用缓存
+cache_path = "all/detection_cache.sqlite"
+
+# 规则快速通道：邮箱/电话/时间/金额/URL 先用正则检测，规则已覆盖全部敏感信息的行不再调用 LLM
+use_rule_fast_path = True
+
+# 无敏感信息门控：哈希字符 n-gram + 逻辑回归（pii_gate.py，用 enron_labeled.xlsx 训练），
+# 预测 P(clean) 不低于阈值且规则没有命中的行直接判为 None；None 表示不使用。
+# 各阈值的跳过率与召回损失见 `python pii_gate.py` 的输出
+pii_gate_path = None  # 例如 "all/pii_gate.npz"（不存在时自动训练并保存）
+pii_gate_threshold = 0.9
+
+# 重复正文去重：正文逐字相同的行只检测一次，结果原样复用到其他行（没有召回损失）
+dedup_identical = True
+
+# 近似重复聚类：完全相同（忽略大小写和标点）或 MinHash 估计相似度不低于该阈值的正文归为一簇，
+# 每簇只检测一次，结果映射回簇内其他行（只保留该行正文中出现的内容）；None 表示不使用。
+# 注意：只出现在簇内某一行、代表行里没有的敏感信息（例如转发时新加的署名）不会被检测到，
+# 确认召回损失可以接受时再设置，例如 0.8；设置后代替 dedup_identical
+dedup_threshold = None
+
+# 长邮件分块：正文超过该长度（字符）时按句子切成窗口并发检测，再合并去重；None 表示不分块
+chunk_max_chars = 1500
+
+# 单封邮件同时检测的窗口数
+chunk_parallel = 4
+
+# 检测模式："rewrite" 让模型改写整封邮件（PROMPT_TEMPLATE_8），
+#          "spans" 用 JSON Schema 约束模型只输出 {type, value} 列表（输出 token 少得多），
+#          "prefix" 同 rewrite，但固定的说明和示例作为 system 前缀复用，只对邮件部分做 prompt eval
+detect_mode = "rewrite"
+
+# 批量检测（仅 rewrite 模式）：每个请求打包多少封邮件，1 表示不打包；
+# 答案格式不对的行会单独重查
+batch_size = 1
+
+# 流式检测（仅 rewrite 模式）：边生成边解析 "key": "value"，模型回答 None 时立即终止生成
+use_streaming = False
+
+# 边检测边遮盖（仅流式检测）：每个 pair 闭合时立即在原文上替换（编号规则与 mask_prompt.py 相同），
+# 生成结束时遮盖结果已就绪，写入 "Masked_<模型名>" 和 "Privacy_<模型名>" 两列
+stream_masking = True
+
+# 级联检测：先用该小模型检测，答案不可靠时（无法解析、value 不在原文、仍有未遮盖的人名/机构名、
+# 与规则检测不一致）才交给 model_list 中的大模型；None 表示不使用级联。
+# model_major 调度下小模型随每个大模型一起预加载，全部跑完后卸载
+cascade_small_model = None  # 例如 "gemma3:1b"
+
+# 级联检测允许小模型答案中残留的疑似人名/机构名（连续多个大写词）个数，超过则升级。
+# 用 enron_labeled.xlsx 的标注当作"完全正确的小模型"回放：0 时升级 44/100 行（其中因残留人名 38 行），
+# 小模型漏掉每行最长的值时能发现 59/66 行；调到 2 升级 40 行，但只能发现 43/66 行
+cascade_max_unmasked = 0
+
+# 传给 Ollama 的生成参数（也是缓存键的一部分），None 表示使用模型默认值
+generation_options = None
+
+# 调度方式："model_major" 一个模型跑完所有行再换下一个（每个模型只加载一次），
+#          "interleaved" 所有模型同时跑（内存足够同时驻留多个模型时使用）
+schedule = "model_major"
+
+# 模型在 Ollama 中的驻留时间；跑完一个模型后会显式卸载
+keep_alive = "10m"
+
 # 本地模型列表（更新后的模型名称列表）
 model_list = [
     "qwen2.5:7b"
@@ -58,11 +126,16 @@ output_col_names = [
     "Private_qwen2.5:7b"
 ]
 
-# 存储每个模型处理时间的列名
+# 存储每个模型处理时间（推理耗时，不含模型加载）的列名
 time_col_names = [
     "Time_qwen2.5:7b"
 ]
 
+# 存储每个模型加载耗时的列名
+load_col_names = [
+    "Load_qwen2.5:7b"
+]
+
 # # 模型回复的列名
 # output_col_names = [
 #     "Private_gemma3:1b",
@@ -91,64 +164,227 @@ for col_name in output_col_names:
         df[col_name] = ""
 
 # 确保每个时间记录的列存在于 DataFrame 中
-for col_name in time_col_names:
+for col_name in time_col_names + load_col_names:
     if col_name not in df.columns:
         df[col_name] = ""
 
 # ------------------------------------------------------------------------------
 # 3) 定义调用本地模型的函数
 # ------------------------------------------------------------------------------
-def call_llama_local(model_name: str, email_body: str) -> str:
+def call_llama_local(model_name: str, email_body: str) -> dict:
     """
-    通过 `ollama run <model_name>` 调用指定的本地 LLM 模型，并返回模型的输出结果。
+    通过 Ollama HTTP 接口（连接池复用）调用指定的本地 LLM 模型。
+    返回结果字典：text、prompt_eval_count、eval_count 以及服务端各项耗时（纳秒）。
     """
     prompt = PROMPT_TEMPLATE_8.format(email_body)
-    process = subprocess.run(
-        ["ollama", "run", model_name],
-        input=prompt,
-        text=True,
-        capture_output=True
-    )
-    return process.stdout.strip()
+    return get_client().generate(model_name, prompt, options=generation_options, keep_alive=keep_alive)
+
+def stream_llama_local(model_name: str, email_body: str):
+    """流式版本：返回 Ollama 响应块的迭代器，供 StreamingDetector 使用"""
+    prompt = PROMPT_TEMPLATE_8.format(email_body)
+    return get_client().generate_stream(model_name, prompt, options=generation_options, keep_alive=keep_alive)
+
+def preload_model(model_name: str) -> dict:
+    """在上一个模型排空时提前加载下一个模型；级联检测时小模型也一起加载（已驻留时只刷新驻留时间）"""
+    if cascade_small_model is not None:
+        get_client().load_model(cascade_small_model, keep_alive=keep_alive)
+    return get_client().load_model(model_name, keep_alive=keep_alive)
+
+def unload_model(model_name: str) -> dict:
+    return get_client().unload_model(model_name)
 
 # ------------------------------------------------------------------------------
-# 4) 处理每一行数据并统计处理时间，每处理10行写入一次Excel文件
+# 4) 并发处理每一行数据并统计处理时间
+#    每完成一个 (行, 模型) 追加写入 journal，断点续跑时跳过已完成的行，
+#    Excel 只在最后生成一次
 # ------------------------------------------------------------------------------
 start_time = time.time()
 
-# 控制要处理的行数，这里取前 105 行或者较小者（可以根据需要修改）
-rows_to_process = min(105, num_rows)
-
-for idx in range(rows_to_process):
-    # 假定数据中的文本位于第一列，如果为空则赋空字符串
-    email_text = df.iloc[idx, 0] if pd.notna(df.iloc[idx, 0]) else ""
-    
-    # 针对每个模型调用处理，并记录返回结果及处理时间
-    for model_name, out_col, time_col in zip(model_list, output_col_names, time_col_names):
-        row_start_time = time.time()  # 记录开始时间
-        model_response = call_llama_local(model_name, email_text)
-        row_end_time = time.time()    # 记录结束时间
-        elapsed_time = row_end_time - row_start_time  # 计算耗时
-        
-        # 将模型的回复和处理时间分别保存到 DataFrame 对应的列中
-        df.at[idx, out_col] = model_response
-        df.at[idx, time_col] = f"{elapsed_time:.2f}"  # 保留两位小数
-        
-        print(f"处理第 {idx} 行数据，模型 {model_name} 用时: {elapsed_time:.2f} 秒")
-    
-    # 每处理10行写一次文件，或者最后一行也写入
-    if (idx + 1) % 10 == 0 or (idx + 1) == rows_to_process:
-        df.to_excel(output_file, index=False)
-        print(f"Checkpoint: 已写入 {idx + 1} 行数据到 {output_file}")
+rows_to_process = num_rows if max_rows is None else min(max_rows, num_rows)
+
+journal = RunJournal(journal_path_for(output_file))
+resume_from = journal.first_incomplete_row(range(rows_to_process), model_list)
+if resume_from is not None and resume_from > 0:
+    print(f"从 journal 恢复：第 {resume_from} 行之前已全部完成")
+
+# 假定数据中的文本位于第一列，如果为空则赋空字符串
+bodies = {idx: df.iloc[idx, 0] if pd.notna(df.iloc[idx, 0]) else "" for idx in range(rows_to_process)}
+
+# 去重 / 近似重复聚类：{代表行: [簇内所有行]}，只把代表行交给引擎
+if dedup_threshold is not None:
+    clusters = cluster_near_duplicates(list(bodies.items()), threshold=dedup_threshold)
+elif dedup_identical:
+    clusters = group_identical(list(bodies.items()))
+else:
+    clusters = {idx: [idx] for idx in bodies}
+
+def cluster_done(idx: int, model_name: str) -> bool:
+    """簇内所有行都已完成该模型，引擎才跳过这个代表行（断点续跑）"""
+    return all(journal.is_done(member, model_name) for member in clusters[idx])
+
+rows = [
+    (idx, bodies[idx])
+    for idx in sorted(clusters)
+    if not all(cluster_done(idx, m) for m in model_list)
+]
+
+def inference_time(result: dict) -> float:
+    """服务端 total_duration 减去模型加载时间，即纯推理耗时（秒）"""
+    return ns_to_s(result.get("total_duration")) - ns_to_s(result.get("load_duration"))
+
+def write_result(idx: int, model_name: str, result: dict):
+    """将模型的回复、推理时间和加载时间分别保存到 DataFrame 对应的列中"""
+    m_idx = model_list.index(model_name)
+    df.at[idx, output_col_names[m_idx]] = result["text"]
+    df.at[idx, time_col_names[m_idx]] = f"{inference_time(result):.2f}"  # 保留两位小数
+    df.at[idx, load_col_names[m_idx]] = f"{ns_to_s(result.get('load_duration')):.2f}"
+    if stream_masker is not None:
+        if "masked_text" not in result:
+            # 映射到同簇其他行的结果没有经过流式遮盖，按最终输出遮盖
+            _, result["privacy_json"], result["masked_text"] = mask_row(bodies[idx], result["text"])
+        df.at[idx, f"Masked_{model_name}"] = result["masked_text"]
+        df.at[idx, f"Privacy_{model_name}"] = result["privacy_json"]
+
+def on_result(idx: int, model_name: str, result: dict):
+    """引擎按行号顺序回调（每个模型各自有序）：追加写 journal，并映射到同簇的其他行"""
+    if stream_masker is not None:
+        _, result["privacy_json"], result["masked_text"] = stream_masker.finish(
+            model_name, bodies[idx], result["text"])
+    journal.append(idx, model_name, result)
+    for member in clusters[idx]:
+        if member != idx:
+            journal.append(member, model_name, project_result(result, bodies[idx], bodies[member]))
+
+    source = ("门控跳过" if result.get("gated") else "规则" if result.get("rule_only")
+              else "缓存命中" if result.get("cached") else "模型调用")
+    if "escalated" in result:
+        source += f", 级联: {result['cascade_model']}"
+    print(f"处理第 {idx} 行数据，模型 {model_name} 推理用时: {inference_time(result):.2f} 秒 "
+          f"(加载 {ns_to_s(result.get('load_duration')):.2f} 秒) [{source}] "
+          f"(prompt tokens: {result.get('prompt_eval_count', 0)}, "
+          f"output tokens: {result.get('eval_count', 0)})")
+
+# 批量模式下每个在途请求携带 batch_size 行，引擎需要相应更多的 worker 才能攒满一批
+if detect_mode == "rewrite" and batch_size > 1:
+    max_in_flight = ({m: n * batch_size for m, n in max_in_flight.items()} if isinstance(max_in_flight, dict)
+                     else max_in_flight * batch_size)
+
+# 连接池大小与总并发数一致
+total_in_flight = (sum(max_in_flight.values()) if isinstance(max_in_flight, dict)
+                   else max_in_flight * len(model_list))
+if chunk_max_chars is not None:
+    total_in_flight *= chunk_parallel
+client = get_client(pool_size=total_in_flight, hosts=ollama_hosts)
+
+def generate_local(model_name: str, prompt: str, **kwargs) -> dict:
+    return get_client().generate(model_name, prompt, options=generation_options, keep_alive=keep_alive, **kwargs)
+
+streamer = None
+batcher = None
+stream_masker = None
+if detect_mode == "spans":
+    call_fn = SpanDetector(generate_local)
+    active_template = PROMPT_TEMPLATE_SPANS
+elif detect_mode == "prefix":
+    call_fn = PrefixReuseDetector(generate_local)
+    active_template = call_fn.cache_template
+elif batch_size > 1:
+    batcher = BatchedDetector(generate_local, call_llama_local, batch_size)
+    call_fn = batcher
+    active_template = PROMPT_TEMPLATE_BATCH
+elif use_streaming:
+    stream_masker = StreamingRowMasker() if stream_masking else None
+    streamer = StreamingDetector(stream_llama_local, on_pair=stream_masker)
+    call_fn = streamer
+    active_template = PROMPT_TEMPLATE_8
+else:
+    call_fn = call_llama_local
+    active_template = PROMPT_TEMPLATE_8
+
+cache = DetectionCache(cache_path) if cache_path else None
+if cache is not None:
+    call_fn = cache.wrap(call_fn, active_template, generation_options)
+cascade = (CascadeDetector(call_fn, cascade_small_model, cascade_max_unmasked)
+           if cascade_small_model is not None else None)
+if cascade is not None:
+    call_fn = cascade
+chunker = ChunkedDetector(call_fn, chunk_max_chars, chunk_parallel) if chunk_max_chars is not None else None
+if chunker is not None:
+    call_fn = chunker
+fast_path = RuleFastPath(call_fn) if use_rule_fast_path else None
+if fast_path is not None:
+    call_fn = fast_path
+pii_gate = NoPiiGate(call_fn, load_or_train(pii_gate_path), pii_gate_threshold) if pii_gate_path else None
+if pii_gate is not None:
+    call_fn = pii_gate
+
+stats = run_detection(rows, model_list, call_fn, max_in_flight, on_result,
+                      is_done=cluster_done, schedule=schedule,
+                      preload_fn=preload_model, unload_fn=unload_model)
+if cascade_small_model is not None and schedule == "model_major":
+    unload_model(cascade_small_model)
+journal.close()
+
+# 所有结果（包括之前运行留下的）统一写回 DataFrame，只写一次 Excel
+for (idx, model_name), record in journal.records.items():
+    if idx < rows_to_process and model_name in model_list:
+        write_result(idx, model_name, record)
+df.to_excel(output_file, index=False)
 
 end_time = time.time()
 total_time = end_time - start_time
-avg_time_per_row = total_time / rows_to_process if rows_to_process > 0 else 0
+avg_time_per_row = total_time / len(rows) if len(rows) > 0 else 0
 
 # ------------------------------------------------------------------------------
 # 5) 输出统计信息
 # ------------------------------------------------------------------------------
-print(f"\n共处理 {rows_to_process} 行数据。")
+saved_calls = sum(len(clusters[idx]) - 1 for idx, _ in rows) * len(model_list)
+print(f"\n本次处理 {len(rows)} 行数据（共 {rows_to_process} 行）。")
+if dedup_threshold is not None or dedup_identical:
+    print(f"{'近似重复聚类' if dedup_threshold is not None else '重复正文去重'}: "
+          f"{rows_to_process} 行归为 {len(clusters)} 簇，去重比例 {dedup_ratio(clusters):.1%}，"
+          f"本次节省 LLM 调用 {saved_calls} 次。")
 print(f"总执行时间: {total_time:.2f} 秒。")
 print(f"平均每行处理时间: {avg_time_per_row:.2f} 秒。")
+print(f"吞吐量: {stats['rows_per_sec']:.2f} 行/秒。")
+for model_name, load_ns in stats["load_duration"].items():
+    print(f"模型 {model_name} 加载耗时: {ns_to_s(load_ns):.2f} 秒。")
+if batcher is not None:
+    print(f"批量检测: 共发出 {batcher.batches} 个批次，单独重查 {batcher.requeried} 行。")
+if cascade is not None:
+    reasons = ", ".join(f"{reason} {count}" for reason, count in cascade.reason_counts.items())
+    print(f"级联检测: {cascade.total} 行中升级到大模型 {cascade.escalated} 行，"
+          f"升级率 {cascade.escalation_rate():.1%}（{reasons or '无'}）；"
+          f"估计节省推理时间 {cascade.latency_saved():.2f} 秒。")
+if streamer is not None:
+    print(f"流式检测提前终止（模型回答 None）: {streamer.early_stops} 次。")
+if stream_masker is not None:
+    print(f"边检测边遮盖: {stream_masker.streamed} 行在生成过程中完成遮盖，"
+          f"{stream_masker.fallback} 行按最终输出遮盖。")
+if chunker is not None:
+    print(f"长邮件分块检测: {chunker.chunked_rows} 次。")
+if fast_path is not None:
+    print(f"规则快速通道: {fast_path.total} 次检测中跳过 LLM {fast_path.avoided} 次。")
+if hasattr(client, "host_stats"):
+    for host in client.host_stats():
+        print(f"主机 {host['host']}: {host['calls']} 次请求，失败 {host['failures']} 次，"
+              f"{'健康' if host['healthy'] else '不健康'}。")
+    print(f"换主机重试: {client.retried} 次。")
+if pii_gate is not None:
+    print(f"无敏感信息门控（阈值 {pii_gate_threshold}）: {pii_gate.total} 次检测中跳过 LLM {pii_gate.skipped} 次。")
+if cache is not None:
+    print(f"缓存命中: {cache.hits}，未命中: {cache.misses}，命中率: {cache.hit_rate():.1%}")
+    cache.close()
 print(f"最终更新后的文件已保存到: {output_file}")
+
+# 每次模型调用的 TTFT、tokens/sec、排队等待等指标（按模型 p50/p95/p99）
+get_metrics().print_summary()
+get_metrics().write_report(metrics_path_for(output_file), {
+    "script": "privacy_detect_local.py",
+    "rows": len(rows),
+    "elapsed": total_time,
+    "rows_per_sec": stats["rows_per_sec"],
+    "detect_mode": detect_mode,
+    "schedule": schedule,
+})
+print(f"调用指标报告已保存到: {metrics_path_for(output_file)}")
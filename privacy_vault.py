@@ -0,0 +1,193 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+
+# ------------------------------------------------------------------------------
+# 隐私值保险库（SQLite，按 (行号, 占位符) 索引）
+# ------------------------------------------------------------------------------
+# 原来的做法是把所有 {rowIndex, id, key, originalValue, replacedValue} 收集到内存列表里，
+# 最后一次性 json.dump；还原时再从 Excel 单元格里逐行解析 JSON 字符串。
+# 这里改为遮盖时逐行追加写入（批量提交），还原时按主键 (row_index, placeholder) 直接查找。
+# 表为 WITHOUT ROWID 的聚簇主键表，key 类型名单独存一张表，条目只存整数编号，
+# 百万级条目时占用的空间与原来的 JSON 相当或更小；export_json() 按原来的格式导出。
+
+DEFAULT_VAULT_PATH = "gemma27b/privacy_vault.sqlite"
+
+
+class JsonArrayWriter:
+    """逐条写出 JSON 数组，格式与 json.dump(list, f, ensure_ascii=False, indent=2) 完全相同"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, item: dict):
+        text = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self.f.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]" if self.count else "[]")
+
+
+class PrivacyVault:
+
+    def __init__(self, path: str = DEFAULT_VAULT_PATH, batch_size: int = 5000):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._key_ids = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS vault_keys (
+                   key_id INTEGER PRIMARY KEY,
+                   key TEXT NOT NULL UNIQUE
+               )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS vault (
+                   row_index INTEGER NOT NULL,
+                   placeholder TEXT NOT NULL,
+                   pair_id INTEGER NOT NULL,
+                   key_id INTEGER NOT NULL,
+                   original TEXT NOT NULL,
+                   PRIMARY KEY (row_index, placeholder)
+               ) WITHOUT ROWID"""
+        )
+        self._conn.commit()
+        self._key_ids = dict(self._conn.execute("SELECT key, key_id FROM vault_keys"))
+
+    # --------------------------------------------------------------------------
+    # 写入（遮盖阶段）
+    # --------------------------------------------------------------------------
+    def _key_id(self, key: str) -> int:
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = self._conn.execute("INSERT INTO vault_keys (key) VALUES (?)", (key,)).lastrowid
+            self._key_ids[key] = key_id
+        return key_id
+
+    def append(self, row_index: int, row_pairs: list):
+        """追加一行的 [{id, key, originalValue, replacedValue}, ...]；攒够 batch_size 条后批量提交"""
+        with self._lock:
+            for pair in row_pairs:
+                self._pending.append((row_index, pair["replacedValue"], pair["id"],
+                                      self._key_id(pair["key"]), pair["originalValue"]))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            # 只追加：同一 (行号, 占位符) 重复写入视为错误，而不是静默覆盖
+            self._conn.executemany("INSERT INTO vault VALUES (?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+        self._conn.commit()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def clear(self):
+        """重新遮盖整个语料前清空旧条目"""
+        with self._lock:
+            self._pending = []
+            self._conn.execute("DELETE FROM vault")
+            self._conn.commit()
+
+    # --------------------------------------------------------------------------
+    # 查找（还原阶段）
+    # --------------------------------------------------------------------------
+    def lookup(self, row_index: int, placeholder: str):
+        """返回原始值，不存在时返回 None"""
+        with self._lock:
+            # 先写入还没提交的条目，否则刚 append 的行查不到
+            if self._pending:
+                self._flush()
+            row = self._conn.execute(
+                "SELECT original FROM vault WHERE row_index = ? AND placeholder = ?",
+                (row_index, placeholder)
+            ).fetchone()
+        return row[0] if row else None
+
+    def row_map(self, row_index: int) -> dict:
+        """一行的 {占位符: 原始值}（主键前缀范围扫描）"""
+        with self._lock:
+            if self._pending:
+                self._flush()
+            rows = self._conn.execute(
+                "SELECT placeholder, original FROM vault WHERE row_index = ?", (row_index,)
+            ).fetchall()
+        return dict(rows)
+
+    def count(self) -> int:
+        with self._lock:
+            self._flush()
+            return self._conn.execute("SELECT COUNT(*) FROM vault").fetchone()[0]
+
+    # --------------------------------------------------------------------------
+    # 与原 JSON 格式互相转换
+    # --------------------------------------------------------------------------
+    def iter_records(self):
+        """按 (rowIndex, id) 顺序产出原全局 JSON 的记录"""
+        self.flush()
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """SELECT v.row_index, v.pair_id, k.key, v.original, v.placeholder
+               FROM vault v JOIN vault_keys k ON v.key_id = k.key_id
+               ORDER BY v.row_index, v.pair_id"""
+        )
+        for row_index, pair_id, key, original, placeholder in cursor:
+            yield {
+                "rowIndex": row_index,
+                "id": pair_id,
+                "key": key,
+                "originalValue": original,
+                "replacedValue": placeholder
+            }
+
+    def export_json(self, path: str) -> int:
+        """流式导出为原来的 storage_privacy.json 格式，返回条数"""
+        with open(path, "w", encoding="utf-8") as f:
+            writer = JsonArrayWriter(f)
+            for record in self.iter_records():
+                writer.write(record)
+            writer.close()
+        return writer.count
+
+    def import_json(self, path: str) -> int:
+        """导入已有的全局 JSON 文件，返回条数"""
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        for record in records:
+            self.append(record["rowIndex"], [record])
+        self.flush()
+        return len(records)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看、导入或导出隐私值保险库")
+    parser.add_argument("--path", default=DEFAULT_VAULT_PATH)
+    parser.add_argument("--import-json", help="从原格式的全局 JSON 文件导入")
+    parser.add_argument("--export-json", help="导出为原格式的全局 JSON 文件")
+    args = parser.parse_args()
+
+    vault = PrivacyVault(args.path)
+    if args.import_json:
+        print(f"已导入 {vault.import_json(args.import_json)} 条")
+    if args.export_json:
+        print(f"已导出 {vault.export_json(args.export_json)} 条到 {args.export_json}")
+    print(f"{args.path}: {vault.count()} 条")
+    vault.close()
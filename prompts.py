@@ -0,0 +1,84 @@
+# ------------------------------------------------------------------------------
+# 隐私检测 Prompt 模板
+# ------------------------------------------------------------------------------
+# 单独放在一个模块里，privacy_detect_local.py 和评测脚本共用同一份模板文本
+# （模板原文也是检测缓存键的一部分，不要随意改动空白字符）。
+
+PROMPT_TEMPLATE_8 = """In the following sentence, please convert all mentions of specific names, specific places, and numbers that may be sensitive into a format that represents the type of information they belong to.
+Format requirements:
+1. Always use double quotes for both keys and values: "key": "value"
+2. Keep the rest of the sentence unchanged
+3. Place the key-value pair exactly where the original information appears
+
+You may select keys from the following list: Person Name, Email Address, Phone Number, Physical Address, password, Job Title, Organization, important time;
+
+Here's an Example:
+Input: Please write a greeting card for Nancy and her email address is nancy@gmail.com.
+Output: Please write a greeting card for "name": "Nancy" and her email address is "email address": "nancy@gmail.com".
+
+Note: Every piece of sensitive information MUST be converted to "key": "value" format with double quotes. If not applicable, return "None". Don't use the example in the real output, just follow the format.
+Real Input:
+{}
+
+Real Output:
+
+"""
+
+# 前缀复用模式：把 PROMPT_TEMPLATE_8 拆成固定的说明+示例部分和每封邮件不同的部分。
+# 固定部分作为 system 发送，每次请求的前缀完全相同，Ollama 可以复用已计算好的 KV cache，
+# prompt eval 只需要处理邮件部分。
+_EMAIL_PART_START = PROMPT_TEMPLATE_8.index("Real Input:")
+PROMPT_8_STATIC_PREFIX = PROMPT_TEMPLATE_8[:_EMAIL_PART_START]
+PROMPT_8_EMAIL_SUFFIX = PROMPT_TEMPLATE_8[_EMAIL_PART_START:]
+
+# 结构化输出模式：只返回 {type, value} 列表，不再复述整封邮件，输出 token 数与敏感信息数量成正比
+PROMPT_TEMPLATE_SPANS = """List every piece of sensitive information in the following email.
+Sensitive information includes specific names, specific places, and numbers that may be sensitive.
+For each item give its type and its exact text as it appears in the email.
+
+You may select types from the following list: Person Name, Email Address, Phone Number, Physical Address, password, Job Title, Organization, important time;
+
+Respond only with JSON of the form {{"items": [{{"type": "...", "value": "..."}}]}}. If nothing is sensitive, return {{"items": []}}.
+Email:
+{}
+"""
+
+# 传给 Ollama 的 format 参数（JSON Schema），约束模型只输出上面的结构
+SPAN_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string"},
+                    "value": {"type": "string"},
+                },
+                "required": ["type", "value"],
+            },
+        },
+    },
+    "required": ["items"],
+}
+
+# 批量模式：一次请求放入多封邮件，用编号分隔符包裹，模型按相同分隔符分别返回
+PROMPT_TEMPLATE_BATCH = """For EACH email below, convert all mentions of specific names, specific places, and numbers that may be sensitive into a format that represents the type of information they belong to.
+Format requirements:
+1. Always use double quotes for both keys and values: "key": "value"
+2. Keep the rest of the email unchanged
+3. Place the key-value pair exactly where the original information appears
+
+You may select keys from the following list: Person Name, Email Address, Phone Number, Physical Address, password, Job Title, Organization, important time;
+
+Here's an Example:
+Input: <<<EMAIL 1>>>Please write a greeting card for Nancy and her email address is nancy@gmail.com.<<<END 1>>>
+Output: <<<EMAIL 1>>>Please write a greeting card for "name": "Nancy" and her email address is "email address": "nancy@gmail.com".<<<END 1>>>
+
+Note: Answer every email separately, wrapped in the same <<<EMAIL n>>> and <<<END n>>> markers as the input, in the same order. If an email has nothing sensitive, answer "None" inside its markers. Don't use the example in the real output, just follow the format.
+Real Input:
+{}
+
+Real Output:
+
+"""
@@ -0,0 +1,286 @@
+import os
+import re
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
+
+import aiohttp
+
+from llm_metrics import get_metrics
+
+# ------------------------------------------------------------------------------
+# 并发、感知限流的远程调用引擎（OpenAI Chat Completions 兼容接口，asyncio + aiohttp）
+# ------------------------------------------------------------------------------
+# 原来每行串行调用一次 openai.ChatCompletion.create，吞吐量 = 1 / 单次延迟。
+# 这里同时发出多个请求，并用两个令牌桶把发送速率控制在账号限额以内：
+#   - 请求桶：每分钟 rpm 个请求
+#   - token 桶：每分钟 tpm 个 token；发送前按 prompt 长度 + 预计输出长度预扣，
+#     收到 usage 后按实际用量多退少补
+# 每次响应都读取 x-ratelimit-remaining-* / x-ratelimit-reset-*：剩余额度用完时，
+# 所有请求暂停到服务端给出的重置时间。429 和 5xx 按 Retry-After（没有时按带随机抖动的
+# 指数退避）重试。结果按行号顺序回调 on_result，写回顺序与串行版本一致。
+#
+# 用法：
+#   engine = RemoteReplyEngine("gpt-4o", rpm=500, tpm=30000)
+#   replies = engine.generate(prompts, on_result=lambda idx, text: ...)
+
+DEFAULT_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数（约 4 个字符一个 token），只用于限流预扣"""
+    return max(1, len(text) // 4)
+
+
+def parse_duration(value: str):
+    """解析 OpenAI 的重置时间 "1m30.5s" / "6ms" / "0.5s"、纯秒数，或 Anthropic 的 ISO 时间；返回秒数"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max((reset_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except ValueError:
+        return None
+
+
+def retry_after(headers) -> float:
+    """429 / 503 响应中服务端要求的等待秒数；没有时返回 None"""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """每分钟补充 rate_per_min 个令牌、容量 rate_per_min 的令牌桶；rate_per_min 为 0 表示不限制"""
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = rate_per_min
+        self.rate = rate_per_min / 60.0
+        self.tokens = rate_per_min
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """取出 amount 个令牌，不足时等待；超过容量的请求在桶满时放行"""
+        if not self.capacity:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """预扣与实际用量之差：delta > 0 补扣，delta < 0 退还"""
+        if self.capacity:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+    def drain(self, remaining: float):
+        """服务端报告的剩余额度比本地估计少时，以服务端为准"""
+        if self.capacity and remaining is not None:
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+
+
+class RemoteReplyEngine:
+    """
+    model_name: 模型名；system_prompt: system 消息；rpm / tpm: 账号限额（0 表示不限制）；
+    concurrency: 同时在途的请求数上限；expected_output_tokens: token 桶预扣的输出长度。
+    api_base / api_key 默认取 OPENAI_API_BASE / OPENAI_API_KEY，可以指向 stub_server.py。
+    """
+
+    def __init__(self, model_name: str, system_prompt: str = "You are ChatGPT.", temperature: float = 0.0,
+                 rpm: int = 500, tpm: int = 30000, concurrency: int = 32, expected_output_tokens: int = 300,
+                 max_retries: int = 6, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 timeout: float = 120.0, api_base: str = None, api_key: str = None, metrics=None):
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = concurrency
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.api_base = (api_base or DEFAULT_API_BASE).rstrip("/")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.metrics = metrics or get_metrics()
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "errors": 0, "paused": 0.0}
+        self._pause_until = 0.0
+
+    # --------------------------------------------------------------------------
+    # 限流
+    # --------------------------------------------------------------------------
+    def _observe_headers(self, headers):
+        """按响应头同步本地令牌桶；某项额度用完时暂停到重置时间（上限为 0 或缺失的项忽略）"""
+        waits = []
+        for name, bucket in (("requests", self._requests), ("tokens", self._tokens)):
+            limit = headers.get(f"x-ratelimit-limit-{name}")
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            if remaining is None or not limit or float(limit) <= 0:
+                continue
+            bucket.drain(float(remaining))
+            if float(remaining) <= 0:
+                waits.append(parse_duration(headers.get(f"x-ratelimit-reset-{name}")))
+        waits = [w for w in waits if w]
+        if waits:
+            self._pause(max(waits))
+
+    def _pause(self, seconds: float):
+        now = time.monotonic()
+        until = now + seconds
+        if until > self._pause_until:
+            self.stats["paused"] += until - max(self._pause_until, now)
+            self._pause_until = until
+
+    async def _wait_for_pause(self):
+        while True:
+            wait = self._pause_until - time.monotonic()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int) -> float:
+        """带随机抖动的指数退避（full jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    # --------------------------------------------------------------------------
+    # 单次调用
+    # --------------------------------------------------------------------------
+    async def _call(self, session: aiohttp.ClientSession, prompt: str, enqueued: float = None) -> dict:
+        """
+        返回 {"text", "prompt_tokens", "output_tokens", "error"}；重试用尽时 text 为空字符串。
+        enqueued: 请求排队的时间（等待并发名额之前）；从它到真正发出请求的时间记为 queue_wait，
+        包括等并发名额、全局暂停和令牌桶；重试时从该次尝试开始等待算起。
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": self.temperature,
+        }
+        reserved = estimate_tokens(self.system_prompt + prompt) + self.expected_output_tokens
+        error = None
+        for attempt in range(self.max_retries + 1):
+            wait_start = enqueued if attempt == 0 and enqueued is not None else time.time()
+            await self._wait_for_pause()
+            await self._requests.acquire(1)
+            await self._tokens.acquire(reserved)
+            start = time.time()
+            queue_wait = start - wait_start
+            try:
+                async with session.post(f"{self.api_base}/chat/completions", json=payload) as resp:
+                    self._observe_headers(resp.headers)
+                    if resp.status == 200:
+                        data = await resp.json()
+                        usage = data.get("usage") or {}
+                        prompt_tokens = usage.get("prompt_tokens", 0)
+                        output_tokens = usage.get("completion_tokens", 0)
+                        self._tokens.adjust(prompt_tokens + output_tokens - reserved)
+                        self.metrics.record(self.model_name, "remote", time.time() - start,
+                                            prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                                            queue_wait=queue_wait)
+                        self.stats["calls"] += 1
+                        return {
+                            "text": data["choices"][0]["message"]["content"].strip(),
+                            "prompt_tokens": prompt_tokens,
+                            "output_tokens": output_tokens,
+                            "error": None,
+                        }
+                    # 请求没有成功，退还本次预扣的令牌；重试时重新预扣
+                    self._tokens.adjust(-reserved)
+                    body = await resp.text()
+                    error = f"HTTP {resp.status}: {body[:200]}"
+                    self.metrics.record(self.model_name, "remote", time.time() - start,
+                                        queue_wait=queue_wait, error=error)
+                    if resp.status not in RETRY_STATUS:
+                        break
+                    if resp.status == 429:
+                        self.stats["throttled"] += 1
+                    wait = retry_after(resp.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._tokens.adjust(-reserved)
+                error = f"{type(e).__name__}: {e}"
+                self.metrics.record(self.model_name, "remote", time.time() - start,
+                                    queue_wait=queue_wait, error=error)
+                wait = None
+            if attempt == self.max_retries:
+                break
+            self.stats["retries"] += 1
+            wait = wait if wait is not None else self._backoff(attempt)
+            if error.startswith("HTTP 429"):
+                # 服务端已经限流：所有请求一起暂停，而不是各自继续撞限额
+                self._pause(wait)
+            else:
+                await asyncio.sleep(wait)
+        self.stats["errors"] += 1
+        return {"text": "", "prompt_tokens": 0, "output_tokens": 0, "error": error}
+
+    # --------------------------------------------------------------------------
+    # 批量调用
+    # --------------------------------------------------------------------------
+    async def run(self, prompts: list, on_result=None) -> list:
+        """
+        prompts: [(行号, prompt 文本), ...]；on_result(行号, 结果字典) 按 prompts 的顺序回调。
+        返回与 prompts 顺序一致的结果字典列表。
+        """
+        self._requests = TokenBucket(self.rpm)
+        self._tokens = TokenBucket(self.tpm)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = [None] * len(prompts)
+        next_pos = 0
+
+        def flush():
+            nonlocal next_pos
+            while next_pos < len(prompts) and results[next_pos] is not None:
+                if on_result is not None:
+                    on_result(prompts[next_pos][0], results[next_pos])
+                next_pos += 1
+
+        async def worker(pos, prompt):
+            enqueued = time.time()
+            async with semaphore:
+                results[pos] = await self._call(session, prompt, enqueued)
+            flush()
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as session:
+            await asyncio.gather(*(worker(pos, prompt) for pos, (_, prompt) in enumerate(prompts)))
+        return results
+
+    def generate(self, prompts: list, on_result=None) -> list:
+        """同步入口：prompts 为 [(行号, prompt 文本), ...]，返回结果字典列表"""
+        return asyncio.run(self.run(prompts, on_result))
+
+    def print_stats(self, elapsed: float):
+        s = self.stats
+        print(f"远程调用 {s['calls']} 次成功，失败 {s['errors']} 次，重试 {s['retries']} 次（其中 429 {s['throttled']} 次），"
+              f"因限额暂停 {s['paused']:.1f} 秒；吞吐量 {s['calls'] / elapsed * 60 if elapsed > 0 else 0:.0f} 次/分钟"
+              f"（rpm 上限 {self.rpm or '不限'}）")
@@ -1,8 +1,12 @@
 import pandas as pd
-import subprocess
 import time
 import logging
 
+from local_llm import get_client, ns_to_s
+from run_journal import RunJournal, journal_path_for
+from detect_engine import run_detection
+from llm_metrics import get_metrics, metrics_path_for
+
 # ------------------------------------------------------------------------------
 # 1) Configuration
 # ------------------------------------------------------------------------------
@@ -27,6 +31,14 @@ model_list = [
     "qwen2.5:7b"
 ]
 
+# Ollama hosts: with several endpoints, rows are spread by least outstanding requests
+# and rows from a failed host are retried on another one.
+# None means OLLAMA_HOSTS / OLLAMA_HOST from the environment (default localhost:11434).
+ollama_hosts = None  # e.g. ["http://localhost:11434", "http://localhost:11435"]
+
+# Requests in flight per model (raise it with the number of hosts)
+max_in_flight = 1
+
 output_col_names = [
     "Reply_qwen2.5:7b"
 ]
@@ -53,74 +65,94 @@ if "reply_time" not in df.columns:
 # ------------------------------------------------------------------------------
 # 3) Define a function to call local LLaMA models via ollama
 # ------------------------------------------------------------------------------
-def call_local_model(model_name: str, email_body: str, row_index: int) -> str:
+def call_local_model(model_name: str, email_body: str) -> dict:
     """
-    Calls a local LLM model using `ollama run <model_name>` and returns its text response.
-    Also logs input, output, and time taken.
+    Calls a local LLM model through the pooled Ollama HTTP client and returns the
+    result dict (text, token counts and server-side durations).
     """
     prompt = PROMPT_TEMPLATE.format(email_body)
-
-    # Log the input before calling the model
-    logging.info(f"[Row {row_index}] Model: {model_name} | Input: {email_body}")
-
-    start_time_model = time.time()
-    process = subprocess.run(
-        ["ollama", "run", model_name],
-        input=prompt,
-        text=True,
-        capture_output=True
-    )
-    end_time_model = time.time()
-
-    output_text = process.stdout.strip()
-
-    # Log the output and time cost
-    elapsed = end_time_model - start_time_model
-    logging.info(f"[Row {row_index}] Model: {model_name} | Time: {elapsed:.2f}s | Output: {output_text}")
-
-    return output_text
+    return get_client().generate(model_name, prompt)
 
 # ------------------------------------------------------------------------------
-# 4) Process each row (skipping header), measure time and record processing time
+# 4) Process each row (skipping header), measure time and record processing time.
+#    Rows are sent concurrently (max_in_flight per model) across the configured hosts;
+#    results come back in row order. Every (row, model) result is appended to a JSONL
+#    journal; on restart the completed pairs are skipped and the Excel file is written
+#    once at the end.
 # ------------------------------------------------------------------------------
 start_time = time.time()
 num_rows = len(df)
 
-# 如果只想处理前 5 行（且第 1 行是表头），可将下面循环改为 range(1, min(num_rows, 6))。
-for idx in range(1, num_rows):
-    # 读取第一列的邮件内容
-    email_text = df.iloc[idx, 0] if pd.notna(df.iloc[idx, 0]) else ""
+journal = RunJournal(journal_path_for(output_file))
+resume_from = journal.first_incomplete_row(range(1, num_rows), model_list)
+if resume_from is not None and resume_from > 1:
+    print(f"Resuming from journal: rows before {resume_from} are already done.")
 
-    row_start_time = time.time()
-    for m_idx, model_name in enumerate(model_list):
-        # 调用模型获取回复，并存储结果
-        response_text = call_local_model(model_name, email_text, idx)
-        df.at[idx, output_col_names[m_idx]] = response_text
-    row_end_time = time.time()
+client = get_client(pool_size=max_in_flight * len(model_list), hosts=ollama_hosts)
 
-    # 计算并记录该行处理的时间
-    elapsed_row_time = row_end_time - row_start_time
-    df.at[idx, "reply_time"] = elapsed_row_time
+# 读取第一列的邮件内容
+# 如果只想处理前 5 行（且第 1 行是表头），可将下面的 range 改为 range(1, min(num_rows, 6))。
+rows = [
+    (idx, df.iloc[idx, 0] if pd.notna(df.iloc[idx, 0]) else "")
+    for idx in range(1, num_rows)
+    if not journal.row_done(idx, model_list)
+]
+bodies = dict(rows)
+
+def on_result(idx: int, model_name: str, result: dict):
+    """Called in row order per model: append to the journal and log input, output and time."""
+    journal.append(idx, model_name, result)
+
+    # Log the input and output with the time cost (server-side, excludes client overhead)
+    elapsed = ns_to_s(result.get("total_duration"))
+    logging.info(f"[Row {idx}] Model: {model_name} | Input: {bodies[idx]}")
+    logging.info(
+        f"[Row {idx}] Model: {model_name} | Time: {elapsed:.2f}s | "
+        f"Prompt tokens: {result.get('prompt_eval_count', 0)} | "
+        f"Output tokens: {result.get('eval_count', 0)} | Output: {result['text']}"
+    )
+    print(f"Processed row {idx}/{num_rows - 1} with {model_name} in {elapsed:.2f} seconds.")
 
-    print(f"Processed row {idx}/{num_rows - 1} in {elapsed_row_time:.2f} seconds.")
+stats = run_detection(rows, model_list, call_local_model, max_in_flight, on_result, is_done=journal.is_done)
+processed_rows = len(rows)
 
-    # === 新增：每处理 10 行就将结果写入一次 Excel，以防中途意外导致数据丢失 ===
-    if idx % 10 == 0:
-        df.to_excel(output_file, index=False)
-        print(f"Temporary save: wrote partial results to {output_file} (after row {idx}).")
+journal.close()
 
 end_time = time.time()
 total_time = end_time - start_time
-avg_time_per_row = total_time / (num_rows - 1) if num_rows > 1 else 0
+avg_time_per_row = total_time / processed_rows if processed_rows > 0 else 0
 
 # ------------------------------------------------------------------------------
-# 5) 最后一次完整保存，并打印摘要
+# 5) 从 journal 重建结果，一次性保存 Excel，并打印摘要
 # ------------------------------------------------------------------------------
+for (idx, model_name), record in journal.records.items():
+    if idx >= num_rows or model_name not in model_list:
+        continue
+    df.at[idx, output_col_names[model_list.index(model_name)]] = record["text"]
+
+# 该行处理的时间 = 各模型服务端耗时之和
+for idx in range(1, num_rows):
+    times = [ns_to_s(journal.records[(idx, m)].get("total_duration"))
+             for m in model_list if journal.is_done(idx, m)]
+    if times:
+        df.at[idx, "reply_time"] = sum(times)
+
 df.to_excel(output_file, index=False)
 
 # Print summary
-print(f"\nProcessing completed (first {num_rows-1} rows).")
+print(f"\nProcessing completed ({processed_rows} new rows, {num_rows-1} rows in total).")
 print(f"Total execution time: {total_time:.2f} seconds.")
 print(f"Average time per row: {avg_time_per_row:.2f} seconds.")
 print(f"The updated file is saved to: {output_file}")
+print(f"Throughput: {stats['rows_per_sec']:.2f} rows/second.")
+if hasattr(client, "host_stats"):
+    for host in client.host_stats():
+        print(f"Host {host['host']}: {host['calls']} requests, {host['failures']} failures, "
+              f"{'healthy' if host['healthy'] else 'unhealthy'}.")
+    print(f"Retried on another host: {client.retried} times.")
 print("Logs have been recorded in dataset/complex_log.txt.")
+
+# Per-call latency metrics (TTFT, tokens/sec, queue wait) for this run
+get_metrics().print_summary()
+get_metrics().write_report(metrics_path_for(output_file), {"script": "reply.py", "rows": processed_rows})
+print(f"Metrics report saved to {metrics_path_for(output_file)}")
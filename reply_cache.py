@@ -0,0 +1,221 @@
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# ------------------------------------------------------------------------------
+# 远程回复缓存（SQLite，内容寻址，LRU 淘汰）
+# ------------------------------------------------------------------------------
+# masked_prompt 中不含原始敏感信息，完全相同的遮盖文本（群发通知、会议邀请、重复转发）
+# 可以共用同一条远程回复。键 = sha256(模型名, system 提示, prompt 模板, masked_prompt, temperature)；
+# 只缓存 temperature = 0 的调用（输出确定），其余温度直接调用模型。
+# 条目数超过 max_entries 时按最近使用时间淘汰最旧的条目。
+#
+# CachedReplies 包装 RemoteReplyEngine / BatchReplyRunner：命中缓存的行不再调用 API，
+# 同一次运行中相同的 masked_prompt 也只调用一次，结果仍按行号顺序回调 on_result。
+
+DEFAULT_CACHE_PATH = "all/reply_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 100000
+
+
+def make_key(model_name: str, system_prompt: str, template: str, masked_prompt: str, temperature: float) -> str:
+    payload = json.dumps(
+        [model_name, system_prompt, template, masked_prompt, float(temperature)],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(temperature: float) -> bool:
+    return float(temperature) == 0.0
+
+
+class ReplyCache:
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS reply_cache (
+                   key TEXT PRIMARY KEY,
+                   model TEXT NOT NULL,
+                   result TEXT NOT NULL,
+                   created REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_reply_last_used ON reply_cache(last_used)")
+        self._conn.commit()
+        # 条目数只在打开时统计一次，之后随写入 / 淘汰 / 删除增减，put 时不再 COUNT(*)
+        self.entries = self._conn.execute("SELECT COUNT(*) FROM reply_cache").fetchone()[0]
+
+    def get(self, key: str):
+        """命中返回结果字典（带 "cached": True）并刷新最近使用时间，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM reply_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE reply_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        result = json.loads(row[0])
+        result["cached"] = True
+        return result
+
+    def put(self, key: str, model_name: str, result: dict):
+        """写入一条回复；出错的结果（带 "error"）不写入。超过 max_entries 时淘汰最久未使用的条目"""
+        if result.get("error"):
+            return
+        stored = {k: v for k, v in result.items() if k != "cached"}
+        now = time.time()
+        payload = json.dumps(stored, ensure_ascii=False)
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO reply_cache VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, payload, now, now)
+            ).rowcount
+            if inserted:
+                self.entries += 1
+            else:
+                self._conn.execute(
+                    "UPDATE reply_cache SET model = ?, result = ?, last_used = ? WHERE key = ?",
+                    (model_name, payload, now, key)
+                )
+            if self.max_entries and self.entries > self.max_entries:
+                deleted = self._conn.execute(
+                    """DELETE FROM reply_cache WHERE key IN (
+                           SELECT key FROM reply_cache ORDER BY last_used LIMIT ?
+                       )""", (self.entries - self.max_entries,)
+                ).rowcount
+                self.entries -= deleted
+                self.evicted += deleted
+            self._conn.commit()
+
+    def invalidate(self, model_name: str = None) -> int:
+        """删除某个模型的缓存条目；不传时清空整个缓存。返回删除条数"""
+        sql, params = "DELETE FROM reply_cache", ()
+        if model_name is not None:
+            sql, params = sql + " WHERE model = ?", (model_name,)
+        with self._lock:
+            deleted = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+            self.entries -= deleted
+        return deleted
+
+    def counts_by_model(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT model, COUNT(*) FROM reply_cache GROUP BY model").fetchall()
+        return dict(rows)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedReplies:
+    """
+    包装 engine（RemoteReplyEngine / BatchReplyRunner，二者都有 generate(prompts, on_result)）。
+    generate([(行号, masked_prompt), ...], on_result) 按 template.format(masked_prompt) 生成 prompt；
+    temperature 不为 0 时不查缓存，全部交给 engine。
+    """
+
+    def __init__(self, cache: ReplyCache, engine, template: str = "{}"):
+        self.cache = cache
+        self.engine = engine
+        self.template = template
+        self.stats = {"rows": 0, "cache_hits": 0, "duplicates": 0, "api_calls": 0}
+
+    def _key(self, masked_prompt: str) -> str:
+        e = self.engine
+        return make_key(e.model_name, e.system_prompt, self.template, masked_prompt, e.temperature)
+
+    def generate(self, rows: list, on_result=None) -> list:
+        results = [None] * len(rows)
+        next_pos = 0
+        self.stats["rows"] += len(rows)
+
+        def flush():
+            nonlocal next_pos
+            while next_pos < len(rows) and results[next_pos] is not None:
+                if on_result is not None:
+                    on_result(rows[next_pos][0], results[next_pos])
+                next_pos += 1
+
+        if not is_cacheable(self.engine.temperature):
+            prompts = [(pos, self.template.format(masked)) for pos, (_, masked) in enumerate(rows)]
+            self.stats["api_calls"] += len(prompts)
+
+            def on_uncached(pos, result):
+                results[pos] = result
+                flush()
+
+            self.engine.generate(prompts, on_result=on_uncached)
+            return results
+
+        # 查缓存；未命中的按键分组，同一次运行中相同的 masked_prompt 只调用一次
+        members = {}
+        keys = {}
+        for pos, (_, masked) in enumerate(rows):
+            key = self._key(masked)
+            if key in members:
+                members[key].append(pos)
+                self.stats["duplicates"] += 1
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[pos] = cached
+                self.stats["cache_hits"] += 1
+                continue
+            members[key] = [pos]
+            keys[pos] = key
+
+        def on_miss(pos, result):
+            key = keys[pos]
+            self.cache.put(key, self.engine.model_name, result)
+            for member in members[key]:
+                results[member] = result
+            flush()
+
+        prompts = [(pos, self.template.format(rows[pos][1])) for pos in keys]
+        self.stats["api_calls"] += len(prompts)
+        flush()
+        if prompts:
+            self.engine.generate(prompts, on_result=on_miss)
+        flush()
+        return results
+
+    def print_stats(self):
+        s = self.stats
+        saved = s["rows"] - s["api_calls"]
+        rate = s["cache_hits"] / s["rows"] if s["rows"] else 0.0
+        print(f"回复缓存: {s['rows']} 行，命中缓存 {s['cache_hits']} 行（命中率 {rate:.1%}），"
+              f"本次运行内重复 {s['duplicates']} 行，实际调用 API {s['api_calls']} 次，节省 {saved} 次；"
+              f"淘汰 {self.cache.evicted} 条")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看或清理远程回复缓存")
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--invalidate-model", help="删除该模型的所有缓存条目")
+    parser.add_argument("--clear", action="store_true", help="清空整个缓存")
+    args = parser.parse_args()
+
+    cache = ReplyCache(args.path)
+    if args.invalidate_model or args.clear:
+        print(f"已删除 {cache.invalidate(args.invalidate_model)} 条缓存")
+    for model, count in cache.counts_by_model().items():
+        print(f"{model}: {count} 条")
+    cache.close()
@@ -3,6 +3,11 @@ import time
 import os
 import openai
 
+from llm_metrics import get_metrics, metrics_path_for
+from remote_engine import RemoteReplyEngine
+from batch_reply import BatchReplyRunner
+from reply_cache import ReplyCache, CachedReplies, make_key
+
 # 设置 OpenAI API 密钥，从环境变量中获取
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
@@ -25,6 +30,25 @@ model_gpt4o = "gpt-4o"
 col_input = "masked_prompt"
 col_output = "masked_reply"
 
+# 并发调用（remote_engine.py）：按账号限额填写每分钟请求数 / token 数；
+# False 时退回逐行串行调用
+use_async_engine = True
+rpm_limit = 500
+tpm_limit = 30000
+max_concurrency = 32
+
+# Batch API 模式（batch_reply.py）：离线生成大量回复时使用，优先于上面的并发模式；
+# 请求文件写到 batch_requests_file，失败的请求最多重试到第 batch_max_rounds 轮
+use_batch_api = False
+batch_requests_file = "gemma27b/batch_requests.jsonl"
+batch_poll_interval = 30
+batch_max_rounds = 3
+
+# 回复缓存（reply_cache.py）：相同的 masked_prompt 共用一条回复（只缓存 temperature = 0 的调用）
+use_reply_cache = True
+reply_cache_file = "all/reply_cache.sqlite"
+reply_cache_max_entries = 100000
+
 # ------------------------------------------------------------------------------
 # 1) 读取 Excel 文件
 # ------------------------------------------------------------------------------
@@ -42,14 +66,17 @@ def call_openai_chat(model_name: str, content: str) -> str:
     调用 OpenAI Chat API 并返回响应的文本。
     """
     try:
-        response = openai.ChatCompletion.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "You are ChatGPT."},
-                {"role": "user", "content": content}
-            ],
-            temperature=0.0,  # 设置为 0 以保证输出更确定
-        )
+        with get_metrics().track(model_name, "remote") as call:
+            response = openai.ChatCompletion.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": "You are ChatGPT."},
+                    {"role": "user", "content": content}
+                ],
+                temperature=0.0,  # 设置为 0 以保证输出更确定
+            )
+            call["prompt_tokens"] = response["usage"]["prompt_tokens"]
+            call["output_tokens"] = response["usage"]["completion_tokens"]
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"Error calling OpenAI model {model_name}: {e}")
@@ -60,25 +87,69 @@ def call_openai_chat(model_name: str, content: str) -> str:
 # ------------------------------------------------------------------------------
 start_time = time.time()
 num_rows = len(df)
+cache = ReplyCache(reply_cache_file, reply_cache_max_entries) if use_reply_cache else None
+cache_stats = None
 
-for idx in range(num_rows):
+
+def email_text_at(idx: int) -> str:
     # 从 "masked_prompt" 列获取邮件文本
     email_text = df.at[idx, col_input]
     if not isinstance(email_text, str):
         email_text = ""
-    
-    # 构建提示，将邮件文本嵌入提示模板
-    prompt_text = PROMPT_TEMPLATE.format(email_text)
-    
-    # 调用 GPT-4o 生成回复
-    row_start_time = time.time()
-    reply_text = call_openai_chat(model_gpt4o, prompt_text)
-    
-    # 将生成的回复保存到 "reply_masked" 列中
-    df.at[idx, col_output] = reply_text
-    
-    row_end_time = time.time()
-    print(f"Processed row {idx+1}/{num_rows} in {row_end_time - row_start_time:.2f} seconds.")
+    return email_text
+
+
+if use_batch_api or use_async_engine:
+    if use_batch_api:
+        engine = BatchReplyRunner(model_gpt4o, system_prompt="You are ChatGPT.", temperature=0.0,
+                                  requests_path=batch_requests_file, poll_interval=batch_poll_interval,
+                                  max_rounds=batch_max_rounds)
+    else:
+        engine = RemoteReplyEngine(model_gpt4o, system_prompt="You are ChatGPT.", temperature=0.0,
+                                   rpm=rpm_limit, tpm=tpm_limit, concurrency=max_concurrency)
+
+    def on_result(idx, result):
+        # 按行号顺序回调，写回顺序与串行版本一致
+        if result["error"]:
+            print(f"Error calling OpenAI model {model_gpt4o} on row {idx+1}: {result['error']}")
+        df.at[idx, col_output] = result["text"]
+        print(f"Processed row {idx+1}/{num_rows} ({time.time() - start_time:.2f} seconds elapsed).")
+
+    if cache is not None:
+        # 命中缓存的行、以及本次运行中重复的 masked_prompt 不再调用 API
+        runner = CachedReplies(cache, engine, PROMPT_TEMPLATE)
+        runner.generate([(idx, email_text_at(idx)) for idx in range(num_rows)], on_result=on_result)
+        runner.print_stats()
+        cache_stats = dict(runner.stats, hit_rate=cache.hit_rate())
+    else:
+        prompts = [(idx, PROMPT_TEMPLATE.format(email_text_at(idx))) for idx in range(num_rows)]
+        engine.generate(prompts, on_result=on_result)
+    engine.print_stats(time.time() - start_time)
+else:
+    cache_stats = {"rows": num_rows, "cache_hits": 0, "api_calls": 0}
+    for idx in range(num_rows):
+        # 构建提示，将邮件文本嵌入提示模板
+        email_text = email_text_at(idx)
+        prompt_text = PROMPT_TEMPLATE.format(email_text)
+
+        # 调用 GPT-4o 生成回复（call_openai_chat 的 temperature 固定为 0，可以缓存）
+        row_start_time = time.time()
+        key = make_key(model_gpt4o, "You are ChatGPT.", PROMPT_TEMPLATE, email_text, 0.0)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            reply_text = cached["text"]
+            cache_stats["cache_hits"] += 1
+        else:
+            reply_text = call_openai_chat(model_gpt4o, prompt_text)
+            cache_stats["api_calls"] += 1
+            if cache is not None and reply_text:
+                cache.put(key, model_gpt4o, {"text": reply_text})
+
+        # 将生成的回复保存到 "reply_masked" 列中
+        df.at[idx, col_output] = reply_text
+
+        row_end_time = time.time()
+        print(f"Processed row {idx+1}/{num_rows} in {row_end_time - row_start_time:.2f} seconds.")
 
 # ------------------------------------------------------------------------------
 # 4) 将结果保存到 Excel 文件
@@ -87,3 +158,14 @@ df.to_excel(output_file, index=False)
 total_time = time.time() - start_time
 print(f"\nFinished processing {num_rows} rows in {total_time:.2f} seconds.")
 print(f"Output saved to {output_file}")
+
+# 每次调用的延迟指标（p50/p95/p99）及 JSON 报告
+get_metrics().print_summary()
+if cache is not None:
+    if not (use_batch_api or use_async_engine):
+        print(f"回复缓存: {num_rows} 行，命中缓存 {cache_stats['cache_hits']} 行"
+              f"（命中率 {cache.hit_rate():.1%}），实际调用 API {cache_stats['api_calls']} 次")
+    cache.close()
+get_metrics().write_report(metrics_path_for(output_file), {"script": "reply_gpt.py", "rows": num_rows,
+                                                          "reply_cache": cache_stats})
+print(f"Metrics report saved to {metrics_path_for(output_file)}")
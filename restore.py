@@ -2,25 +2,93 @@ import re
 import json
 import pandas as pd
 
+from mask_engine import Masker
+from privacy_vault import PrivacyVault
+from excel_stream import ExcelRowReader, ExcelRowWriter, cell_text
+
+# 列名
+col_reply_mask = "masked_reply"
+col_privacy_json = "storage_privacy.json"
+col_restored = "restored_reply"  # 新增列
+col_canonical_map = "canonical_map.json"
+
+# 用于匹配 reply_mask 中的 [xxxx]
+# 注意：如果占位符中可能存在更复杂的字符，需要适当调整
+pattern_placeholder = re.compile(r"\[[^\]]+\]")
+
+
+def restore_row(reply_text: str, privacy_str: str = None, map_str: str = None, originals: dict = None) -> str:
+    """
+    还原一行回复；DataFrame 模式和流式模式共用。
+    map_str: canonical_map.json 列的值，不为空时先把规范化占位符换回语料级占位符。
+    originals: 从保险库取出的本行 {占位符: 原始值}；为 None 时解析 privacy_str（storage_privacy.json 列）。
+    """
+    if map_str is not None and map_str not in ("None", "nan"):
+        reply_text = Masker(json.loads(map_str)).mask(reply_text)
+
+    if originals is not None:
+        # 单遍扫描替换；直接匹配完整占位符，
+        # "[mailto:[email address_5]]" 这样嵌套在方括号里的也能还原
+        return Masker(originals).mask(reply_text)
+
+    # 如果这行的 storage_privacy.json 为 "None"，则无需替换
+    if privacy_str == "None":
+        # 直接把 reply_mask 原样放到 restored_value
+        return reply_text
+
+    # 尝试将该列解析为 JSON 数组
+    try:
+        records = json.loads(privacy_str)
+    except json.JSONDecodeError:
+        # 解析失败，可能是格式问题；可根据实际需求做其他处理
+        return reply_text
+
+    # 在 reply_text 中查找所有占位符
+    placeholders = pattern_placeholder.findall(reply_text)
+    # placeholders 可能重复出现，如 ["[name_1]", "[name_1]", "[school_2]", ...]
+
+    # 按出现顺序依次替换
+    for ph in placeholders:
+        # 在当前记录数组中查找 replacedValue == ph 的项
+        # 可能不止一个，但一般而言只会有一个匹配
+        match_item = next((item for item in records if item.get("replacedValue") == ph), None)
+        if match_item:
+            original_val = match_item.get("originalValue", "")
+            # 将 reply_text 中的该占位符替换为 originalValue
+            reply_text = reply_text.replace(ph, original_val)
+
+    return reply_text
+
+
+def _check_columns(columns, vault, canonical):
+    if vault is not None:
+        if col_reply_mask not in columns:
+            raise ValueError(f"Excel中缺少 {col_reply_mask} 列。")
+    elif col_reply_mask not in columns or col_privacy_json not in columns:
+        raise ValueError(f"Excel中缺少 {col_reply_mask} 或 {col_privacy_json} 列。")
+    if canonical and col_canonical_map not in columns:
+        raise ValueError(f"Excel中缺少 {col_canonical_map} 列。")
+
+
 def restore_reply(
     input_excel_path="gemma27b/with_remote_reply.xlsx",
-    output_excel_path="gemma27b/restored_reply.xlsx"
+    output_excel_path="gemma27b/restored_reply.xlsx",
+    vault_path=None,
+    canonical=False
 ):
+    """
+    vault_path 不为空时，按 (行号, 占位符) 从隐私值保险库（见 privacy_vault.py）查找原始值，
+    不再解析 storage_privacy.json 列；此时输入只需要 masked_reply 列。
+    canonical=True 表示回复是针对 canonical_prompt 生成的：先按 canonical_map.json 列
+    把规范化占位符换回语料级占位符，再照常还原。
+    """
     # 1. 读取 Excel
     print("读取文件:", input_excel_path)
     df = pd.read_excel(input_excel_path)
 
     # 确保存在所需列
-    col_reply_mask = "masked_reply"
-    col_privacy_json = "storage_privacy.json"
-    col_restored = "restored_reply"  # 新增列
-
-    if col_reply_mask not in df.columns or col_privacy_json not in df.columns:
-        raise ValueError(f"Excel中缺少 {col_reply_mask} 或 {col_privacy_json} 列。")
-
-    # 用于匹配 reply_mask 中的 [xxxx]
-    # 注意：如果占位符中可能存在更复杂的字符，需要适当调整
-    pattern_placeholder = re.compile(r"\[[^\]]+\]")
+    vault = PrivacyVault(vault_path) if vault_path else None
+    _check_columns(df.columns, vault, canonical)
 
     total_rows = len(df)
     print(f"共 {total_rows} 行，开始处理占位符替换...")
@@ -30,39 +98,15 @@ def restore_reply(
         if idx % 50 == 0:
             print(f"正在处理第 {idx+1} / {total_rows} 行...")
 
-        reply_text = str(df.at[idx, col_reply_mask])  # reply_mask 的文本
-        privacy_str = str(df.at[idx, col_privacy_json])  # storage_privacy.json 的字符串
-
-        # 如果这行的 storage_privacy.json 为 "None"，则无需替换
-        if privacy_str == "None":
-            # 直接把 reply_mask 原样放到 restored_value
-            df.at[idx, col_restored] = reply_text
-            continue
-
-        # 尝试将该列解析为 JSON 数组
-        try:
-            records = json.loads(privacy_str)
-        except json.JSONDecodeError:
-            # 解析失败，可能是格式问题；可根据实际需求做其他处理
-            df.at[idx, col_restored] = reply_text
-            continue
-
-        # 在 reply_text 中查找所有占位符
-        placeholders = pattern_placeholder.findall(reply_text)
-        # placeholders 可能重复出现，如 ["[name_1]", "[name_1]", "[school_2]", ...]
-
-        # 按出现顺序依次替换
-        for ph in placeholders:
-            # 在当前记录数组中查找 replacedValue == ph 的项
-            # 可能不止一个，但一般而言只会有一个匹配
-            match_item = next((item for item in records if item.get("replacedValue") == ph), None)
-            if match_item:
-                original_val = match_item.get("originalValue", "")
-                # 将 reply_text 中的该占位符替换为 originalValue
-                reply_text = reply_text.replace(ph, original_val)
-
-        # 将最终替换完的结果写入
-        df.at[idx, col_restored] = reply_text
+        df.at[idx, col_restored] = restore_row(
+            str(df.at[idx, col_reply_mask]),  # reply_mask 的文本
+            str(df.at[idx, col_privacy_json]) if vault is None else None,  # storage_privacy.json 的字符串
+            str(df.at[idx, col_canonical_map]) if canonical else None,
+            vault.row_map(idx) if vault is not None else None
+        )
+
+    if vault is not None:
+        vault.close()
 
     # 2. 写出新的 Excel
     print("全部处理完成，写出结果到:", output_excel_path)
@@ -70,5 +114,41 @@ def restore_reply(
     print("处理结束。")
 
 
+def restore_reply_streaming(
+    input_excel_path="gemma27b/with_remote_reply.xlsx",
+    output_excel_path="gemma27b/restored_reply.xlsx",
+    vault_path=None,
+    canonical=False
+):
+    """
+    与 restore_reply 相同，但逐行读取、逐行写出（见 excel_stream.py），内存占用与行数无关。
+    """
+    print("流式读取文件:", input_excel_path)
+    vault = PrivacyVault(vault_path) if vault_path else None
+    with ExcelRowReader(input_excel_path) as reader:
+        _check_columns(reader.header, vault, canonical)
+        reply_pos = reader.header.index(col_reply_mask)
+        privacy_pos = reader.header.index(col_privacy_json) if vault is None else None
+        map_pos = reader.header.index(col_canonical_map) if canonical else None
+
+        with ExcelRowWriter(output_excel_path, reader.header, (col_restored,)) as writer:
+            for row in reader:
+                idx = writer.rows
+                if idx % 1000 == 0:
+                    print(f"正在处理第 {idx+1} 行...")
+                restored = restore_row(
+                    cell_text(row[reply_pos]),
+                    cell_text(row[privacy_pos]) if privacy_pos is not None else None,
+                    cell_text(row[map_pos]) if map_pos is not None else None,
+                    vault.row_map(idx) if vault is not None else None
+                )
+                writer.write(row, {col_restored: restored})
+            print(f"共 {writer.rows} 行，写出结果到:", output_excel_path)
+
+    if vault is not None:
+        vault.close()
+    print("处理结束。")
+
+
 if __name__ == "__main__":
     restore_reply()
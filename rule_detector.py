@@ -0,0 +1,157 @@
+import re
+import threading
+
+# ------------------------------------------------------------------------------
+# 规则检测（在调用 LLM 之前运行）
+# ------------------------------------------------------------------------------
+# 邮箱、电话、日期/时间、金额、URL 用预编译的正则即可找到，不需要 LLM。
+# 输出与 LLM 相同的 "key": "value" 内联格式，mask_prompt.process_restore_excel
+# 可以直接解析。若一行在去掉规则命中的内容后不再含有疑似人名/机构名（大写词）
+# 或长数字，则认为规则已经覆盖全部敏感信息，跳过 LLM 调用。
+
+_MONTHS = (r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|"
+           r"Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)")
+_WEEKDAYS = r"(?:Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)day"
+
+# 按优先级排列：先匹配的规则先占用文本区间，后面的规则不会在其中再次匹配
+RULES = [
+    ("URL", re.compile(r"\b(?:https?://|www\.)[^\s<>\"]+[^\s<>\".,;:!?)\]]")),
+    ("Email Address", re.compile(r"\b[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}\b")),
+    ("money", re.compile(
+        r"(?:[$€£]\s?\d[\d,]*(?:\.\d+)?(?:\s?(?:million|billion|thousand|(?-i:[MBK]))\b)?"
+        r"|\b\d[\d,]*(?:\.\d+)?\s?(?:dollars|USD)\b)", re.IGNORECASE)),
+    ("Phone Number", re.compile(
+        r"(?:\+?1[\s.\-]?)?(?:\(\d{3}\)\s?|\b\d{3}[\s.\-])\d{3}[\s.\-]\d{4}\b"
+        r"(?:\s?(?:x|ext\.?)\s?\d{1,5})?")),
+    ("important time", re.compile(
+        r"\b(?:\d{1,2}[/\-]\d{1,2}[/\-]\d{2,4}"
+        r"|\d{4}-\d{2}-\d{2}"
+        rf"|{_MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?(?:,?\s+\d{{4}})?"
+        rf"|\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTHS}(?:,?\s+\d{{4}})?"
+        rf"|{_WEEKDAYS}"
+        r"|\d{1,2}:\d{2}(?:\s?(?:[AaPp]\.[Mm]\.|[AaPp][Mm]\b))?"
+        r"|\d{1,2}\s?(?:[AaPp]\.[Mm]\.|[AaPp][Mm]\b))"
+        r"(?!\w)")),
+]
+
+# 剩余文本中出现的大写词视为疑似人名/机构名（宁可多调用 LLM，也不漏检）；
+# 以下常见的句首词、称呼和邮件头字段除外
+_COMMON_CAPITALIZED = {
+    "I", "I'm", "I'll", "I've", "I'd", "OK", "Ok", "FYI", "ASAP", "PM", "AM",
+    "Hi", "Hello", "Dear", "Thanks", "Thank", "Regards", "Best", "Sincerely", "Cheers", "Please",
+    "Re", "RE", "Fw", "FW", "Fwd", "Subject", "To", "From", "Cc", "CC", "Sent", "Original", "Message",
+    "The", "This", "That", "These", "Those", "A", "An", "We", "You", "He", "She", "It", "They",
+    "My", "Our", "Your", "His", "Her", "Their", "Its", "Let", "Let's", "Can", "Could", "Would",
+    "Will", "Should", "Do", "Does", "Did", "Is", "Are", "Was", "Were", "Have", "Has", "Had",
+    "If", "When", "What", "Where", "Why", "How", "Who", "Which", "And", "But", "Or", "So",
+    "Also", "Yes", "No", "Not", "As", "At", "In", "On", "For", "Of", "With", "By", "Here",
+    "There", "All", "Any", "Some", "Just", "Attached", "See", "Call", "Sure", "Great", "Good",
+    "Hope", "Sounds", "Note", "Looking", "After", "Before", "Once", "Since", "Because",
+}
+_CAPITALIZED = re.compile(r"\b[A-Z][A-Za-z'\-]*")
+_PROPER_WORD = r"[A-Z][a-z][A-Za-z'\-]*"
+_PROPER_NOUN_RUN = re.compile(rf"\b{_PROPER_WORD}(?:[ \t]+(?:[A-Z]\.?[ \t]+)?{_PROPER_WORD})+")
+_LONG_NUMBER = re.compile(r"\d{3,}")
+
+
+def find_spans(text: str) -> list:
+    """返回不重叠的规则命中 [(start, end, key, value), ...]，按出现位置排序"""
+    taken = []
+    spans = []
+    for key, pattern in RULES:
+        for m in pattern.finditer(text):
+            start, end = m.span()
+            if any(start < t_end and end > t_start for t_start, t_end in taken):
+                continue
+            taken.append((start, end))
+            spans.append((start, end, key, m.group(0)))
+    spans.sort()
+    return spans
+
+
+def rewrite_with_pairs(text: str, spans: list) -> str:
+    """把命中的内容替换为 "key": "value"，其余文本保持不变（与 PROMPT_TEMPLATE_8 输出格式一致）"""
+    parts = []
+    last = 0
+    for start, end, key, value in spans:
+        parts.append(text[last:start])
+        parts.append(f'"{key}": "{value}"')
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def needs_llm(text: str, spans: list) -> bool:
+    """去掉规则命中后，剩余文本是否仍可能含有规则覆盖不到的敏感信息"""
+    residual = list(text)
+    for start, end, _, _ in spans:
+        residual[start:end] = [" "] * (end - start)
+    residual = "".join(residual)
+
+    if _LONG_NUMBER.search(residual):
+        return True
+    return any(m.group(0) not in _COMMON_CAPITALIZED for m in _CAPITALIZED.finditer(residual))
+
+
+def unmasked_proper_nouns(text: str, values: list) -> list:
+    """
+    去掉已检测出的 values 后，剩余文本中仍然出现的疑似人名/机构名：
+    同一行内连续两个及以上首字母大写的词（允许中间夹一个 "K." 这样的缩写），
+    去掉常见词后至少还剩两个词。单个大写词（句首词、ECT/HOU 这样的缩写、会议标题里的词）
+    在邮件里太常见，不计入。
+    """
+    residual = text
+    for value in sorted(values, key=len, reverse=True):
+        if value:
+            residual = residual.replace(value, " ")
+    runs = []
+    for m in _PROPER_NOUN_RUN.finditer(residual):
+        words = [w for w in m.group(0).split() if w not in _COMMON_CAPITALIZED and len(w.rstrip(".")) > 1]
+        if len(words) >= 2:
+            runs.append(" ".join(words))
+    return runs
+
+
+def detect(text: str) -> dict:
+    """
+    对一封邮件做规则检测，返回:
+    {"text": 内联 "key": "value" 格式的文本（无命中时为 "None"）,
+     "pairs": [{"key", "value"}, ...], "needs_llm": bool}
+    """
+    spans = find_spans(text)
+    return {
+        "text": rewrite_with_pairs(text, spans) if spans else "None",
+        "pairs": [{"key": key, "value": value} for _, _, key, value in spans],
+        "needs_llm": needs_llm(text, spans),
+    }
+
+
+class RuleFastPath:
+    """
+    包装 call_fn(model_name, email_body) -> dict：规则能覆盖全部敏感信息的行直接返回规则结果，
+    不调用 LLM；否则照常调用 call_fn。avoided / total 统计节省的 LLM 调用次数。
+    """
+
+    def __init__(self, call_fn):
+        self.call_fn = call_fn
+        self.total = 0
+        self.avoided = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model_name: str, email_body: str) -> dict:
+        rule_result = detect(email_body)
+        with self._lock:
+            self.total += 1
+            if not rule_result["needs_llm"]:
+                self.avoided += 1
+        if rule_result["needs_llm"]:
+            return self.call_fn(model_name, email_body)
+        return {
+            "model": model_name,
+            "text": rule_result["text"],
+            "rule_only": True,
+            "prompt_eval_count": 0,
+            "eval_count": 0,
+            "total_duration": 0,
+            "load_duration": 0,
+        }
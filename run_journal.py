@@ -0,0 +1,72 @@
+import os
+import json
+
+# ------------------------------------------------------------------------------
+# 追加写日志（JSONL）+ 断点续跑
+# ------------------------------------------------------------------------------
+# 每完成一个 (行号, 模型) 就追加一行 JSON，写入成本与已处理行数无关；
+# 重启时读取日志，跳过已完成的 (行号, 模型)，最后再一次性生成 Excel。
+# 出错的结果（带 "error"）也会写入日志，但不算完成，续跑时会重新处理。
+# 如需从头重新跑，删除对应的 .journal.jsonl 文件即可。
+
+
+def journal_path_for(output_file: str) -> str:
+    """all/xxx.xlsx -> all/xxx.journal.jsonl"""
+    return os.path.splitext(output_file)[0] + ".journal.jsonl"
+
+
+class RunJournal:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = self._load()
+        self._fh = open(path, "a", encoding="utf-8")
+        # 上次崩溃可能留下没有换行的半行，先补一个换行，避免新记录接在它后面
+        if self._fh.tell() > 0 and not self._ends_with_newline():
+            self._fh.write("\n")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self) -> dict:
+        """读取已有日志，返回 {(行号, 模型名): 记录}；崩溃时写了一半的最后一行会被忽略"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[(record["row"], record["model"])] = record
+        return records
+
+    def append(self, row_idx: int, model_name: str, result: dict):
+        record = {"row": int(row_idx), "model": model_name}
+        record.update({k: v for k, v in result.items() if k != "model"})
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        self.records[(record["row"], model_name)] = record
+
+    def is_done(self, row_idx: int, model_name: str) -> bool:
+        record = self.records.get((int(row_idx), model_name))
+        return record is not None and not record.get("error")
+
+    def row_done(self, row_idx: int, model_list: list) -> bool:
+        return all(self.is_done(row_idx, m) for m in model_list)
+
+    def first_incomplete_row(self, row_indices: list, model_list: list):
+        """返回第一个尚未全部完成的行号；全部完成时返回 None"""
+        for idx in row_indices:
+            if not self.row_done(idx, model_list):
+                return idx
+        return None
+
+    def close(self):
+        self._fh.close()
@@ -0,0 +1,611 @@
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from collections import deque, OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ------------------------------------------------------------------------------
+# 离线模拟后端：Ollama / OpenAI chat-completions / Anthropic messages
+# ------------------------------------------------------------------------------
+# 不需要真实模型或付费 API 就能跑完整条流水线，用来测流水线自身的开销和性能回归。
+# 支持：可配置的延迟分布（首 token 延迟 + 按 tokens/sec 生成）、流式输出、
+# 429 限流（带 Retry-After 和各家的 rate-limit 响应头）、随机 5xx、echo 或固定回复。
+# 同一 prompt 的延迟与输出由 (seed, prompt) 决定，多次运行结果一致。
+# 另外提供 OpenAI Batch API 的最小实现（/v1/files、/v1/batches），batch 中每条请求按
+# 与实时接口相同的规则决定成功或失败（--error-rate / --rate-limit-rate），失败的进入 error 文件。
+#
+# 启动：
+#   python stub_server.py --port 11434 --latency lognormal:-1.5,0.5 --tokens-per-sec 80
+#   python stub_server.py --port 8089 --rpm 60 --tpm 40000 --output canned --canned replies.json
+#
+# 让各脚本指向模拟后端（环境变量）：
+#   Ollama   （privacy_detect_local.py, reply.py, bench_detection.py）
+#            OLLAMA_HOST=http://localhost:11434   或 OLLAMA_HOSTS=http://localhost:11434,http://localhost:11435
+#   OpenAI   （reply_gpt.py, merge.py, gpt_label.py；openai 0.x 读取 OPENAI_API_BASE）
+#            OPENAI_API_BASE=http://localhost:8089/v1 OPENAI_API_KEY=stub
+#   Anthropic（judge_claude.py；anthropic SDK 读取 ANTHROPIC_BASE_URL）
+#            ANTHROPIC_BASE_URL=http://localhost:8089 ANTHROPIC_API_KEY=stub
+# 同一个端口同时提供三种接口。
+
+LATENCY_KINDS = ("fixed", "uniform", "normal", "lognormal")
+OUTPUT_MODES = ("echo", "canned", "none")
+
+
+def parse_latency(spec: str):
+    """
+    "fixed:0.2" / "uniform:0.05,0.3" / "normal:0.2,0.05" / "lognormal:-1.5,0.5"（秒）
+    返回 sample(rng) -> 秒（不小于 0）
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()]
+    if kind not in LATENCY_KINDS:
+        raise ValueError(f"未知的延迟分布: {kind}，可选 {LATENCY_KINDS}")
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    return lambda rng: rng.lognormvariate(values[0], values[1])
+
+
+def count_tokens(text: str) -> int:
+    """粗略的 token 数：按空白切分"""
+    return len(text.split())
+
+
+def empty_instance(schema: dict):
+    """按 JSON Schema 生成最小的合法实例（Ollama 的 format 参数，例如 spans 模式）"""
+    kind = schema.get("type")
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {key: empty_instance(props.get(key, {})) for key in schema.get("required", [])}
+    return {"array": [], "string": "", "number": 0, "integer": 0, "boolean": False}.get(kind)
+
+
+class RateLimiter:
+    """60 秒滑动窗口内的请求数 (rpm) 与 token 数 (tpm) 上限；0 表示不限制"""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events = deque()  # (时间, token 数)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> tuple:
+        """返回 (是否放行, 需要等待的秒数, 剩余请求数, 剩余 token 数)"""
+        now = time.time()
+        with self._lock:
+            while self._events and now - self._events[0][0] >= 60:
+                self._events.popleft()
+            used_requests = len(self._events)
+            used_tokens = sum(t for _, t in self._events)
+            over_rpm = self.rpm and used_requests + 1 > self.rpm
+            over_tpm = self.tpm and used_tokens + tokens > self.tpm
+            if over_rpm or over_tpm:
+                wait = 60 - (now - self._events[0][0]) if self._events else 1.0
+                return False, max(wait, 0.001), max(self.rpm - used_requests, 0), max(self.tpm - used_tokens, 0)
+            self._events.append((now, tokens))
+            return True, 0.0, self.rpm - used_requests - 1, self.tpm - used_tokens - tokens
+
+
+class StubBackend:
+    """模拟后端的全部配置与状态；HTTP 处理器通过 server.backend 访问"""
+
+    def __init__(self, latency: str = "fixed:0.05", tokens_per_sec: float = 0, output: str = "echo",
+                 canned: list = None, echo_after: str = None, rpm: int = 0, tpm: int = 0,
+                 rate_limit_rate: float = 0.0, error_rate: float = 0.0, retry_after: float = 1.0,
+                 seed: int = 0, batch_delay: float = 1.0, max_tracked_prompts: int = 100000):
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"未知的输出方式: {output}，可选 {OUTPUT_MODES}")
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.output = output
+        self.canned = canned or ["None"]
+        self.echo_after = echo_after
+        self.limiter = RateLimiter(rpm, tpm)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.requests = 0
+        # prompt 的摘要 -> 该 prompt 收到的请求次数；只保留最近 max_tracked_prompts 个 prompt，
+        # 长时间压测时内存不随请求数增长（被淘汰的 prompt 再次出现时从第 1 次请求算起）
+        self.attempts = OrderedDict()
+        self.max_tracked_prompts = max_tracked_prompts
+        self.throttled = 0
+        self.batch_delay = batch_delay
+        self.files = {}     # file_id -> {"meta": 文件对象, "content": bytes}
+        self.batches = {}   # batch_id -> batch 对象
+        self._lock = threading.Lock()
+
+    def rng_for(self, prompt: str) -> random.Random:
+        return random.Random(f"{self.seed}:{prompt}")
+
+    def reply_for(self, prompt: str, rng: random.Random) -> str:
+        if self.output == "none":
+            return "None"
+        if self.output == "canned":
+            return self.canned[rng.randrange(len(self.canned))]
+        if self.echo_after and self.echo_after in prompt:
+            return prompt.rsplit(self.echo_after, 1)[1].strip()
+        return prompt
+
+    def plan(self, prompt: str) -> dict:
+        """决定一次请求的结果：放行 / 429 / 500，以及回复文本和各阶段耗时"""
+        rng = self.rng_for(prompt)
+        prompt_tokens = count_tokens(prompt)
+        with self._lock:
+            self.requests += 1
+            digest = hashlib.sha1(prompt.encode("utf-8")).digest()
+            attempt = self.attempts.pop(digest, 0) + 1
+            self.attempts[digest] = attempt
+            if len(self.attempts) > self.max_tracked_prompts:
+                self.attempts.popitem(last=False)
+        # 随机故障由 (seed, prompt, 该 prompt 的第几次请求) 决定：与其他请求的到达顺序无关，
+        # 同样的输入每次运行故障都相同，同一 prompt 重试时也不会永远失败
+        fault_rng = random.Random(f"{self.seed}:{prompt}:{attempt}")
+        if self.error_rate and fault_rng.random() < self.error_rate:
+            return {"status": 500}
+        allowed, wait, remaining_requests, remaining_tokens = self.limiter.acquire(prompt_tokens)
+        if not allowed or (self.rate_limit_rate and fault_rng.random() < self.rate_limit_rate):
+            with self._lock:
+                self.throttled += 1
+            return {"status": 429, "retry_after": wait if not allowed else self.retry_after,
+                    "remaining_requests": remaining_requests, "remaining_tokens": remaining_tokens}
+        text = self.reply_for(prompt, rng)
+        output_tokens = count_tokens(text)
+        return {
+            "status": 200,
+            "text": text,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "ttft": self.sample_latency(rng),
+            "per_token": 1 / self.tokens_per_sec if self.tokens_per_sec else 0.0,
+            "remaining_requests": remaining_requests,
+            "remaining_tokens": remaining_tokens,
+        }
+
+
+    # -------------------------- Batch API --------------------------
+    def add_file(self, content: bytes, purpose: str, filename: str) -> dict:
+        file_id = "file-" + uuid.uuid4().hex[:24]
+        meta = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose}
+        with self._lock:
+            self.files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, payload: dict) -> dict:
+        batch_id = "batch_" + uuid.uuid4().hex[:24]
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": payload.get("endpoint"),
+            "input_file_id": payload.get("input_file_id"),
+            "completion_window": payload.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "completed_at": None, "metadata": payload.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch_id: str):
+        """batch_delay 秒后一次性完成整个 batch；成功与失败的请求分别写入 output / error 文件"""
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(requests)
+        time.sleep(self.batch_delay)
+
+        outputs, errors = [], []
+        for request in requests:
+            body = request.get("body", {})
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user")
+            plan = self.plan(prompt)
+            line = {"id": "batch_req_" + uuid.uuid4().hex[:24], "custom_id": request.get("custom_id"), "error": None}
+            if plan["status"] != 200:
+                line["response"] = {"status_code": plan["status"], "request_id": uuid.uuid4().hex,
+                                    "body": {"error": {"message": "simulated failure", "type": "server_error"}}}
+                errors.append(line)
+                continue
+            line["response"] = {
+                "status_code": 200, "request_id": uuid.uuid4().hex,
+                "body": {
+                    "id": "chatcmpl-" + uuid.uuid4().hex[:24], "object": "chat.completion",
+                    "created": int(time.time()), "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": plan["text"]},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": plan["prompt_tokens"], "completion_tokens": plan["output_tokens"],
+                              "total_tokens": plan["prompt_tokens"] + plan["output_tokens"]},
+                },
+            }
+            outputs.append(line)
+
+        def to_file(items, kind):
+            if not items:
+                return None
+            content = "".join(json.dumps(item) + "\n" for item in items).encode("utf-8")
+            return self.add_file(content, "batch_output", f"{batch_id}_{kind}.jsonl")["id"]
+
+        batch["output_file_id"] = to_file(outputs, "output")
+        batch["error_file_id"] = to_file(errors, "error")
+        batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+
+def _pieces(text: str) -> list:
+    """流式输出的分块：按空白切分并保留空白，拼接后与原文相同"""
+    parts = []
+    current = ""
+    for ch in text:
+        current += ch
+        if ch.isspace():
+            parts.append(current)
+            current = ""
+    if current:
+        parts.append(current)
+    return parts
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def backend(self) -> StubBackend:
+        return self.server.backend
+
+    # -------------------------- 响应工具 --------------------------
+    def _send_json(self, status: int, data: dict, headers: dict = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type: str, headers: dict = None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_payload(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _rate_limit_headers(self, api: str, plan: dict) -> dict:
+        """只发送设置了上限（非 0）的那几项，与真实服务不会报告 "上限 0" 一致"""
+        limiter = self.backend.limiter
+        reset = plan.get("retry_after", 0.0)
+        headers = {}
+        if api == "openai":
+            for name, limit, remaining in (("requests", limiter.rpm, plan["remaining_requests"]),
+                                           ("tokens", limiter.tpm, plan["remaining_tokens"])):
+                if limit:
+                    headers[f"x-ratelimit-limit-{name}"] = limit
+                    headers[f"x-ratelimit-remaining-{name}"] = remaining
+                    headers[f"x-ratelimit-reset-{name}"] = f"{reset:.3f}s"
+        elif api == "anthropic":
+            reset_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + reset))
+            for name, limit, remaining in (("requests", limiter.rpm, plan["remaining_requests"]),
+                                           ("tokens", limiter.tpm, plan["remaining_tokens"])):
+                if limit:
+                    headers[f"anthropic-ratelimit-{name}-limit"] = limit
+                    headers[f"anthropic-ratelimit-{name}-remaining"] = remaining
+                    headers[f"anthropic-ratelimit-{name}-reset"] = reset_at
+        return headers
+
+    def _reject(self, api: str, plan: dict) -> bool:
+        """429 / 500 时直接回复错误并返回 True"""
+        if plan["status"] == 500:
+            self._send_json(500, {"error": {"type": "server_error", "message": "simulated server error"}})
+            return True
+        if plan["status"] == 429:
+            headers = self._rate_limit_headers(api, plan)
+            headers["Retry-After"] = max(1, math.ceil(plan["retry_after"]))
+            headers["retry-after-ms"] = int(plan["retry_after"] * 1000)
+            self._send_json(429, {"error": {"type": "rate_limit_error", "message": "simulated rate limit"}},
+                            headers)
+            return True
+        return False
+
+    # -------------------------- 路由 --------------------------
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json(200, {"version": "stub"})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": []})
+        elif self.path.startswith("/v1/batches/"):
+            batch = self.backend.batches.get(self.path.split("/")[3])
+            if batch is None:
+                self._send_json(404, {"error": {"message": "batch not found"}})
+            else:
+                self._send_json(200, batch)
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            stored = self.backend.files.get(self.path.split("/")[3])
+            if stored is None:
+                self._send_json(404, {"error": {"message": "file not found"}})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(stored["content"])))
+            self.end_headers()
+            self.wfile.write(stored["content"])
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/v1/files":
+            self._upload_file()
+            return
+        try:
+            payload = self._read_payload()
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        routes = {
+            "/api/generate": self._ollama,
+            "/api/chat": self._ollama,
+            "/v1/chat/completions": self._openai,
+            "/chat/completions": self._openai,
+            "/v1/messages": self._anthropic,
+            "/v1/batches": lambda payload: self._send_json(200, self.backend.create_batch(payload)),
+        }
+        handler = routes.get(self.path.split("?")[0])
+        if handler is None:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        handler(payload)
+
+    def _upload_file(self):
+        """multipart/form-data 上传（字段 purpose 与 file），与 OpenAI 文件接口相同"""
+        length = int(self.headers.get("Content-Length", 0))
+        head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode()
+        message = BytesParser(policy=HTTP).parsebytes(head + self.rfile.read(length))
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = (
+                part.get_filename(), part.get_payload(decode=True)
+            )
+        if "file" not in fields:
+            self._send_json(400, {"error": {"message": "missing file"}})
+            return
+        filename, content = fields["file"]
+        purpose = (fields.get("purpose", (None, b"batch"))[1] or b"").decode()
+        self._send_json(200, self.backend.add_file(content, purpose, filename or "upload.jsonl"))
+
+    # -------------------------- Ollama --------------------------
+    def _ollama(self, payload: dict):
+        model = payload.get("model", "stub")
+        is_chat = self.path.startswith("/api/chat")
+        if is_chat:
+            prompt = (payload.get("messages") or [{}])[-1].get("content", "")
+        else:
+            prompt = payload.get("prompt")
+        if not prompt:
+            # 空 prompt：Ollama 只加载（或 keep_alive=0 时卸载）模型
+            self._send_json(200, {"model": model, "response": "", "done": True, "load_duration": 0,
+                                  "total_duration": 0})
+            return
+        if payload.get("system"):
+            prompt = payload["system"] + "\n" + prompt
+
+        plan = self.backend.plan(prompt)
+        if self._reject("ollama", plan):
+            return
+        if payload.get("format"):
+            schema = payload["format"] if isinstance(payload["format"], dict) else {"type": "object"}
+            plan["text"] = json.dumps(empty_instance(schema))
+            plan["output_tokens"] = count_tokens(plan["text"])
+
+        eval_s = plan["per_token"] * plan["output_tokens"]
+        final = {
+            "model": model,
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": plan["prompt_tokens"],
+            "eval_count": plan["output_tokens"],
+            "prompt_eval_duration": int(plan["ttft"] * 1e9),
+            "eval_duration": int(eval_s * 1e9),
+            "load_duration": 0,
+            "total_duration": int((plan["ttft"] + eval_s) * 1e9),
+        }
+
+        def content(text):
+            return {"message": {"role": "assistant", "content": text}} if is_chat else {"response": text}
+
+        if not payload.get("stream", True):
+            time.sleep(plan["ttft"] + eval_s)
+            self._send_json(200, dict(final, **content(plan["text"])))
+            return
+
+        self._start_chunked("application/x-ndjson")
+        time.sleep(plan["ttft"])
+        try:
+            for piece in _pieces(plan["text"]):
+                self._write_chunk((json.dumps(dict(model=model, done=False, **content(piece))) + "\n").encode())
+                time.sleep(plan["per_token"])
+            self._write_chunk((json.dumps(dict(final, **content(""))) + "\n").encode())
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（例如流式检测遇到 None 提前终止）
+            self.close_connection = True
+
+    # -------------------------- OpenAI --------------------------
+    def _openai(self, payload: dict):
+        model = payload.get("model", "stub")
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []) if m.get("role") == "user")
+        plan = self.backend.plan(prompt)
+        if self._reject("openai", plan):
+            return
+        headers = self._rate_limit_headers("openai", plan)
+        completion_id = "chatcmpl-" + uuid.uuid4().hex[:24]
+        created = int(time.time())
+        usage = {"prompt_tokens": plan["prompt_tokens"], "completion_tokens": plan["output_tokens"],
+                 "total_tokens": plan["prompt_tokens"] + plan["output_tokens"]}
+
+        if not payload.get("stream"):
+            time.sleep(plan["ttft"] + plan["per_token"] * plan["output_tokens"])
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": plan["text"]},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }, headers)
+            return
+
+        def event(delta, finish_reason=None):
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        self._start_chunked("text/event-stream", headers)
+        time.sleep(plan["ttft"])
+        try:
+            self._write_chunk(event({"role": "assistant", "content": ""}))
+            for piece in _pieces(plan["text"]):
+                self._write_chunk(event({"content": piece}))
+                time.sleep(plan["per_token"])
+            self._write_chunk(event({}, "stop"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    # -------------------------- Anthropic --------------------------
+    def _anthropic(self, payload: dict):
+        model = payload.get("model", "stub")
+        prompt = "\n".join(
+            m["content"] if isinstance(m.get("content"), str)
+            else "".join(block.get("text", "") for block in m.get("content", []))
+            for m in payload.get("messages", []) if m.get("role") == "user"
+        )
+        plan = self.backend.plan(prompt)
+        if self._reject("anthropic", plan):
+            return
+        headers = self._rate_limit_headers("anthropic", plan)
+        message_id = "msg_" + uuid.uuid4().hex[:24]
+        usage = {"input_tokens": plan["prompt_tokens"], "output_tokens": plan["output_tokens"]}
+
+        if not payload.get("stream"):
+            time.sleep(plan["ttft"] + plan["per_token"] * plan["output_tokens"])
+            self._send_json(200, {
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": plan["text"]}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": usage,
+            }, headers)
+            return
+
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps(dict(type=name, **data))}\n\n".encode()
+
+        self._start_chunked("text/event-stream", headers)
+        time.sleep(plan["ttft"])
+        try:
+            self._write_chunk(event("message_start", {"message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+                "stop_reason": None, "usage": {"input_tokens": plan["prompt_tokens"], "output_tokens": 0}}}))
+            self._write_chunk(event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}))
+            for piece in _pieces(plan["text"]):
+                self._write_chunk(event("content_block_delta", {"index": 0,
+                                                                "delta": {"type": "text_delta", "text": piece}}))
+                time.sleep(plan["per_token"])
+            self._write_chunk(event("content_block_stop", {"index": 0}))
+            self._write_chunk(event("message_delta", {"delta": {"stop_reason": "end_turn"},
+                                                      "usage": {"output_tokens": plan["output_tokens"]}}))
+            self._write_chunk(event("message_stop", {}))
+            self._end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def start_server(port: int = 0, host: str = "127.0.0.1", **backend_kwargs) -> ThreadingHTTPServer:
+    """在后台线程启动模拟后端（测试脚本使用）；port=0 时自动分配，实际端口见 server.server_port"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.backend = StubBackend(**backend_kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama / OpenAI / Anthropic 离线模拟后端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", default="fixed:0.05",
+                        help="首 token 延迟分布（秒）：fixed:0.2 / uniform:a,b / normal:mean,std / lognormal:mu,sigma")
+    parser.add_argument("--tokens-per-sec", type=float, default=0, help="生成速度，0 表示不模拟生成耗时")
+    parser.add_argument("--output", choices=OUTPUT_MODES, default="echo",
+                        help="echo 返回 prompt；canned 从 --canned 文件中选一条；none 返回 \"None\"")
+    parser.add_argument("--canned", help="JSON 文件：字符串列表（按 prompt 哈希固定选取）")
+    parser.add_argument("--echo-after", help="echo 时只返回 prompt 中最后一次出现该标记之后的部分")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求数上限，超过返回 429")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟 prompt token 数上限，超过返回 429")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="随机返回 429 的比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="随机 429 的 Retry-After 秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="Batch API 每个 batch 完成前的等待秒数")
+    parser.add_argument("--max-tracked-prompts", type=int, default=100000,
+                        help="记录请求次数（决定重试时的随机故障）的 prompt 个数上限，超过时淘汰最久未出现的")
+    args = parser.parse_args()
+
+    canned = None
+    if args.canned:
+        with open(args.canned, "r", encoding="utf-8") as f:
+            canned = json.load(f)
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    server.backend = StubBackend(
+        latency=args.latency, tokens_per_sec=args.tokens_per_sec, output=args.output, canned=canned,
+        echo_after=args.echo_after, rpm=args.rpm, tpm=args.tpm, rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed,
+        batch_delay=args.batch_delay, max_tracked_prompts=args.max_tracked_prompts,
+    )
+    print(f"模拟后端已启动: http://{args.host}:{args.port}（Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"共 {server.backend.requests} 次请求，其中限流 {server.backend.throttled} 次。")
+
+
+if __name__ == "__main__":
+    main()